@@ -0,0 +1,173 @@
+"""Agregados multi-resolución de las series diarias en un solo recorrido.
+
+`agregar` recorre una vez las fechas y las columnas (precipitación,
+temperatura, evapotranspiración, riesgo diario, ...) y acumula suma, media,
+mínimo y máximo de cada variable por semana ISO, mes, temporada hidrológica
+y año. Las fechas no se convierten con `strptime`: año, mes y día salen de
+la cadena ISO y la semana se calcula con aritmética de ordinales.
+
+Temporadas hidrológicas (año hidrológico de noviembre a octubre, etiquetado
+con el año en que termina):
+- estiaje: noviembre a mayo  → '2024-estiaje' = nov 2023 .. may 2024
+- lluvias: junio a octubre   → '2024-lluvias' = jun .. oct 2024
+
+`CacheAgregados` guarda los resultados por versión de la serie (municipio,
+primera y última fecha, número de días): los datos del archivo no cambian una
+vez guardados, así que la misma versión siempre produce los mismos agregados.
+"""
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import Any, Callable, Dict, Hashable, List, Sequence
+
+RESOLUCIONES = ('semanal', 'mensual', 'estacional', 'anual')
+MES_INICIO_LLUVIAS = 6
+MES_INICIO_ESTIAJE = 11
+
+_DIAS_ANTES_DEL_MES = (0, 0, 31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334)
+
+
+def _ordinal(anio: int, mes: int, dia: int) -> int:
+    """Igual que date(anio, mes, dia).toordinal(), sin crear el objeto."""
+    a = anio - 1
+    bisiesto = anio % 4 == 0 and (anio % 100 != 0 or anio % 400 == 0)
+    return (a * 365 + a // 4 - a // 100 + a // 400 + _DIAS_ANTES_DEL_MES[mes]
+            + (1 if bisiesto and mes > 2 else 0) + dia)
+
+
+def _temporada(anio: int, mes: int) -> str:
+    if MES_INICIO_LLUVIAS <= mes < MES_INICIO_ESTIAJE:
+        return f"{anio}-lluvias"
+    return f"{anio + 1 if mes >= MES_INICIO_ESTIAJE else anio}-estiaje"
+
+
+def _nuevo(k: int) -> List[float]:
+    return [0.0] + [0.0] * k + [float('inf')] * k + [float('-inf')] * k
+
+
+def _combinar(destino: List[float], origen: List[float], k: int):
+    destino[0] += origen[0]
+    for j in range(1, 1 + k):
+        destino[j] += origen[j]
+    for j in range(1 + k, 1 + 2 * k):
+        if origen[j] < destino[j]:
+            destino[j] = origen[j]
+    for j in range(1 + 2 * k, 1 + 3 * k):
+        if origen[j] > destino[j]:
+            destino[j] = origen[j]
+
+
+def agregar(fechas: Sequence[str], columnas: Dict[str, Sequence[float]],
+            resoluciones: Sequence[str] = RESOLUCIONES) -> Dict[str, List[Dict[str, Any]]]:
+    """Agregados de `columnas` ({nombre: valores diarios}) por resolución.
+
+    Devuelve {resolucion: [{'periodo', 'dias', nombre: {'suma', 'media',
+    'minimo', 'maximo'}, ...}, ...]} con los periodos en orden cronológico.
+    Las fechas deben venir ordenadas (como las entrega el almacén).
+
+    Sólo las semanas y los meses se acumulan día por día; las temporadas y
+    los años se combinan a partir de los meses."""
+    nombres = list(columnas)
+    valores = [columnas[n] for n in nombres]
+    k = len(nombres)
+    semanal = 'semanal' in resoluciones
+    # acumulador = [dias, sumas..., minimos..., maximos...]
+    meses: Dict[str, List[float]] = {}
+    semanas: Dict[str, List[float]] = {}
+    clave_mes = None
+    semana_lunes = None
+    acc_mes = acc_semana = None
+
+    for i, f in enumerate(fechas):
+        if f[:7] != clave_mes:
+            clave_mes = f[:7]
+            acc_mes = meses.get(clave_mes)
+            if acc_mes is None:
+                acc_mes = meses[clave_mes] = _nuevo(k)
+        en_curso = (acc_mes,)
+        if semanal:
+            ordinal = _ordinal(int(f[:4]), int(f[5:7]), int(f[8:10]))
+            lunes = ordinal - (ordinal - 1) % 7
+            if lunes != semana_lunes:
+                semana_lunes = lunes
+                iso = date.fromordinal(lunes).isocalendar()
+                clave_semana = f"{iso[0]}-W{iso[1]:02d}"
+                acc_semana = semanas.get(clave_semana)
+                if acc_semana is None:
+                    acc_semana = semanas[clave_semana] = _nuevo(k)
+            en_curso = (acc_mes, acc_semana)
+        for acc in en_curso:
+            acc[0] += 1
+            for j in range(k):
+                v = valores[j][i]
+                acc[1 + j] += v
+                if v < acc[1 + k + j]:
+                    acc[1 + k + j] = v
+                if v > acc[1 + 2 * k + j]:
+                    acc[1 + 2 * k + j] = v
+
+    acumuladores = {'semanal': semanas, 'mensual': meses, 'estacional': {}, 'anual': {}}
+    for mes, acc in meses.items():
+        for r, clave in (('estacional', _temporada(int(mes[:4]), int(mes[5:7]))), ('anual', mes[:4])):
+            destino = acumuladores[r].get(clave)
+            if destino is None:
+                destino = acumuladores[r][clave] = _nuevo(k)
+            _combinar(destino, acc, k)
+
+    resultado = {}
+    for r in resoluciones:
+        periodos = []
+        for periodo, acc in acumuladores[r].items():
+            dias = int(acc[0])
+            fila = {"periodo": periodo, "dias": dias}
+            for j, nombre in enumerate(nombres):
+                fila[nombre] = {
+                    "suma": acc[1 + j],
+                    "media": acc[1 + j] / dias,
+                    "minimo": acc[1 + k + j],
+                    "maximo": acc[1 + 2 * k + j],
+                }
+            periodos.append(fila)
+        resultado[r] = periodos
+    return resultado
+
+
+def redondear(agregados: Dict[str, List[Dict[str, Any]]], decimales: int = 2) -> Dict[str, List[Dict[str, Any]]]:
+    return {
+        r: [
+            {c: ({s: round(x, decimales) for s, x in v.items()} if isinstance(v, dict) else v)
+             for c, v in fila.items()}
+            for fila in periodos
+        ]
+        for r, periodos in agregados.items()
+    }
+
+
+class CacheAgregados:
+    """LRU de agregados por versión de serie, segura entre hilos."""
+
+    def __init__(self, maximo: int = 128):
+        self.maximo = maximo
+        self._datos: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._candado = threading.Lock()
+
+    @staticmethod
+    def version(municipio: str, fechas: Sequence[str], *extra: Hashable) -> Hashable:
+        return (municipio, fechas[0] if fechas else None, fechas[-1] if fechas else None, len(fechas)) + extra
+
+    def contiene(self, clave: Hashable) -> bool:
+        with self._candado:
+            return clave in self._datos
+
+    def obtener(self, clave: Hashable, calcular: Callable[[], Any]) -> Any:
+        with self._candado:
+            if clave in self._datos:
+                self._datos.move_to_end(clave)
+                return self._datos[clave]
+        valor = calcular()
+        with self._candado:
+            self._datos[clave] = valor
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.maximo:
+                self._datos.popitem(last=False)
+        return valor
@@ -39,59 +39,112 @@ def regresion_lineal_simple(x: List[float], y: List[float]):
     return beta0, beta1
 
 
-def transpuesta_matriz(A):
-    return [[A[j][i] for j in range(len(A))] for i in range(len(A[0]))]
-
-
-def resolver_sistema_gauss_jordan(A, b):
-    """Resuelve A*x = b mediante Gauss-Jordan (precario, sin pivotado avanzado)."""
+def resolver_sistema_pivoteo_parcial(A, b, tol: float = 1e-10):
+    """Resuelve A*x = b por eliminación gaussiana con pivoteo parcial.
+
+    En cada columna se elige como pivote el renglón con mayor valor absoluto.
+    Si el mejor pivote es despreciable frente a la escala de A (sistema
+    singular, p. ej. una columna constante junto al intercepto) esa variable
+    se fija en 0 y se continúa, lo que da una solución válida cuando el
+    sistema es consistente."""
     n = len(A)
-    # matriz aumentada
-    M = [list(A[i]) + [b[i]] for i in range(n)]
-    for i in range(n):
-        if abs(M[i][i]) < 1e-12:
-            for k in range(i + 1, n):
-                if abs(M[k][i]) > 1e-12:
-                    M[i], M[k] = M[k], M[i]
-                    break
-        if abs(M[i][i]) < 1e-12:
+    M = [list(map(float, A[i])) + [float(b[i])] for i in range(n)]
+    escala = max((abs(v) for fila in A for v in fila), default=0.0)
+    umbral = tol * escala if escala > 0 else tol
+    columnas_pivote = []
+    r = 0
+    for c in range(n):
+        if r >= n:
+            break
+        p = max(range(r, n), key=lambda k: abs(M[k][c]))
+        if abs(M[p][c]) <= umbral:
             continue
-        pivote = M[i][i]
-        for j in range(i, n + 1):
-            M[i][j] /= pivote
-        for k in range(n):
-            if k != i and abs(M[k][i]) > 1e-12:
-                factor = M[k][i]
-                for j in range(i, n + 1):
-                    M[k][j] -= factor * M[i][j]
-    return [M[i][n] for i in range(n)]
+        M[r], M[p] = M[p], M[r]
+        for k in range(r + 1, n):
+            factor = M[k][c] / M[r][c]
+            if factor != 0.0:
+                for j in range(c, n + 1):
+                    M[k][j] -= factor * M[r][j]
+        columnas_pivote.append(c)
+        r += 1
+    # sustitución hacia atrás; las variables sin pivote quedan en 0
+    x = [0.0] * n
+    for fila in range(len(columnas_pivote) - 1, -1, -1):
+        c = columnas_pivote[fila]
+        suma = M[fila][n] - sum(M[fila][j] * x[j] for j in range(c + 1, n))
+        x[c] = suma / M[fila][c]
+    return x
+
+
+class AcumuladorMinimosCuadrados:
+    """Acumula las ecuaciones normales (X^T X y X^T y) observación por observación.
+
+    Cada fila se amplía con un 1 para el intercepto, que queda al final de
+    los coeficientes. Agregar o quitar una observación cuesta O(k²), así que
+    una ventana deslizante no necesita recorrer toda la historia en cada día
+    nuevo. Quitar observaciones acumula error de redondeo; para ventanas muy
+    largas conviene reconstruir el acumulador de vez en cuando."""
+
+    def __init__(self, k: int):
+        self.k = k
+        self.n = 0
+        self.XtX = [[0.0] * (k + 1) for _ in range(k + 1)]
+        self.Xty = [0.0] * (k + 1)
+
+    def _actualizar(self, fila: List[float], y: float, signo: float):
+        if len(fila) != self.k:
+            raise ValueError(f"Se esperaban {self.k} columnas, se recibieron {len(fila)}")
+        z = [float(v) for v in fila] + [1.0]
+        for i in range(self.k + 1):
+            zi = signo * z[i]
+            self.Xty[i] += zi * y
+            fila_i = self.XtX[i]
+            for j in range(self.k + 1):
+                fila_i[j] += zi * z[j]
+        self.n += 1 if signo > 0 else -1
+
+    def agregar(self, fila: List[float], y: float):
+        """Incorpora la observación (fila, y)."""
+        self._actualizar(fila, float(y), 1.0)
+
+    def quitar(self, fila: List[float], y: float):
+        """Retira una observación agregada antes (p. ej. la que sale de la ventana)."""
+        if self.n == 0:
+            raise ValueError("El acumulador está vacío")
+        self._actualizar(fila, float(y), -1.0)
+
+    def coeficientes(self) -> List[float]:
+        """Coeficientes beta (intercepto al final)."""
+        return resolver_sistema_pivoteo_parcial(self.XtX, self.Xty)
+
+    def predecir(self, fila: List[float]) -> float:
+        beta = self.coeficientes()
+        return sum(b * float(v) for b, v in zip(beta, fila)) + beta[-1]
 
 
 def modelo_algebra_lineal(precip: float, temp: float, marg: float,
                          X: Optional[List[List[float]]] = None,
-                         y: Optional[List[float]] = None) -> float:
+                         y: Optional[List[float]] = None,
+                         acumulador: Optional[AcumuladorMinimosCuadrados] = None) -> float:
     """Modelo multivariable simple. Si no se proporcionan X,y usa regla de respaldo.
+    También acepta un `acumulador` ya cargado (p. ej. una ventana deslizante)
+    en lugar de X,y.
     Devuelve valor en [0,1]."""
-    # Datos de ejemplo mínimos (pueden reemplazarse con historia)
-    if X is None or y is None or len(X) < 3:
-        if precip < 20 and marg > 0.7:
-            return 0.9
-        elif precip < 30:
-            return 0.5
-        else:
-            return 0.1
-
-    # Añadir columna de 1s para el intercepto
-    X_con_const = [fila + [1] for fila in X]
-    Xt = transpuesta_matriz(X_con_const)
-
-    # XtX y Xty
-    n_cols = len(X_con_const[0])
-    XtX = [[sum(Xt[i][k] * X_con_const[k][j] for k in range(len(X_con_const)))
-            for j in range(n_cols)] for i in range(n_cols)]
-    Xty = [sum(Xt[i][k] * y[k] for k in range(len(y))) for i in range(n_cols)]
+    if acumulador is None:
+        # Datos de ejemplo mínimos (pueden reemplazarse con historia)
+        if X is None or y is None or len(X) < 3:
+            if precip < 20 and marg > 0.7:
+                return 0.9
+            elif precip < 30:
+                return 0.5
+            else:
+                return 0.1
+        acumulador = AcumuladorMinimosCuadrados(len(X[0]))
+        for fila, yi in zip(X, y):
+            acumulador.agregar(fila, yi)
+
     try:
-        beta = resolver_sistema_gauss_jordan(XtX, Xty)
+        beta = acumulador.coeficientes()
         # beta order: coef_0..coef_n-1, intercept last
         pred = 0.0
         for i in range(len(beta) - 1):
@@ -169,7 +222,27 @@ def calcular_riesgo_modelo(precip: float, temp: float, marg: Optional[float] = N
         y = [1 if precip_hist[i] < 20 else 0 for i in range(n)]
 
     pred_alg = modelo_algebra_lineal(precip, temp, marg, X=X, y=y)
+    return combinar_riesgo(tendencia, pred_estad, pred_alg)
+
+
+def riesgo_con_coeficientes(coeficientes: Dict[str, Any], precip: float, temp: float,
+                            historia: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Igual que `calcular_riesgo_modelo`, pero con los coeficientes
+    entrenados fuera de línea (`modelos_riesgo.py`): sin ajustes, sólo la
+    tendencia de los dos últimos días y dos productos punto."""
+    tendencia = 0.0
+    if historia and 'precipitacion' in historia:
+        tendencia = derivada_tendencia(historia['precipitacion'][-2:])
+    est = coeficientes['estadistico']
+    pred_estad = max(0.0, min(1.0, est['beta0'] + est['beta1'] * precip))
+    alg = coeficientes['algebra']
+    pred_alg = alg['precipitacion'] * precip + alg['temperatura'] * temp + alg['intercepto']
+    pred_alg = max(0.0, min(1.0, pred_alg))
+    return combinar_riesgo(tendencia, pred_estad, pred_alg)
+
 
+def combinar_riesgo(tendencia: float, pred_estad: float, pred_alg: float) -> Dict[str, Any]:
+    """Combina las tres predicciones del modelo en el dict de `calcular_riesgo_modelo`."""
     # combinar predicciones (0-1)
     # tendencia negativa (caída) incrementa sequía → usamos -tendencia/10 como en el adjunto
     riesgo = (max(0.0, -tendencia / 10.0) + pred_estad + pred_alg) / 3.0
@@ -204,6 +277,7 @@ def main_cli():
 
     Modos:
     - Si se pasan --precip y --temp se calcula y muestra resultado.
+    - Con --lote se evalúa un archivo CSV/JSONL de escenarios (ver `escenarios.py`).
     - Si no se pasan, entra en modo interactivo pidiendo valores por teclado.
     """
     import argparse
@@ -217,8 +291,28 @@ def main_cli():
     parser.add_argument('--hist-temp', type=str, help='Historial de temperatura como CSV (ej: 25,26,24)')
     parser.add_argument('--json', action='store_true', help='Imprimir salida en JSON')
     parser.add_argument('--interactive', action='store_true', help='Modo interactivo (pregunta por teclado)')
+    lote = parser.add_argument_group('modo por lotes')
+    lote.add_argument('--lote', metavar='ENTRADA', help='Archivo CSV o JSONL de escenarios ("-" = entrada estándar)')
+    lote.add_argument('--formato-entrada', choices=['csv', 'jsonl'], help='Por defecto según la extensión de ENTRADA')
+    lote.add_argument('--formato', choices=['csv', 'jsonl'], help='Formato de salida (por defecto el de la entrada)')
+    lote.add_argument('--salida', default='-', help='Archivo de salida ("-" = salida estándar)')
+    lote.add_argument('--procesos', type=int, default=None, help='Procesos de cálculo (por defecto uno por CPU)')
+    lote.add_argument('--bloque', type=int, default=2000, help='Escenarios por bloque')
+    lote.add_argument('--barrido-marg', metavar='VALORES',
+                      help='Repetir cada escenario con cada marginación: "0.2,0.5,0.8" o "inicio:fin:paso"')
     args = parser.parse_args()
 
+    if args.lote:
+        from escenarios import ejecutar_lote, valores_barrido
+        try:
+            barrido = valores_barrido(args.barrido_marg) if args.barrido_marg else None
+        except ValueError as e:
+            print(f'--barrido-marg inválido: {e}')
+            return 1
+        return ejecutar_lote(args.lote, args.salida, formato_entrada=args.formato_entrada,
+                             formato_salida=args.formato, procesos=args.procesos,
+                             tamano_bloque=max(1, args.bloque), barrido_marg=barrido)
+
     if args.interactive or (args.precip is None or args.temp is None):
         try:
             precip = float(input('Precipitación (mm): ').strip())
@@ -1,62 +1,240 @@
 """Script de utilidad: analizar_municipios.py
 
-Este script consulta la API local (/api/municipios y /api/analizar) y muestra
-un resumen rápido de cuántos municipios caen en cada categoría (D0..D4).
+Analiza todos (o algunos) municipios por lotes y escribe una fila por
+municipio en CSV o JSONL, a medida que cada lote termina. Al final muestra
+el resumen de cuántos municipios caen en cada categoría (D0..D4).
 
-Notas:
-- Está escrito para ejecutarse localmente contra http://127.0.0.1:5000
-- Por simplicidad limita el análisis a los primeros 10 municipios
-- Maneja errores de red/JSON de forma muy simple (imprime el error)
+Modos:
+- local (por defecto): llama a las funciones de `api.py` en el mismo
+  proceso (almacén local + una consulta multi-ubicación por lote), sin
+  levantar el servidor.
+- http: consulta `/api/analizar_lote` de un servidor en marcha (`--url`).
+
+Los lotes se procesan en paralelo (`--concurrencia`); cada lote se reintenta
+con espera exponencial si falla. Con `--reanudar` se omiten los municipios
+ya anotados en el archivo de avance (`<salida>.avance`) y las filas nuevas
+se agregan al final de la salida, así que una corrida interrumpida continúa
+donde se quedó.
+
+Ejemplos:
+    py analizar_municipios.py --salida estado.csv
+    py analizar_municipios.py --formato jsonl --salida estado.jsonl --reanudar
+    py analizar_municipios.py --modo http --url http://127.0.0.1:5000 --timeout 60
 """
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter
+from contextlib import redirect_stdout
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+CAMPOS = [
+    "municipio", "ultima_fecha", "indice_sequia", "categoria", "nombre_categoria",
+    "riesgo_modelo", "categoria_modelo", "precipitacion_promedio",
+    "temperatura_promedio", "evapotranspiracion_promedio",
+]
 
-import urllib.request  # para abrir URLs HTTP sin dependencias externas
-import json             # para parsear respuestas JSON
-from collections import Counter  # para contar categorías al final
 
-# Envolvemos todo en try/except para atrapar errores globales (conexión, JSON, etc.)
-try:
-    # 1) Obtener la lista de municipios desde la API local
-    resp_municipios = urllib.request.urlopen('http://127.0.0.1:5000/api/municipios')
-    municipios_data = json.loads(resp_municipios.read().decode())
+def _fila(resultado: Dict[str, Any]) -> Dict[str, Any]:
+    """Aplana la respuesta de `/api/analizar` a las columnas de salida."""
+    fechas = resultado.get("series", {}).get("fechas") or []
+    datos = resultado.get("datos", {})
+    modelo = resultado.get("modelo", {})
+    return {
+        "municipio": resultado.get("municipio"),
+        "ultima_fecha": fechas[-1] if fechas else None,
+        "indice_sequia": resultado.get("indice_sequia"),
+        "categoria": resultado.get("categoria"),
+        "nombre_categoria": resultado.get("nombre_categoria"),
+        "riesgo_modelo": modelo.get("riesgo_modelo"),
+        "categoria_modelo": modelo.get("categoria_modelo"),
+        "precipitacion_promedio": datos.get("precipitacion_promedio"),
+        "temperatura_promedio": datos.get("temperatura_promedio"),
+        "evapotranspiracion_promedio": datos.get("evapotranspiracion_promedio"),
+    }
 
-    # Limitamos a los primeros 10 municipios para que el script sea rápido
-    # Si quieres analizar todos, quita '[:10]'.
-    municipios = municipios_data['municipios']
 
-    # Lista para reunir las categorías devueltas por la API
-    categorias = []
+# ---------------------------------------------------------------------------
+# Análisis de un lote: devuelve (filas, errores {municipio: mensaje})
 
-    print("Analizando municipios...")
-    print("-" * 60)
+def _analizar_lote_local(municipios: List[str], marg: Optional[float]) -> Tuple[List[Dict], Dict[str, str]]:
+    import api  # importación tardía: trae Flask y el almacén de series
 
-    # 2) Iterar sobre cada municipio y pedir el análisis a la API
+    # Un fallo de Open-Meteo se lanza para que `_con_reintentos` vuelva a intentar
+    series, historias = api._datos_con_historia_lote(municipios, propagar_fallos=True)
+    calculados = api._calcular_lote_vectorizado(series, marg)
+    filas, errores = [], {}
     for municipio in municipios:
+        if series[municipio] is None:
+            errores[municipio] = "Sin datos disponibles"
+            continue
+        filas.append(_fila(api._analizar_datos(municipio, series[municipio], marg, calculados.get(municipio),
+                                               historia=historias[municipio])))
+    return filas, errores
+
+
+def _analizar_lote_http(url: str, timeout: float, municipios: List[str],
+                        marg: Optional[float]) -> Tuple[List[Dict], Dict[str, str]]:
+    import requests
+
+    respuesta = requests.post(
+        url.rstrip('/') + '/api/analizar_lote',
+        params={} if marg is None else {'marg': marg},
+        json={'municipios': municipios},
+        timeout=(5, timeout)
+    )
+    respuesta.raise_for_status()
+    lote = respuesta.json()
+    return [_fila(r) for r in lote.get('resultados', [])], lote.get('errores', {})
+
+
+def _con_reintentos(funcion: Callable[[], Any], reintentos: int, espera: float) -> Any:
+    """Ejecuta `funcion`; si falla espera espera·2^intento (±50 %) y reintenta."""
+    for intento in range(reintentos + 1):
+        try:
+            return funcion()
+        except Exception as e:
+            if intento == reintentos:
+                raise
+            pausa = espera * 2 ** intento * random.uniform(0.5, 1.5)
+            print(f"[LOTE] Error ({e}); reintento {intento + 1}/{reintentos} en {pausa:.1f} s", file=sys.stderr)
+            time.sleep(pausa)
+
+
+# ---------------------------------------------------------------------------
+# Salida en flujo y archivo de avance
+
+class _Salida:
+    """Escribe filas CSV o JSONL y las vacía al disco una por una."""
+
+    def __init__(self, ruta: str, formato: str, agregar: bool):
+        if ruta == '-':
+            self._archivo = sys.stdout
+            nuevo = True
+        else:
+            nuevo = not (agregar and os.path.exists(ruta) and os.path.getsize(ruta) > 0)
+            self._archivo = open(ruta, 'w' if nuevo else 'a', encoding='utf-8', newline='')
+        self._formato = formato
+        self._csv = None
+        if formato == 'csv':
+            self._csv = csv.DictWriter(self._archivo, fieldnames=CAMPOS)
+            if nuevo:
+                self._csv.writeheader()
+
+    def escribir(self, fila: Dict[str, Any]):
+        if self._csv is not None:
+            self._csv.writerow(fila)
+        else:
+            self._archivo.write(json.dumps(fila, ensure_ascii=False) + '\n')
+        self._archivo.flush()
+
+    def cerrar(self):
+        if self._archivo is not sys.stdout:
+            self._archivo.close()
+
+
+def _leer_avance(ruta: str) -> set:
+    if not os.path.exists(ruta):
+        return set()
+    with open(ruta, 'r', encoding='utf-8') as f:
+        return {linea.strip() for linea in f if linea.strip()}
+
+
+def main_cli(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Análisis por lotes de los municipios de Chihuahua')
+    parser.add_argument('--modo', choices=['local', 'http'], default='local',
+                        help='local: funciones de api.py en el mismo proceso; http: servidor en --url')
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='Servidor para --modo http')
+    parser.add_argument('--municipio', action='append', help='Municipio a analizar (se puede repetir); por defecto todos')
+    parser.add_argument('--marg', type=float, default=None, help='Índice de marginación (0-1)')
+    parser.add_argument('--lote', type=int, default=10, help='Municipios por consulta')
+    parser.add_argument('--concurrencia', type=int, default=4, help='Lotes simultáneos')
+    parser.add_argument('--timeout', type=float, default=30, help='Tiempo límite de lectura por consulta (s)')
+    parser.add_argument('--reintentos', type=int, default=3, help='Reintentos por lote')
+    parser.add_argument('--espera', type=float, default=1.0, help='Espera inicial entre reintentos (s)')
+    parser.add_argument('--formato', choices=['csv', 'jsonl'], default='csv')
+    parser.add_argument('--salida', default='-', help='Archivo de salida ("-" = salida estándar)')
+    parser.add_argument('--avance', default=None, help='Archivo de avance (por defecto <salida>.avance)')
+    parser.add_argument('--reanudar', action='store_true', help='Omitir los municipios ya anotados en el avance')
+    args = parser.parse_args(argv)
+
+    if args.modo == 'local':
+        import api
+        api.TIMEOUT_OPEN_METEO = (5, args.timeout)
+        todos = list(api.MUNICIPIOS)
+        analizar = lambda grupo: _analizar_lote_local(grupo, args.marg)
+    else:
+        import requests
         try:
-            # Llamada GET a /api/analizar?municipio=Nombre
-            resp = urllib.request.urlopen(f'http://127.0.0.1:5000/api/analizar?municipio={municipio}')
-            data = json.loads(resp.read().decode())
-
-            # Extraer el índice y la categoría de la respuesta JSON.
-            # Usamos .get() con valores por defecto para evitar KeyError si la respuesta cambia.
-            indice = data.get('indice_sequia', 0)
-            categoria = data.get('categoria', 'N/A')
-
-            # Guardar la categoría para el resumen y mostrar la línea por municipio
-            categorias.append(categoria)
-            print(f"{municipio:<30} => Índice: {indice:>6}% | {categoria}")
+            todos = _con_reintentos(
+                lambda: requests.get(args.url.rstrip('/') + '/api/municipios', timeout=(5, args.timeout)).json()['municipios'],
+                args.reintentos, args.espera)
         except Exception as e:
-            # Si falla la llamada o el parseo, mostramos el error pero seguimos con el siguiente municipio
-            print(f"{municipio:<30} => Error: {e}")
+            print(f"Error: no se pudo consultar {args.url} ({e})", file=sys.stderr)
+            return 2
+        analizar = lambda grupo: _analizar_lote_http(args.url, args.timeout, grupo, args.marg)
 
-    print("-" * 60)
-    print("\nResumen de categorías:")
+    municipios = args.municipio or todos
+    desconocidos = [m for m in municipios if m not in todos]
+    if desconocidos:
+        print(f"Municipios no encontrados: {', '.join(desconocidos)}", file=sys.stderr)
+        return 2
 
-    # 3) Contar ocurrencias de cada categoría y mostrarlas ordenadas D0..D4
-    conteo = Counter(categorias)
+    ruta_avance = args.avance or (None if args.salida == '-' else args.salida + '.avance')
+    hechos = _leer_avance(ruta_avance) if (args.reanudar and ruta_avance) else set()
+    if ruta_avance and not args.reanudar and os.path.exists(ruta_avance):
+        os.remove(ruta_avance)
+    pendientes = [m for m in municipios if m not in hechos]
+    grupos = [pendientes[i:i + args.lote] for i in range(0, len(pendientes), max(1, args.lote))]
+    print(f"Analizando {len(pendientes)} municipios en {len(grupos)} lotes "
+          f"({len(hechos)} ya hechos)...", file=sys.stderr)
+
+    salida = _Salida(args.salida, args.formato, agregar=args.reanudar)
+    avance = open(ruta_avance, 'a', encoding='utf-8') if ruta_avance else None
+    categorias = Counter()
+    fallidos: Dict[str, str] = {}
+    inicio = time.perf_counter()
+    try:
+        # Los mensajes de api.py van a stderr para no mezclarse con la salida
+        with redirect_stdout(sys.stderr), ThreadPoolExecutor(max_workers=max(1, args.concurrencia)) as ejecutor:
+            futuros = {
+                ejecutor.submit(_con_reintentos, lambda g=grupo: analizar(g), args.reintentos, args.espera): grupo
+                for grupo in grupos
+            }
+            for futuro in as_completed(futuros):
+                try:
+                    filas, errores = futuro.result()
+                except Exception as e:
+                    fallidos.update({m: str(e) for m in futuros[futuro]})
+                    continue
+                fallidos.update(errores)
+                # La fila se escribe antes de anotar el avance: si la corrida se
+                # corta entre ambos, al reanudar la fila sale repetida, no perdida
+                for fila in filas:
+                    salida.escribir(fila)
+                    categorias[fila["categoria"]] += 1
+                    if avance:
+                        avance.write(fila["municipio"] + '\n')
+                        avance.flush()
+    finally:
+        salida.cerrar()
+        if avance:
+            avance.close()
+
+    print("-" * 60, file=sys.stderr)
+    for municipio, error in sorted(fallidos.items()):
+        print(f"{municipio:<30} => Error: {error}", file=sys.stderr)
+    print(f"\nResumen de categorías ({time.perf_counter() - inicio:.1f} s):", file=sys.stderr)
     for cat in ['D0', 'D1', 'D2', 'D3', 'D4']:
-        count = conteo.get(cat, 0)
-        print(f"  {cat}: {count}")
+        print(f"  {cat}: {categorias.get(cat, 0)}", file=sys.stderr)
+    # Código 1 si quedaron municipios sin analizar (se pueden reintentar con --reanudar)
+    return 1 if fallidos else 0
+
 
-except Exception as e:
-    # Error general: por ejemplo, la API local no está levantada
-    print(f"Error: {e}")
+if __name__ == '__main__':
+    raise SystemExit(main_cli())
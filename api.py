@@ -1,9 +1,31 @@
-﻿from flask import Flask, jsonify, request  # Núcleo de Flask: crear la aplicación, devolver respuestas JSON y acceder a datos de la petición
+﻿from flask import Flask, Response, g, jsonify, request, stream_with_context  # Núcleo de Flask: crear la aplicación, devolver respuestas JSON y acceder a datos de la petición
 from flask_cors import CORS  # Habilita CORS (Cross-Origin Resource Sharing) para que el frontend pueda llamar a la API desde otro origen
-from datetime import date, timedelta  # Utilidades de fechas para calcular rangos (inicio/fin) en consultas históricas
+from datetime import date, datetime, timedelta  # Utilidades de fechas para calcular rangos (inicio/fin) en consultas históricas
 import requests  # Cliente HTTP usado para consultar la API de Open-Meteo
+import json  # Líneas de error dentro de las respuestas NDJSON en flujo
 import os  # Utilidades del sistema operativo (rutas, variables de entorno) utilizadas por la aplicación
-from analisis_sequia import calcular_riesgo_modelo
+import time  # Medición de la duración de las peticiones
+import threading  # Llenado de la rejilla en segundo plano
+from urllib.parse import quote  # Codificar nombres de archivo con acentos en Content-Disposition
+from analisis_sequia import calcular_riesgo_modelo, riesgo_con_coeficientes, _clasificar_por_umbral
+from modelos_riesgo import ModelosRiesgo  # Coeficientes del modelo entrenados fuera de línea
+import cache_meteo  # Almacén local (SQLite) de las series diarias ya descargadas
+import motor_vectorizado  # Cálculo por lotes con NumPy (opcional)
+import indice_movil  # Índice diario con ventanas móviles (30/90/180/365 días)
+from instantaneas import AlmacenInstantaneas  # Respuestas precalculadas en memoria
+import instantanea_compartida  # Instantáneas en un archivo mapeado, compartido entre workers
+from respuestas import respuesta_binaria, respuesta_json  # ETag/Last-Modified (304) y compresión gzip/brotli
+import formato_series  # Series compactas: fecha inicial + días + columnas float32
+import historico  # Modo de largo plazo: bloques anuales en paralelo y acumuladores
+from climatologia import Climatologia, ESCALAS as ESCALAS_CLIMATOLOGIA  # Parámetros SPI/SPEI ajustados por municipio y mes
+import agregados  # Agregados semanales, mensuales, estacionales y anuales en un recorrido
+import rejilla  # Rejilla lat/lon sobre Chihuahua para el mapa de calor
+import indice_espacial  # Árbol k-d de municipios y celdas del reanálisis
+import submuestreo  # Submuestreo LTTB de las series para las gráficas
+from concurrent.futures import ThreadPoolExecutor  # Descargas en paralelo (rejilla, archivo + pronóstico)
+import limite_open_meteo  # Vuelo único y presupuesto de cuota para Open-Meteo
+import metricas  # Histogramas por etapa y contadores para /api/metrics
+from perfilador import PerfiladorMuestreo  # Perfilador por muestreo de una petición (X-Perfilar)
 
 # Funciones auxiliares para operaciones matemáticas (sin NumPy)
 def _min(lista):
@@ -19,7 +41,9 @@ def _mean(lista):
     return sum(lista) / len(lista) if lista else 0
 
 app = Flask(__name__, static_folder='static', static_url_path='/static')
-CORS(app)
+CORS(app, expose_headers=["X-Serie-Inicio", "X-Serie-Dias", "X-Serie-Columnas", "X-Serie-Tipo",
+                          "X-Rejilla-Paso", "X-Rejilla-Filas", "X-Rejilla-Columnas",
+                          "X-Rejilla-Norte", "X-Rejilla-Oeste", "X-Rejilla-Fecha"])
 
 MUNICIPIOS = {
     "Ahumada": {"lat": 30.5833, "lon": -106.5167},
@@ -91,31 +115,332 @@ MUNICIPIOS = {
     "Valle de Zaragoza": {"lat": 27.6500, "lon": -105.7333},
 }
 
-def obtener_datos_meteo(municipio, dias=90):
+# Municipio más cercano a una coordenada (consultas ?lat=&lon=)
+INDICE_MUNICIPIOS = indice_espacial.IndiceEspacial(MUNICIPIOS)
+MARGEN_COORDENADAS = 0.5  # grados aceptados fuera del rectángulo de Chihuahua
+
+def _coordenadas(clave):
+    """Coordenadas de un municipio o de una celda del reanálisis ('celda:lat,lon')."""
+    coords = MUNICIPIOS.get(clave) or indice_espacial.coordenadas_de_clave(clave)
+    if coords is None:
+        raise ValueError(f"Municipio '{clave}' no encontrado")
+    return coords
+
+def _clave_almacen(clave, coords=None):
+    """Clave en el almacén local: la de la celda del reanálisis. Open-Meteo
+    responde lo mismo para toda la celda, así que un municipio, una consulta
+    'celda:' y una celda de la rejilla ('rejilla:') que caen en ella
+    comparten los días guardados."""
+    coords = coords or _coordenadas(clave)
+    return indice_espacial.clave_celda(coords["lat"], coords["lon"])
+
+def _clave_almacen_anterior(clave):
+    # Claves guardadas antes de agruparse por celda: nombre de municipio o 'rejilla:lat,lon'
+    if clave.startswith('rejilla:'):
+        try:
+            lat, lon = (float(x) for x in clave[len('rejilla:'):].split(','))
+        except ValueError:
+            return None
+        return indice_espacial.clave_celda(lat, lon)
+    try:
+        return _clave_almacen(clave)
+    except ValueError:
+        return None
+
+try:
+    _migradas = cache_meteo.migrar_claves(_clave_almacen_anterior, 'celda')
+    if _migradas:
+        print(f"[API] Almacén local: {_migradas} claves pasadas a celdas del reanálisis")
+except Exception as _e:
+    print(f"[API] No se pudieron migrar las claves del almacén local: {_e}")
+
+def _ubicacion_consulta(args):
+    """Resuelve `lat`/`lon` de la consulta. Devuelve None si no vienen, o
+    (clave, ubicacion): la clave es la de la celda del reanálisis, o la del
+    municipio más cercano con `cercano=1`. Lanza ValueError si son inválidas."""
+    if args.get('lat') is None and args.get('lon') is None:
+        return None
+    try:
+        lat, lon = float(args.get('lat')), float(args.get('lon'))
+    except (TypeError, ValueError):
+        raise ValueError("Coordenadas inválidas; use lat y lon en grados decimales")
+    lat_min, lat_max, lon_min, lon_max = rejilla.LIMITES_CHIHUAHUA
+    if not (lat_min - MARGEN_COORDENADAS <= lat <= lat_max + MARGEN_COORDENADAS
+            and lon_min - MARGEN_COORDENADAS <= lon <= lon_max + MARGEN_COORDENADAS):
+        raise ValueError("Coordenadas fuera de Chihuahua")
+    cercano, distancia = INDICE_MUNICIPIOS.mas_cercano(lat, lon)
+    celda_lat, celda_lon = indice_espacial.celda_reanalisis(lat, lon)
+    ubicacion = {
+        "lat": lat,
+        "lon": lon,
+        "celda": {"lat": celda_lat, "lon": celda_lon, "resolucion": indice_espacial.RESOLUCION_REANALISIS},
+        "municipio_cercano": cercano,
+        "distancia_km": round(distancia, 1),
+    }
+    if args.get('cercano') == '1':
+        return cercano, ubicacion
+    return indice_espacial.clave_celda(lat, lon), ubicacion
+
+def _municipio_consulta(args):
+    """(clave, ubicacion) de `municipio` o de `lat`/`lon` (ubicacion es None
+    con `municipio`). Lanza ValueError si no son válidos."""
+    consulta = _ubicacion_consulta(args)
+    if consulta is not None:
+        return consulta
+    municipio = args.get('municipio', 'Chihuahua')
     if municipio not in MUNICIPIOS:
         raise ValueError(f"Municipio '{municipio}' no encontrado")
-    coords = MUNICIPIOS[municipio]
-    fecha_fin = date.today() - timedelta(days=1)
-    fecha_inicio = fecha_fin - timedelta(days=dias)
-    url = "https://archive-api.open-meteo.com/v1/archive"
-    params = {
-        "latitude": coords["lat"],
-        "longitude": coords["lon"],
+    return municipio, None
+
+# Se puede apuntar a otro servidor (p. ej. el simulador de benchmarks/) con SEQUIA_URL_ARCHIVO
+URL_ARCHIVO = os.environ.get('SEQUIA_URL_ARCHIVO', "https://archive-api.open-meteo.com/v1/archive")
+URL_PRONOSTICO = os.environ.get('SEQUIA_URL_PRONOSTICO', "https://api.open-meteo.com/v1/forecast")
+DIAS_PRONOSTICO = 16  # máximo del pronóstico de Open-Meteo
+DIAS_PASADOS_PRONOSTICO = 7  # cubren el retraso del archivo (ERA5 llega con ~5 días)
+TIMEOUT_OPEN_METEO = (5, 20)  # (conexión, lectura) en segundos
+
+# Presupuesto compartido por todas las consultas del proceso (ver limite_open_meteo.py)
+PRESUPUESTO = limite_open_meteo.CuboFichas(
+    capacidad=float(os.environ.get('SEQUIA_RAFAGA_OPEN_METEO', limite_open_meteo.RAFAGA)),
+    por_segundo=float(os.environ.get('SEQUIA_CUOTA_DIARIA', limite_open_meteo.CUOTA_DIARIA)) / 86400.0,
+    espera_maxima=float(os.environ.get('SEQUIA_ESPERA_CUOTA', limite_open_meteo.ESPERA_MAXIMA))
+)
+VUELOS = limite_open_meteo.VueloUnico()
+
+def _descargar_archivo(coords, fecha_inicio, fecha_fin):
+    """Descarga del archivo de Open-Meteo el bloque diario [fecha_inicio, fecha_fin]."""
+    return _descargar_archivo_lote([coords], fecha_inicio, fecha_fin)[0]
+
+def _params_archivo(lista_coords, fecha_inicio, fecha_fin):
+    """Parámetros de la consulta multi-ubicación al archivo de Open-Meteo."""
+    return {
+        "latitude": ",".join(str(c["lat"]) for c in lista_coords),
+        "longitude": ",".join(str(c["lon"]) for c in lista_coords),
         "start_date": fecha_inicio.strftime('%Y-%m-%d'),
         "end_date": fecha_fin.strftime('%Y-%m-%d'),
         "daily": ["precipitation_sum", "temperature_2m_mean", "et0_fao_evapotranspiration"],
         "timezone": "auto"
     }
-    print(f"[API] Consultando Open-Meteo para {municipio}...")
-    respuesta = requests.get(url, params=params)
-    respuesta.raise_for_status()
-    datos = respuesta.json()
-    datos_diarios = datos["daily"]
+
+def _clave_consulta(lista_coords, fecha_inicio, fecha_fin):
+    """Identifica consultas idénticas para agruparlas en un solo vuelo."""
+    return tuple((c["lat"], c["lon"]) for c in lista_coords), fecha_inicio, fecha_fin
+
+def _costo_consulta(lista_coords, fecha_inicio, fecha_fin):
+    return limite_open_meteo.costo_llamada(len(lista_coords), (fecha_fin - fecha_inicio).days + 1)
+
+def _bloques_respuesta(datos):
+    # Con una sola ubicación Open-Meteo responde un objeto en lugar de una lista
+    if isinstance(datos, dict):
+        datos = [datos]
+    return [d["daily"] for d in datos]
+
+def _agrupar_por_celda(lista_coords):
+    """Una ubicación por celda del reanálisis (Open-Meteo devuelve lo mismo
+    para toda la celda) y, por cada coordenada original, su posición en esa lista."""
+    celdas = {}
+    posiciones = [
+        celdas.setdefault(indice_espacial.celda_reanalisis(c["lat"], c["lon"]), len(celdas))
+        for c in lista_coords
+    ]
+    return [{"lat": lat, "lon": lon} for lat, lon in celdas], posiciones
+
+def _descargar_archivo_lote(lista_coords, fecha_inicio, fecha_fin):
+    """Descarga en una sola petición el bloque diario de varias ubicaciones.
+
+    Open-Meteo acepta latitudes y longitudes separadas por comas y responde
+    con una lista (un objeto por ubicación, en el mismo orden). Se pide una
+    vez cada celda del reanálisis; las consultas idénticas simultáneas
+    (mismas celdas y fechas) comparten una sola petición, y cada petición
+    descuenta del presupuesto (puede lanzar `PresupuestoAgotado`)."""
+    celdas, posiciones = _agrupar_por_celda(lista_coords)
+
+    def _consultar():
+        try:
+            PRESUPUESTO.tomar(_costo_consulta(celdas, fecha_inicio, fecha_fin))
+            params = _params_archivo(celdas, fecha_inicio, fecha_fin)
+            with metricas.etapa('descarga'):
+                respuesta = requests.get(URL_ARCHIVO, params=params, timeout=TIMEOUT_OPEN_METEO)
+                respuesta.raise_for_status()
+            with metricas.etapa('decodificacion_json'):
+                return _bloques_respuesta(respuesta.json())
+        except requests.RequestException as e:
+            metricas.ERRORES_OPEN_METEO.incrementar(tipo=_tipo_error_open_meteo(e))
+            raise
+    bloques = VUELOS.ejecutar(_clave_consulta(celdas, fecha_inicio, fecha_fin), _consultar)
+    return [bloques[i] for i in posiciones]
+
+def _descargar_pronostico_lote(lista_coords):
+    """Pronóstico diario (los últimos `DIAS_PASADOS_PRONOSTICO` días, hoy y
+    los siguientes) de varias ubicaciones en una sola petición, con el mismo
+    vuelo único, presupuesto y métricas que el archivo."""
+    celdas, posiciones = _agrupar_por_celda(lista_coords)
+    params = {
+        "latitude": ",".join(str(c["lat"]) for c in celdas),
+        "longitude": ",".join(str(c["lon"]) for c in celdas),
+        "daily": ["precipitation_sum", "temperature_2m_mean", "et0_fao_evapotranspiration"],
+        "past_days": DIAS_PASADOS_PRONOSTICO,
+        "forecast_days": DIAS_PRONOSTICO,
+        "timezone": "auto"
+    }
+
+    def _consultar():
+        try:
+            PRESUPUESTO.tomar(limite_open_meteo.costo_llamada(len(celdas), DIAS_PASADOS_PRONOSTICO + DIAS_PRONOSTICO))
+            with metricas.etapa('descarga_pronostico'):
+                respuesta = requests.get(URL_PRONOSTICO, params=params, timeout=TIMEOUT_OPEN_METEO)
+                respuesta.raise_for_status()
+            with metricas.etapa('decodificacion_json'):
+                return _bloques_respuesta(respuesta.json())
+        except requests.RequestException as e:
+            metricas.ERRORES_OPEN_METEO.incrementar(tipo=_tipo_error_open_meteo(e))
+            raise
+    bloques = VUELOS.ejecutar(('pronostico', params["latitude"], params["longitude"], date.today()), _consultar)
+    return [bloques[i] for i in posiciones]
+
+def _tipo_error_open_meteo(e):
+    """Etiqueta `tipo` de sequia_open_meteo_errores_total."""
+    if isinstance(e, limite_open_meteo.PresupuestoAgotado):
+        return 'cuota'
+    if isinstance(e, requests.Timeout):
+        return 'tiempo_agotado'
+    if isinstance(e, requests.HTTPError) and e.response is not None:
+        return f'http_{e.response.status_code}'
+    if isinstance(e, requests.ConnectionError):
+        return 'conexion'
+    if isinstance(e, requests.JSONDecodeError):
+        return 'decodificacion'
+    return 'otro'
+
+def _guardar_bloque(clave, datos_diarios):
+    """Guarda el bloque `daily` de Open-Meteo bajo `clave` (ver `_clave_almacen`)."""
+    cache_meteo.guardar_dias(
+        clave,
+        datos_diarios["time"],
+        datos_diarios["precipitation_sum"],
+        datos_diarios["temperature_2m_mean"],
+        datos_diarios["et0_fao_evapotranspiration"]
+    )
+
+def _rango_pendiente(clave, guardados, fecha_inicio, fecha_fin, recientes=None):
+    """Rango a descargar: días ausentes del almacén que no se pidieron sin
+    éxito hace poco (evita insistir cuando Open-Meteo falla o aún no tiene el día)."""
+    if recientes is None:
+        recientes = cache_meteo.sin_dato_reciente(clave, fecha_inicio, fecha_fin)
+    return cache_meteo.rango_faltante(guardados, fecha_inicio, fecha_fin, omitir=recientes)
+
+def _serie_desde_guardados(guardados):
+    fechas = sorted(guardados)
     return {
-        "precipitacion": [float(x) for x in datos_diarios["precipitation_sum"]],
-        "temperatura": [float(x) for x in datos_diarios["temperature_2m_mean"]],
-        "evapotranspiracion": [float(x) for x in datos_diarios["et0_fao_evapotranspiration"]],
-        "fechas": datos_diarios["time"]
+        "precipitacion": [guardados[f][0] for f in fechas],
+        "temperatura": [guardados[f][1] for f in fechas],
+        "evapotranspiracion": [guardados[f][2] for f in fechas],
+        "fechas": fechas
+    }
+
+def _rango_fechas(dias):
+    fecha_fin = date.today() - timedelta(days=1)
+    return fecha_fin - timedelta(days=dias), fecha_fin
+
+def obtener_datos_meteo(municipio, dias=90):
+    return _serie_rango(municipio, *_rango_fechas(dias))
+
+def _serie_rango(municipio, fecha_inicio, fecha_fin):
+    """Series diarias de [fecha_inicio, fecha_fin] usando el almacén local.
+    `municipio` también puede ser la clave de una celda del reanálisis."""
+    coords = _coordenadas(municipio)
+    clave = _clave_almacen(municipio, coords)
+
+    # Leer lo que ya está en el almacén local y pedir sólo el rango faltante
+    guardados = cache_meteo.leer_dias(clave, fecha_inicio, fecha_fin)
+    faltante = _rango_pendiente(clave, guardados, fecha_inicio, fecha_fin)
+    metricas.registrar_cache('almacen', 'acierto' if faltante is None else 'fallo')
+    if faltante is not None:
+        desde, hasta = faltante
+        print(f"[API] Consultando Open-Meteo para {municipio} ({desde} a {hasta})...")
+        try:
+            datos_diarios = _descargar_archivo(coords, desde, hasta)
+        except requests.RequestException as e:
+            # Sin presupuesto no se consultó nada: los días se pedirán en cuanto haya fichas
+            if not isinstance(e, limite_open_meteo.PresupuestoAgotado):
+                cache_meteo.registrar_sin_dato(clave, cache_meteo.fechas_rango(desde, hasta))
+            # Si Open-Meteo falla pero hay días guardados, se responde con ellos
+            if not guardados:
+                raise
+            print(f"[API] Open-Meteo no respondió ({e}); se usan {len(guardados)} días guardados")
+        else:
+            _guardar_bloque(clave, datos_diarios)
+            guardados = cache_meteo.leer_dias(clave, fecha_inicio, fecha_fin)
+
+    if not guardados:
+        raise RuntimeError(f"Sin datos disponibles para '{municipio}' ({fecha_inicio} a {fecha_fin})")
+    return _serie_desde_guardados(guardados)
+
+def obtener_datos_meteo_lote(municipios, dias=90, propagar_fallos=False):
+    """Versión por lote de `obtener_datos_meteo`.
+
+    Los municipios a los que les faltan días se descargan juntos en una sola
+    petición multi-ubicación que cubre la unión de sus rangos faltantes.
+    Devuelve {municipio: datos}; si Open-Meteo falla, un municipio sin días
+    guardados queda con None (con `propagar_fallos`, ver `_series_lote`)."""
+    return _series_lote({m: _coordenadas(m) for m in municipios}, *_rango_fechas(dias),
+                        propagar_fallos=propagar_fallos)
+
+def _series_lote(ubicaciones, fecha_inicio, fecha_fin, tamano_lote=None, concurrencia=1, propagar_fallos=False):
+    """Series de [fecha_inicio, fecha_fin] para {clave: coords} usando el almacén.
+
+    Lo que falta se pide en peticiones multi-ubicación: una sola, o grupos de
+    `tamano_lote` ubicaciones con hasta `concurrencia` peticiones a la vez
+    (la rejilla del mapa tiene cientos de celdas). Con `propagar_fallos` un
+    fallo de Open-Meteo (o la cuota agotada) se lanza en lugar de responder
+    con lo guardado, y los días no se anotan como sin dato: quien llama
+    reintenta (p. ej. `analizar_municipios.py`)."""
+    # Las ubicaciones de una misma celda se leen, descargan y guardan una vez
+    almacen = {c: _clave_almacen(c, coords) for c, coords in ubicaciones.items()}
+    claves = list(dict.fromkeys(almacen.values()))
+    ubicaciones = {clave: indice_espacial.coordenadas_de_clave(clave) for clave in claves}
+    guardados = cache_meteo.leer_varios(claves, fecha_inicio, fecha_fin)
+    recientes = cache_meteo.sin_dato_reciente_varios(claves, fecha_inicio, fecha_fin)
+    faltantes = {}
+    for clave in claves:
+        rango = _rango_pendiente(clave, guardados[clave], fecha_inicio, fecha_fin, recientes[clave])
+        metricas.registrar_cache('almacen', 'acierto' if rango is None else 'fallo')
+        if rango is not None:
+            faltantes[clave] = rango
+
+    def _descargar_grupo(pendientes):
+        desde = min(faltantes[c][0] for c in pendientes)
+        hasta = max(faltantes[c][1] for c in pendientes)
+        print(f"[API] Consultando Open-Meteo para {len(pendientes)} ubicaciones ({desde} a {hasta})...")
+        try:
+            bloques = _descargar_archivo_lote([ubicaciones[c] for c in pendientes], desde, hasta)
+        except requests.RequestException as e:
+            if propagar_fallos:
+                raise
+            if not isinstance(e, limite_open_meteo.PresupuestoAgotado):
+                for clave in pendientes:
+                    cache_meteo.registrar_sin_dato(clave, cache_meteo.fechas_rango(desde, hasta))
+            print(f"[API] Open-Meteo no respondió ({e}); se usan los días guardados")
+            return
+        cache_meteo.guardar_varios({
+            clave: (d["time"], d["precipitation_sum"], d["temperature_2m_mean"], d["et0_fao_evapotranspiration"])
+            for clave, d in zip(pendientes, bloques)
+        })
+        guardados.update(cache_meteo.leer_varios(pendientes, fecha_inicio, fecha_fin))
+
+    if faltantes:
+        pendientes = list(faltantes)
+        tamano = tamano_lote or len(pendientes)
+        grupos = [pendientes[i:i + tamano] for i in range(0, len(pendientes), tamano)]
+        if len(grupos) == 1:
+            _descargar_grupo(grupos[0])
+        else:
+            with ThreadPoolExecutor(max_workers=concurrencia) as ejecutor:
+                list(ejecutor.map(_descargar_grupo, grupos))
+
+    return {
+        c: _serie_desde_guardados(guardados[clave]) if guardados[clave] else None
+        for c, clave in almacen.items()
     }
 
 def calcular_indice_sequia(precipitacion, temperatura, evapotranspiracion):
@@ -155,6 +480,42 @@ def calcular_indice_sequia(precipitacion, temperatura, evapotranspiracion):
     # Retornar el promedio y la serie de valores diarios
     return _mean(indice_valores), indice_valores
 
+@app.errorhandler(limite_open_meteo.PresupuestoAgotado)
+def _respuesta_sin_presupuesto(e):
+    """503 con Retry-After cuando no hay días guardados y la cuota no alcanza."""
+    respuesta = jsonify({"error": str(e)})
+    respuesta.status_code = 503
+    respuesta.headers["Retry-After"] = str(max(1, int(e.reintentar_en + 0.999)))
+    return respuesta
+
+PERFILADOR_HABILITADO = os.environ.get('SEQUIA_PERFILADOR') == '1'
+
+@app.before_request
+def _inicio_peticion():
+    g.inicio_peticion = time.perf_counter()
+    # Con SEQUIA_PERFILADOR=1, el encabezado `X-Perfilar: 1` perfila esa petición
+    if PERFILADOR_HABILITADO and request.headers.get('X-Perfilar') == '1':
+        g.perfilador = PerfiladorMuestreo()
+        g.perfilador.iniciar()
+
+@app.after_request
+def _fin_peticion(respuesta):
+    ruta = request.url_rule.rule if request.url_rule else 'sin_ruta'
+    metricas.PETICIONES.observar(time.perf_counter() - g.get('inicio_peticion', time.perf_counter()), ruta=ruta)
+    perfilador = g.pop('perfilador', None)
+    if perfilador is not None:
+        # La respuesta se reemplaza por el perfil en formato de pilas plegadas
+        perfilador.detener()
+        return Response(perfilador.pilas_plegadas(), mimetype='text/plain',
+                        headers={"X-Perfil-Muestras": str(sum(perfilador.muestras.values())),
+                                 "X-Perfil-Estado-Original": str(respuesta.status_code)})
+    return respuesta
+
+@app.route('/api/metrics')
+def exponer_metricas():
+    """Métricas en formato de texto de Prometheus."""
+    return Response(metricas.exposicion(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def index():
     try:
@@ -170,122 +531,868 @@ def listar_municipios():
 
 @app.route('/api/analizar_detalle')
 def analizar_detalle():
-    """Devuelve las series crudas (para depuración)"""
+    """Devuelve las series crudas (para depuración o exportación).
+
+    `formato` (o Accept): json, compacto, binario, csv o ndjson. Por defecto
+    los últimos 90 días; `desde`/`hasta` (YYYY-MM-DD) piden un rango largo,
+    que con ndjson se envía año por año conforme se descarga. Con json,
+    `puntos` submuestrea las series para graficar (ver `_leer_puntos`)."""
     municipio = request.args.get('municipio', 'Chihuahua')
     if municipio not in MUNICIPIOS:
         return jsonify({"error": f"Municipio '{municipio}' no encontrado"}), 400
-    datos = obtener_datos_meteo(municipio)
-    return jsonify({
-        "fechas": datos["fechas"],
+    try:
+        formato = formato_series.elegir_formato(request.args.get('formato'), request.accept_mimetypes)
+        puntos = _leer_puntos(request.args, formato)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    rango = None
+    if request.args.get('desde') or request.args.get('hasta'):
+        ayer = date.today() - timedelta(days=1)
+        try:
+            hasta = min(date.fromisoformat(request.args['hasta']), ayer) if request.args.get('hasta') else ayer
+            desde = date.fromisoformat(request.args['desde']) if request.args.get('desde') else hasta - timedelta(days=90)
+        except ValueError:
+            return jsonify({"error": "Fechas inválidas; use YYYY-MM-DD"}), 400
+        if desde < historico.FECHA_MINIMA or desde > hasta:
+            return jsonify({"error": f"Rango inválido: debe estar entre {historico.FECHA_MINIMA} y {ayer}"}), 400
+        rango = (desde, hasta)
+    if formato == 'ndjson':
+        bloques = _bloques_rango(municipio, *rango) if rango else iter([obtener_datos_meteo(municipio)])
+        flujo = formato_series.ndjson_en_flujo(bloques, ("precipitacion", "temperatura", "evapotranspiracion"))
+        # El primer bloque se obtiene antes de responder: si falla, el error lleva su código HTTP
+        primero = next(flujo, '')
+
+        def _lineas():
+            yield primero
+            try:
+                yield from flujo
+            except Exception as e:
+                # El encabezado ya se envió: el error viaja como última línea
+                print(f"[ERROR] {str(e)}")
+                yield json.dumps({"error": str(e)}, ensure_ascii=False) + '\n'
+
+        return Response(stream_with_context(_lineas()), mimetype='application/x-ndjson')
+    datos = _serie_larga(municipio, *rango) if rango else obtener_datos_meteo(municipio)
+    fechas = datos["fechas"]
+    ultima_fecha = fechas[-1] if fechas else None
+    columnas = {
         "precipitacion": [float(x) for x in datos["precipitacion"]],
         "temperatura": [float(x) for x in datos["temperatura"]],
         "evapotranspiracion": [float(x) for x in datos["evapotranspiracion"]]
-    })
+    }
+    if formato == 'csv':
+        nombre = f"datos_diarios_{municipio.replace(' ', '_')}.csv"
+        return Response(
+            stream_with_context(formato_series.csv_en_flujo(fechas, columnas)),
+            mimetype='text/csv',
+            headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(nombre)}"}
+        )
+    if formato == 'binario':
+        cuerpo, encabezados = formato_series.cuerpo_binario(fechas, columnas)
+        return respuesta_binaria(cuerpo, encabezados, ultima_fecha=ultima_fecha)
+    if formato == 'compacto':
+        return respuesta_json(formato_series.serie_compacta(fechas, columnas), ultima_fecha=ultima_fecha)
+    cuerpo = dict(fechas=fechas, **columnas)
+    if puntos is not None and len(fechas) > puntos:
+        with metricas.etapa('submuestreo'):
+            cuerpo = submuestreo.submuestrear_series(cuerpo, puntos)
+        cuerpo["submuestreo"] = {"metodo": submuestreo.METODO, "puntos": len(cuerpo["fechas"]), "dias": len(fechas)}
+    return respuesta_json(cuerpo, ultima_fecha=ultima_fecha)
+
+# Se recarga sola cuando `py modelos_riesgo.py` publica o activa una versión
+MODELOS = ModelosRiesgo()
+
+def _coeficientes_modelo(clave):
+    """Coeficientes entrenados del municipio (para una celda, los del
+    municipio más cercano); None si no hay modelo entrenado."""
+    coords = indice_espacial.coordenadas_de_clave(clave)
+    if coords is not None:
+        clave = INDICE_MUNICIPIOS.mas_cercano(coords["lat"], coords["lon"])[0]
+    return MODELOS.coeficientes(clave)
+
+def _modelo_entrenado(coeficientes, datos):
+    modelo = riesgo_con_coeficientes(coeficientes, _mean(datos["precipitacion"]), _mean(datos["temperatura"]),
+                                     historia={'precipitacion': datos['precipitacion']})
+    modelo['version'] = MODELOS.version
+    return modelo
+
+def _coeficientes_consulta(municipio, marg_val):
+    """Coeficientes entrenados para una consulta. El modelo entrenado no usa la
+    marginación (es constante en la historia), así que con `marg` explícito
+    se ajusta en línea con `calcular_riesgo_modelo`, como sin modelo."""
+    return _coeficientes_modelo(municipio) if municipio and marg_val is None else None
+
+def _modelo_municipio(datos, marg_val=None, municipio=None):
+    # Llamada al modelo adicional del archivo adjunto (opcional)
+    try:
+        coeficientes = _coeficientes_consulta(municipio, marg_val)
+        if coeficientes is not None:
+            return _modelo_entrenado(coeficientes, datos)
+        mean_precip = _mean(datos["precipitacion"])
+        mean_temp = _mean(datos["temperatura"])
+        historia = {
+            'precipitacion': datos['precipitacion'],
+            'temperatura': datos['temperatura']
+        }
+        return calcular_riesgo_modelo(mean_precip, mean_temp, marg=marg_val, historia=historia)
+    except Exception as _e:
+        return None
+
+def _calcular_lote_vectorizado(series, marg_val=None):
+    """Índice y modelo de todos los municipios del lote en una sola llamada
+    al motor NumPy. Devuelve {municipio: calculado}, o {} si NumPy no está
+    disponible o las series no tienen la misma longitud (se usa entonces la
+    ruta con listas). Los municipios con modelo entrenado no se ajustan
+    (salvo con `marg_val`, ver `_coeficientes_consulta`)."""
+    disponibles = [m for m, d in series.items() if d is not None]
+    if not motor_vectorizado.HAY_NUMPY or not disponibles:
+        return {}
+    if len({len(series[m]["fechas"]) for m in disponibles}) != 1:
+        return {}
+    coeficientes = {m: _coeficientes_consulta(m, marg_val) for m in disponibles}
+    with metricas.etapa('motor_vectorizado'):
+        resultados = motor_vectorizado.analizar_matriz(
+            [series[m]["precipitacion"] for m in disponibles],
+            [series[m]["temperatura"] for m in disponibles],
+            [series[m]["evapotranspiracion"] for m in disponibles],
+            marg=marg_val,
+            con_modelo=any(c is None for c in coeficientes.values())
+        )
+    for m, calculado in zip(disponibles, resultados):
+        if coeficientes[m] is not None:
+            calculado['modelo'] = _modelo_entrenado(coeficientes[m], series[m])
+    return dict(zip(disponibles, resultados))
+
+def _promedio_mensual(fechas, lluvia_lista):
+    """Lluvia total por mes: [{"mes": "YYYY-MM", "lluvia_mm": ..}, ...]."""
+    mensual = agregados.agregar(fechas, {"lluvia": lluvia_lista}, ('mensual',))['mensual']
+    return [{"mes": m["periodo"], "lluvia_mm": round(m["lluvia"]["suma"], 2)} for m in mensual]
+
+def _analizar_datos(municipio, datos, marg_val=None, calculado=None, ventanas=None, historia=None):
+    """Calcula índice, modelo y agregados de un municipio a partir de sus
+    series diarias. Devuelve el cuerpo JSON de /api/analizar.
+
+    `calculado` permite pasar el resultado ya obtenido por el motor
+    vectorizado (`indice`, `indice_diario`, `modelo`) para no recalcularlo.
+    `historia` es la misma serie precedida de los días previos (ver
+    `_datos_con_historia`): de ella salen el SPI/SPEI y, si se indican
+    `ventanas`, el índice móvil de cada una, recortado a los días de `datos`."""
+    if calculado is not None:
+        indice = calculado['indice']
+        indice_diario_serie = calculado['indice_diario']
+        modelo_res = calculado['modelo']
+    else:
+        with metricas.etapa('indice'):
+            indice, indice_diario_serie = calcular_indice_sequia(datos["precipitacion"], datos["temperatura"], datos["evapotranspiracion"])
+        with metricas.etapa('modelo_riesgo'):
+            modelo_res = _modelo_municipio(datos, marg_val, municipio)
+
+    # Mapear índice numérico a categoría USDM (D0-D4)
+    # Umbrales ajustados para climatología árida
+    # Rango típico en Chihuahua: 0.5 - 0.8
+    if indice < 0.35:
+        nivel_riesgo = "D0"
+        nombre_nivel = "Anormalmente Seco"
+    elif indice < 0.50:
+        nivel_riesgo = "D1"
+        nombre_nivel = "Sequía Moderada"
+    elif indice < 0.65:
+        nivel_riesgo = "D2"
+        nombre_nivel = "Sequía Severa"
+    elif indice < 0.80:
+        nivel_riesgo = "D3"
+        nombre_nivel = "Sequía Extrema"
+    else:
+        nivel_riesgo = "D4"
+        nombre_nivel = "Sequía Excepcional"
+    
+    # Preparar series diarias para las gráficas (ya son listas)
+    base = historia or datos
+    fechas = datos["fechas"]
+    lluvia_lista = datos["precipitacion"]
+    temperatura_lista = datos["temperatura"]
+    evapotranspiracion_lista = datos["evapotranspiracion"]
+
+    with metricas.etapa('promedio_mensual'):
+        promedio_mensual = _promedio_mensual(fechas, lluvia_lista)
+
+    print(f"[API] Resultado: índice={indice:.2f}, categoría={nivel_riesgo} ({nombre_nivel})")
+    resultado = {
+        "success": True,
+        "municipio": municipio,
+        "indice_sequia": round(indice * 100, 1),
+        "categoria": nivel_riesgo,
+        "nombre_categoria": nombre_nivel,
+        "modelo": {
+            "riesgo_modelo": round(modelo_res['riesgo'] * 100, 1) if modelo_res else None,
+            "categoria_modelo": modelo_res['categoria'] if modelo_res else None,
+            "nombre_categoria_modelo": modelo_res['nombre_categoria'] if modelo_res else None,
+            # Versión del modelo entrenado; None si se ajustó con la ventana consultada
+            "version_modelo": modelo_res.get('version') if modelo_res else None
+        },
+        "datos": {
+            "precipitacion_promedio": _mean(datos["precipitacion"]),
+            "temperatura_promedio": _mean(datos["temperatura"]),
+            "evapotranspiracion_promedio": _mean(datos["evapotranspiracion"])
+        },
+        "series": {
+            "fechas": fechas,
+            "lluvia_mm": lluvia_lista,
+            "temperatura_c": temperatura_lista,
+            "evapotranspiracion_mm": evapotranspiracion_lista,
+            "riesgo_diario": [round(val * 100, 1) for val in indice_diario_serie] # Nueva serie de riesgo
+        },
+        "promedio_mensual": promedio_mensual,
+        # SPI/SPEI al último día consolidado (None si aún no se ajustó la
+        # climatología del municipio)
+        "indices_estandarizados": CLIMATOLOGIA.evaluar(municipio, base["fechas"], base["precipitacion"],
+                                                       base["evapotranspiracion"])
+    }
+    if ventanas:
+        moviles = indice_movil.indice_movil(base["precipitacion"], base["temperatura"],
+                                            base["evapotranspiracion"], ventanas)
+        previos = len(base["fechas"]) - len(fechas)
+        resultado["ventanas"] = ventanas
+        resultado["series"]["indice_movil"] = {
+            str(w): [round(val * 100, 1) for val in moviles[w][previos:]] for w in ventanas
+        }
+    return resultado
+
+# Los últimos días del archivo aún no están consolidados (quedan sin dato),
+# así que la serie de 90 días termina unos días antes de ayer: se leen los
+# días de la escala mayor antes de su inicio para que el SPI/SPEI tenga su
+# acumulado completo al último día consolidado
+DIAS_PREVIOS_ESTANDARIZADOS = max(ESCALAS_CLIMATOLOGIA)
+
+def _dias_previos(ventanas=None):
+    """Días que se leen antes de la serie consultada: los del SPI/SPEI y,
+    con índice móvil, max(ventanas) - 1 para que cada valor use su ventana
+    completa."""
+    return max(DIAS_PREVIOS_ESTANDARIZADOS, max(ventanas) - 1 if ventanas else 0)
+
+def _recortar(historia, fecha_inicio):
+    desde = fecha_inicio.isoformat()
+    corte = next((i for i, f in enumerate(historia["fechas"]) if f >= desde), len(historia["fechas"]))
+    return {k: v[corte:] for k, v in historia.items()}
+
+def _datos_con_historia(municipio, ventanas=None, dias=90):
+    """(datos, historia): la serie de siempre (`dias` días, de la que salen
+    índice, modelo y agregados) y la misma precedida de `_dias_previos`."""
+    fecha_inicio, fecha_fin = _rango_fechas(dias)
+    historia = _serie_rango(municipio, fecha_inicio - timedelta(days=_dias_previos(ventanas)), fecha_fin)
+    datos = _recortar(historia, fecha_inicio)
+    if not datos["fechas"]:
+        raise RuntimeError(f"Sin datos disponibles para '{municipio}' ({fecha_inicio} a {fecha_fin})")
+    return datos, historia
+
+def _datos_con_historia_lote(municipios, dias=90, propagar_fallos=False):
+    """Versión por lote de `_datos_con_historia` (sin índice móvil), con una
+    sola petición multi-ubicación como `obtener_datos_meteo_lote`.
+    Devuelve (series, historias), ambos {municipio: datos o None}."""
+    fecha_inicio, fecha_fin = _rango_fechas(dias)
+    historias = _series_lote({m: _coordenadas(m) for m in municipios},
+                             fecha_inicio - timedelta(days=_dias_previos()), fecha_fin,
+                             propagar_fallos=propagar_fallos)
+    series = {}
+    for m, historia in historias.items():
+        datos = _recortar(historia, fecha_inicio) if historia is not None else None
+        series[m] = datos if datos and datos["fechas"] else None
+    return series, historias
+
+def _leer_marg():
+    marg_param = request.args.get('marg')
+    try:
+        return float(marg_param) if marg_param is not None else None
+    except Exception:
+        return None
+
+def _calcular_instantaneas(municipios):
+    """Cuerpos de /api/analizar (parámetros por defecto) para varios municipios."""
+    series, historias = _datos_con_historia_lote(municipios)
+    calculados = _calcular_lote_vectorizado(series)
+    return {
+        m: _analizar_datos(m, series[m], None, calculados.get(m), historia=historias[m])
+        for m in municipios if series[m] is not None
+    }
+
+# Se recarga sola cuando `py climatologia.py` reescribe el archivo
+CLIMATOLOGIA = Climatologia()
+
+# Instantáneas de /api/analizar sin parámetros extra (marg, ventana), por
+# municipio o por celda del reanálisis (consultas con lat/lon)
+INSTANTANEAS = AlmacenInstantaneas(
+    _calcular_instantaneas,
+    ttl=float(os.environ.get('SEQUIA_TTL_INSTANTANEA', 6 * 3600))
+)
+HORA_REFRESCO = os.environ.get('SEQUIA_HORA_REFRESCO', '03:00')
+
+# Con varios workers: el proceso del programador que gana el candado publica
+# las instantáneas en este archivo cada TTL y todos las leen de ahí (ver
+# instantanea_compartida.py)
+RUTA_COMPARTIDA = os.environ.get('SEQUIA_INSTANTANEA_COMPARTIDA')
+COMPARTIDA = instantanea_compartida.InstantaneaCompartida(
+    RUTA_COMPARTIDA, edad_maxima=2 * INSTANTANEAS.ttl
+) if RUTA_COMPARTIDA else None
+ESCRITOR_COMPARTIDA = instantanea_compartida.CandadoEscritor(RUTA_COMPARTIDA) if RUTA_COMPARTIDA else None
+REINTENTO_ESCRITOR = 60  # segundos entre intentos de tomar el candado del escritor
+
+def _publicar_compartida(cuerpos):
+    try:
+        tamano = instantanea_compartida.escribir(RUTA_COMPARTIDA, cuerpos)
+        print(f"[COMPARTIDA] {len(cuerpos)} municipios publicados ({tamano / 1024:.0f} KiB)")
+    except OSError as e:
+        print(f"[COMPARTIDA] No se pudo escribir {RUTA_COMPARTIDA}: {e}")
+
+def iniciar_programador():
+    """Refresco diario de las instantáneas. Con archivo compartido, sólo el
+    worker que toma el candado corre el programador, refresca cada TTL y
+    publica cada refresco; los demás siguen intentando por si ese muere."""
+    if COMPARTIDA is None:
+        INSTANTANEAS.iniciar_programador(MUNICIPIOS, HORA_REFRESCO)
+        return
+
+    def _elegir_escritor():
+        while not ESCRITOR_COMPARTIDA.tomar():
+            time.sleep(REINTENTO_ESCRITOR)
+        print(f"[COMPARTIDA] Proceso {os.getpid()} publica {RUTA_COMPARTIDA}")
+        INSTANTANEAS.iniciar_programador(MUNICIPIOS, HORA_REFRESCO, al_refrescar=_publicar_compartida,
+                                         intervalo=INSTANTANEAS.ttl)
+
+    threading.Thread(target=_elegir_escritor, name='escritor-compartida', daemon=True).start()
+
+CONCURRENCIA_HISTORICO = int(os.environ.get('SEQUIA_CONCURRENCIA_HISTORICO', 4))
+
+# La rejilla se descarga en segundo plano, en lotes que caben en la mitad de
+# la cubeta (la otra mitad queda para las consultas interactivas) y con una
+# cuota diaria propia, así que nunca agota el presupuesto de /api/analizar.
+TAMANO_LOTE_REJILLA = 100  # ubicaciones por petición (longitud de la URL)
+COSTO_LOTE_REJILLA = PRESUPUESTO.capacidad / 2
+PRESUPUESTO_REJILLA = limite_open_meteo.CuboFichas(
+    capacidad=COSTO_LOTE_REJILLA,
+    por_segundo=float(os.environ.get('SEQUIA_CUOTA_REJILLA', PRESUPUESTO.por_segundo * 86400 / 4)) / 86400.0,
+    espera_maxima=float('inf')
+)
+DIAS_RETRASO_ARCHIVO = 5  # días recientes que el archivo aún no consolida; la rejilla no los persigue
+
+def _indices_celdas(series):
+    """Índice (0-100) de cada celda; NaN si no tiene datos. Las celdas con
+    la serie completa se calculan juntas con el motor vectorizado."""
+    valores = [float('nan')] * len(series)
+    longitud = max((len(d["fechas"]) for d in series if d), default=0)
+    completas = [i for i, d in enumerate(series) if d and len(d["fechas"]) == longitud]
+    if motor_vectorizado.HAY_NUMPY and completas:
+        with metricas.etapa('motor_vectorizado'):
+            promedios, _ = motor_vectorizado.indice_sequia_matriz(
+                [series[i]["precipitacion"] for i in completas],
+                [series[i]["temperatura"] for i in completas],
+                [series[i]["evapotranspiracion"] for i in completas])
+        for i, indice in zip(completas, promedios):
+            valores[i] = float(indice) * 100
+    for i, d in enumerate(series):
+        if d and valores[i] != valores[i]:
+            valores[i] = calcular_indice_sequia(d["precipitacion"], d["temperatura"], d["evapotranspiracion"])[0] * 100
+    return valores
+
+def _estado_rejilla(paso):
+    """(malla, clave en el almacén de cada celda en orden de ráster, días
+    guardados por clave, {clave: (desde, hasta)} de lo que falta descargar).
+    Sólo lee el almacén local."""
+    malla = rejilla.Rejilla(float(paso))
+    almacen = [_clave_almacen(rejilla.clave_celda(lat, lon), {"lat": lat, "lon": lon})
+               for lat, lon in malla.centros()]
+    claves = list(dict.fromkeys(almacen))
+    fecha_inicio, fecha_fin = _rango_fechas(90)
+    consolidado = fecha_fin - timedelta(days=DIAS_RETRASO_ARCHIVO)
+    guardados = cache_meteo.leer_varios(claves, fecha_inicio, fecha_fin)
+    recientes = cache_meteo.sin_dato_reciente_varios(claves, fecha_inicio, consolidado)
+    pendientes = {}
+    for clave in claves:
+        rango = _rango_pendiente(clave, guardados[clave], fecha_inicio, consolidado, recientes[clave])
+        if rango is not None:
+            pendientes[clave] = rango
+    return malla, almacen, guardados, pendientes
+
+def _lotes_rejilla(pendientes):
+    """Agrupa {clave: (desde, hasta)} en lotes de a lo más
+    TAMANO_LOTE_REJILLA celdas cuyo costo (celdas × días de la unión de sus
+    rangos) no pasa de COSTO_LOTE_REJILLA. Devuelve [(claves, desde, hasta)]."""
+    lotes = []
+    for clave, (d, h) in sorted(pendientes.items(), key=lambda p: p[1]):
+        if lotes:
+            claves, desde, hasta = lotes[-1]
+            nuevo_desde, nuevo_hasta = min(desde, d), max(hasta, h)
+            costo = limite_open_meteo.costo_llamada(len(claves) + 1, (nuevo_hasta - nuevo_desde).days + 1)
+            if len(claves) < TAMANO_LOTE_REJILLA and costo <= COSTO_LOTE_REJILLA:
+                claves.append(clave)
+                lotes[-1] = (claves, nuevo_desde, nuevo_hasta)
+                continue
+        lotes.append(([clave], d, h))
+    return lotes
+
+def _llenar_rejilla(paso):
+    """Descarga, lote por lote, las celdas que le faltan a la rejilla. Cada
+    lote espera su cuota (PRESUPUESTO_REJILLA) y a que la cubeta general
+    tenga fichas de sobra; al terminar se recalcula el mapa."""
+    _, _, _, pendientes = _estado_rejilla(paso)
+    lotes = _lotes_rejilla(pendientes)
+    if lotes:
+        print(f"[REJILLA] {paso}: {len(pendientes)} celdas por descargar en {len(lotes)} lotes")
+    for claves, desde, hasta in lotes:
+        costo = limite_open_meteo.costo_llamada(len(claves), (hasta - desde).days + 1)
+        PRESUPUESTO_REJILLA.tomar(costo)
+        while True:
+            espera = PRESUPUESTO.espera_libre(costo, reserva=PRESUPUESTO.capacidad - COSTO_LOTE_REJILLA)
+            if espera <= 0:
+                break
+            time.sleep(espera)
+        try:
+            _series_lote({c: indice_espacial.coordenadas_de_clave(c) for c in claves}, desde, hasta,
+                         propagar_fallos=True)
+        except requests.RequestException as e:
+            # Se vuelve a intentar con la siguiente petición del mapa
+            print(f"[REJILLA] {paso}: descarga interrumpida ({e})")
+            break
+        REJILLAS.refrescar([paso])
+
+_LLENANDO_REJILLA = set()
+_CANDADO_REJILLA = threading.Lock()
+
+def _llenar_rejilla_en_segundo_plano(paso):
+    with _CANDADO_REJILLA:
+        if paso in _LLENANDO_REJILLA:
+            return
+        _LLENANDO_REJILLA.add(paso)
+
+    def _llenar():
+        try:
+            _llenar_rejilla(paso)
+        except Exception as e:
+            print(f"[REJILLA] Error al llenar la rejilla {paso}: {e}")
+        finally:
+            with _CANDADO_REJILLA:
+                _LLENANDO_REJILLA.discard(paso)
+
+    threading.Thread(target=_llenar, name=f'rejilla-{paso}', daemon=True).start()
+
+def _calcular_rejillas(pasos):
+    """Mapa de calor de cada paso (clave '0.25', ...) para AlmacenInstantaneas.
+
+    Se calcula con lo que ya está en el almacén, sin descargar; si faltan
+    celdas el mapa sale incompleto (NaN en ellas) y se lanza el llenado en
+    segundo plano."""
+    resultado = {}
+    for clave in pasos:
+        malla, almacen, guardados, pendientes = _estado_rejilla(clave)
+        if pendientes:
+            _llenar_rejilla_en_segundo_plano(clave)
+        datos = [_serie_desde_guardados(guardados[a]) if guardados[a] else None for a in almacen]
+        if not any(datos):
+            continue
+        resultado[clave] = {
+            "rejilla": malla.descripcion(),
+            "valores": _indices_celdas(datos),
+            "ultima_fecha": max(d["fechas"][-1] for d in datos if d),
+            "completa": not pendientes,
+            "celdas_con_dato": sum(1 for d in datos if d),
+        }
+    return resultado
+
+# Mapas de calor precalculados, con la misma política que las instantáneas;
+# uno incompleto se entrega pero se recalcula (del almacén) en cada petición
+REJILLAS = AlmacenInstantaneas(
+    _calcular_rejillas,
+    ttl=float(os.environ.get('SEQUIA_TTL_INSTANTANEA', 6 * 3600)),
+    nombre='rejillas',
+    completo=lambda mapa: mapa["completa"]
+)
+
+PUNTOS_MINIMOS = 50  # `?puntos=` de /api/analizar y /api/analizar_detalle; menos no alcanza para una gráfica
+DIAS_ANALISIS = 90  # ventana por defecto de /api/analizar (`?dias=`)
+DIAS_ANALISIS_LIMITES = (30, 3650)
+
+def _leer_puntos(args, formato):
+    """`?puntos=`: máximo de días por serie para las gráficas, o None."""
+    if not args.get('puntos'):
+        return None
+    try:
+        puntos = int(args['puntos'])
+    except ValueError:
+        puntos = 0
+    if puntos < PUNTOS_MINIMOS:
+        raise ValueError(f"'puntos' debe ser un entero mayor o igual a {PUNTOS_MINIMOS}")
+    if formato != 'json':
+        raise ValueError("'puntos' sólo aplica al formato json")
+    return puntos
+
+def _respuesta_analisis(cuerpo, formato='json', ubicacion=None, puntos=None):
+    fechas = cuerpo["series"]["fechas"]
+    if ubicacion is not None:
+        cuerpo = dict(cuerpo, ubicacion=ubicacion)
+    if puntos is not None and len(fechas) > puntos:
+        with metricas.etapa('submuestreo'):
+            series = submuestreo.submuestrear_series(cuerpo["series"], puntos)
+        cuerpo = dict(cuerpo, series=series, submuestreo={
+            "metodo": submuestreo.METODO, "puntos": len(series["fechas"]), "dias": len(fechas)})
+    if formato == 'compacto':
+        # Copia superficial: la instantánea guardada no se modifica
+        cuerpo = dict(cuerpo, series=formato_series.serie_compacta(
+            fechas, formato_series.columnas_de_series(cuerpo["series"])))
+    return respuesta_json(cuerpo, ultima_fecha=fechas[-1] if fechas else None)
 
 @app.route('/api/analizar')
 def analizar_sequia():
+    """Análisis de un municipio (`?municipio=X`) o de una coordenada
+    (`?lat=28.63&lon=-106.08`): por defecto la celda del reanálisis que la
+    contiene, o el municipio más cercano con `cercano=1`."""
+    try:
+        try:
+            municipio, ubicacion = _municipio_consulta(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        try:
+            formato = formato_series.elegir_formato(request.args.get('formato'), request.accept_mimetypes,
+                                                    permitidos=('json', 'compacto'))
+            puntos = _leer_puntos(request.args, formato)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        ventanas = None
+        if request.args.get('ventana'):
+            try:
+                ventanas = indice_movil.parsear_ventanas(request.args['ventana'])
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+        dias = DIAS_ANALISIS
+        if request.args.get('dias'):
+            minimo, maximo = DIAS_ANALISIS_LIMITES
+            try:
+                dias = int(request.args['dias'])
+            except ValueError:
+                dias = 0
+            if not minimo <= dias <= maximo:
+                return jsonify({"error": f"'dias' debe ser un entero entre {minimo} y {maximo}"}), 400
+        marg_val = _leer_marg()
+        if ventanas is None and marg_val is None and dias == DIAS_ANALISIS:
+            # Caso común: responder desde la instantánea compartida o la de este proceso
+            cuerpo = COMPARTIDA.obtener(municipio) if COMPARTIDA else None
+            if cuerpo is None:
+                entrada = INSTANTANEAS.obtener(municipio)
+                if entrada is None:
+                    return jsonify({"error": f"Sin datos disponibles para '{municipio}'"}), 503
+                cuerpo = entrada['cuerpo']
+            return _respuesta_analisis(cuerpo, formato, ubicacion, puntos)
+        print(f"[API] Analizando: {municipio}")
+        datos, historia = _datos_con_historia(municipio, ventanas, dias)
+        return _respuesta_analisis(_analizar_datos(municipio, datos, marg_val, ventanas=ventanas,
+                                                   historia=historia),
+                                   formato, ubicacion, puntos)
+    except limite_open_meteo.PresupuestoAgotado as e:
+        return _respuesta_sin_presupuesto(e)
+    except Exception as e:
+        print(f"[ERROR] {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/analizar_lote', methods=['GET', 'POST'])
+def analizar_lote():
+    """Analiza varios municipios con una sola consulta a Open-Meteo.
+
+    Municipios: `?municipios=Chihuahua,Juárez` o cuerpo JSON
+    `{"municipios": [...]}`; si no se indican se analizan todos."""
+    try:
+        cuerpo = request.get_json(silent=True) or {}
+        municipios = cuerpo.get('municipios')
+        if municipios is None:
+            param = request.args.get('municipios')
+            municipios = [m.strip() for m in param.split(',') if m.strip()] if param else list(MUNICIPIOS)
+        desconocidos = [m for m in municipios if m not in MUNICIPIOS]
+        if desconocidos:
+            return jsonify({"error": f"Municipios no encontrados: {', '.join(desconocidos)}"}), 400
+        print(f"[API] Analizando lote de {len(municipios)} municipios")
+        marg_val = _leer_marg()
+        series, historias = _datos_con_historia_lote(municipios)
+        calculados = _calcular_lote_vectorizado(series, marg_val)
+        resultados = []
+        errores = {}
+        for municipio in municipios:
+            if series[municipio] is None:
+                errores[municipio] = "Sin datos disponibles"
+                continue
+            resultados.append(_analizar_datos(municipio, series[municipio], marg_val, calculados.get(municipio),
+                                              historia=historias[municipio]))
+        fechas_finales = [r["series"]["fechas"][-1] for r in resultados if r["series"]["fechas"]]
+        return respuesta_json(
+            {"success": True, "total": len(resultados), "resultados": resultados, "errores": errores},
+            ultima_fecha=max(fechas_finales) if fechas_finales else None
+        )
+    except Exception as e:
+        print(f"[ERROR] {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/historico')
+def analizar_historico():
+    """Resumen de un rango largo (décadas): `?municipio=X&desde=1985-01-01&hasta=2024-12-31`.
+
+    El rango se descarga por años y se resume en línea; la respuesta trae el
+    índice, el modelo y los totales anuales y mensuales, sin series diarias."""
     try:
         municipio = request.args.get('municipio', 'Chihuahua')
         if municipio not in MUNICIPIOS:
             return jsonify({"error": f"Municipio '{municipio}' no encontrado"}), 400
-        print(f"[API] Analizando: {municipio}")
-        datos = obtener_datos_meteo(municipio)
-        indice, indice_diario_serie = calcular_indice_sequia(datos["precipitacion"], datos["temperatura"], datos["evapotranspiracion"])
-        # Llamada al modelo adicional del archivo adjunto (opcional)
-        marg_param = request.args.get('marg')
+        ayer = date.today() - timedelta(days=1)
         try:
-            marg_val = float(marg_param) if marg_param is not None else None
-        except Exception:
-            marg_val = None
+            desde = date.fromisoformat(request.args['desde'])
+            hasta = date.fromisoformat(request.args['hasta']) if request.args.get('hasta') else ayer
+        except KeyError:
+            return jsonify({"error": "Falta el parámetro 'desde' (YYYY-MM-DD)"}), 400
+        except ValueError:
+            return jsonify({"error": "Fechas inválidas; use YYYY-MM-DD"}), 400
+        hasta = min(hasta, ayer)
+        if desde < historico.FECHA_MINIMA or desde > hasta:
+            return jsonify({"error": f"Rango inválido: debe estar entre {historico.FECHA_MINIMA} y {ayer}"}), 400
+        print(f"[API] Histórico: {municipio} ({desde} a {hasta})")
+        resumen = historico.ResumenHistorico(_leer_marg())
+        bloques = historico.bloques_en_paralelo(
+            lambda inicio, fin: _serie_rango(municipio, inicio, fin),
+            historico.rangos_anuales(desde, hasta),
+            concurrencia=CONCURRENCIA_HISTORICO
+        )
+        for bloque in bloques:
+            resumen.agregar_bloque(bloque)
+        cuerpo = dict(success=True, municipio=municipio, **resumen.resultado())
+        return respuesta_json(cuerpo, ultima_fecha=cuerpo["hasta"])
+    except limite_open_meteo.PresupuestoAgotado as e:
+        return _respuesta_sin_presupuesto(e)
+    except Exception as e:
+        print(f"[ERROR] {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/rejilla')
+def mapa_calor():
+    """Índice de sequía sobre una rejilla lat/lon de Chihuahua: `?paso=0.25`.
+
+    `formato=binario` (o Accept: application/octet-stream) entrega el ráster
+    float32 (fila 0 al norte, NaN = sin dato) con la geometría en los
+    encabezados X-Rejilla-*; `formato=json` la misma información en JSON."""
+    try:
+        paso = request.args.get('paso', '0.25')
         try:
-            mean_precip = _mean(datos["precipitacion"])
-            mean_temp = _mean(datos["temperatura"])
-            historia = {
-                'precipitacion': datos['precipitacion'],
-                'temperatura': datos['temperatura']
-            }
-            modelo_res = calcular_riesgo_modelo(mean_precip, mean_temp, marg=marg_val, historia=historia)
-        except Exception as _e:
-            modelo_res = None
-        
-        # Mapear índice numérico a categoría USDM (D0-D4)
-        # Umbrales ajustados para climatología árida
-        # Rango típico en Chihuahua: 0.5 - 0.8
-        if indice < 0.35:
-            nivel_riesgo = "D0"
-            nombre_nivel = "Anormalmente Seco"
-        elif indice < 0.50:
-            nivel_riesgo = "D1"
-            nombre_nivel = "Sequía Moderada"
-        elif indice < 0.65:
-            nivel_riesgo = "D2"
-            nombre_nivel = "Sequía Severa"
-        elif indice < 0.80:
-            nivel_riesgo = "D3"
-            nombre_nivel = "Sequía Extrema"
-        else:
-            nivel_riesgo = "D4"
-            nombre_nivel = "Sequía Excepcional"
-        
-        # Preparar series diarias para las gráficas (ya son listas)
-        fechas = datos["fechas"]
-        lluvia_lista = datos["precipitacion"]
-        temperatura_lista = datos["temperatura"]
-        evapotranspiracion_lista = datos["evapotranspiracion"]
-
-        # Calcular promedio mensual de lluvia (suma por mes)
-        from collections import defaultdict
-        import datetime
-
-        mensual = defaultdict(float)
-        dias_por_mes = defaultdict(int)
-        for f, l in zip(fechas, lluvia_lista):
-            try:
-                dt = datetime.datetime.strptime(f, "%Y-%m-%d")
-            except Exception:
-                # si el formato es distinto, intentar parseo flexible
-                dt = datetime.date.fromisoformat(f)
-            key = dt.strftime("%Y-%m")
-            mensual[key] += l
-            dias_por_mes[key] += 1
-
-        # Construir lista ordenada de meses
-        meses_ordenados = sorted(mensual.keys())
-        promedio_mensual = []
-        for m in meses_ordenados:
-            # Usamos la suma total de lluvia del mes (mm)
-            promedio_mensual.append({"mes": m, "lluvia_mm": round(mensual[m], 2)})
-
-        print(f"[API] Resultado: índice={indice:.2f}, categoría={nivel_riesgo} ({nombre_nivel})")
-        return jsonify({
+            paso = str(float(paso))
+        except ValueError:
+            paso = None
+        if paso is None or float(paso) not in rejilla.PASOS:
+            return jsonify({"error": f"Paso inválido; use {', '.join(str(p) for p in rejilla.PASOS)}"}), 400
+        try:
+            formato = formato_series.elegir_formato(request.args.get('formato'), request.accept_mimetypes,
+                                                    permitidos=('json', 'binario'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        entrada = REJILLAS.obtener(paso)
+        if entrada is None:
+            # Ninguna celda guardada todavía: el llenado ya está en curso
+            respuesta = jsonify({"error": "La rejilla se está descargando; reintente en unos minutos"})
+            respuesta.status_code = 503
+            respuesta.headers["Retry-After"] = "60"
+            return respuesta
+        mapa = entrada['cuerpo']
+        geometria = mapa["rejilla"]
+        if formato == 'binario':
+            return respuesta_binaria(rejilla.raster_float32(mapa["valores"]), {
+                "X-Rejilla-Paso": str(geometria["paso"]),
+                "X-Rejilla-Filas": str(geometria["filas"]),
+                "X-Rejilla-Columnas": str(geometria["columnas"]),
+                "X-Rejilla-Norte": str(geometria["norte"]),
+                "X-Rejilla-Oeste": str(geometria["oeste"]),
+                "X-Rejilla-Fecha": mapa["ultima_fecha"],
+                "X-Rejilla-Completa": '1' if mapa["completa"] else '0',
+            }, ultima_fecha=mapa["ultima_fecha"])
+        return respuesta_json(dict(
+            geometria,
+            success=True,
+            ultima_fecha=mapa["ultima_fecha"],
+            completa=mapa["completa"],
+            celdas_con_dato=mapa["celdas_con_dato"],
+            valores=[None if v != v else round(v, 1) for v in mapa["valores"]]
+        ), ultima_fecha=mapa["ultima_fecha"])
+    except Exception as e:
+        print(f"[ERROR] {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+def _calcular_pronosticos(claves):
+    """Series del pronóstico por municipio o celda, para AlmacenInstantaneas.
+    Se descartan los días que el pronóstico trae sin valor."""
+    bloques = _descargar_pronostico_lote([_coordenadas(c) for c in claves])
+    resultado = {}
+    for clave, d in zip(claves, bloques):
+        serie = {"fechas": [], "precipitacion": [], "temperatura": [], "evapotranspiracion": []}
+        for f, p, t, e in zip(d["time"], d["precipitation_sum"], d["temperature_2m_mean"],
+                              d["et0_fao_evapotranspiration"]):
+            if p is not None and t is not None and e is not None:
+                serie["fechas"].append(f)
+                serie["precipitacion"].append(p)
+                serie["temperatura"].append(t)
+                serie["evapotranspiracion"].append(e)
+        if serie["fechas"]:
+            resultado[clave] = serie
+    return resultado
+
+# El pronóstico cambia varias veces al día: su propia caché, con TTL corto,
+# aparte del almacén del archivo (que no vence)
+PRONOSTICOS = AlmacenInstantaneas(
+    _calcular_pronosticos,
+    ttl=float(os.environ.get('SEQUIA_TTL_PRONOSTICO', 3600)),
+    nombre='pronosticos'
+)
+# Hilos para pedir el pronóstico mientras la petición lee el archivo
+EJECUTOR_PRONOSTICO = ThreadPoolExecutor(max_workers=8, thread_name_prefix='pronostico')
+
+def _proyectar(datos, pronostico):
+    """Une la ventana del archivo con los días del pronóstico posteriores a
+    ella. Devuelve (serie combinada, días del archivo)."""
+    ultima = datos["fechas"][-1]
+    inicio = next((i for i, f in enumerate(pronostico["fechas"]) if f > ultima), len(pronostico["fechas"]))
+    serie = {c: list(datos[c]) + pronostico[c][inicio:] for c in ("fechas", "precipitacion", "temperatura", "evapotranspiracion")}
+    return serie, len(datos["fechas"])
+
+@app.route('/api/pronostico')
+def analizar_pronostico():
+    """Proyección del riesgo con los próximos 16 días de pronóstico:
+    `?municipio=X` o `?lat=&lon=`.
+
+    El archivo (almacén local) y el pronóstico (instantánea con
+    `SEQUIA_TTL_PRONOSTICO`) se consultan a la vez. El índice proyectado usa
+    la ventana de 90 días que termina en el último día pronosticado; el
+    riesgo diario se normaliza sobre toda la serie, archivo y pronóstico juntos."""
+    try:
+        try:
+            municipio, ubicacion = _municipio_consulta(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        futuro = EJECUTOR_PRONOSTICO.submit(PRONOSTICOS.obtener, municipio)
+        datos = obtener_datos_meteo(municipio)
+        try:
+            entrada = futuro.result()
+        except limite_open_meteo.PresupuestoAgotado:
+            raise
+        except requests.RequestException as e:
+            # Sin pronóstico previo y Open-Meteo no respondió: no hay qué proyectar
+            print(f"[API] Pronóstico no disponible ({e})")
+            entrada = None
+        if entrada is None:
+            return jsonify({"error": f"Pronóstico no disponible para '{municipio}'"}), 503
+        serie, dias_archivo = _proyectar(datos, entrada['cuerpo'])
+        with metricas.etapa('indice'):
+            indice_actual, _ = calcular_indice_sequia(datos["precipitacion"], datos["temperatura"], datos["evapotranspiracion"])
+            ventana = len(datos["fechas"])
+            indice_proyectado, _ = calcular_indice_sequia(serie["precipitacion"][-ventana:], serie["temperatura"][-ventana:],
+                                                          serie["evapotranspiracion"][-ventana:])
+            _, riesgo_diario = calcular_indice_sequia(serie["precipitacion"], serie["temperatura"], serie["evapotranspiracion"])
+        actual = _clasificar_por_umbral(indice_actual)
+        proyectada = _clasificar_por_umbral(indice_proyectado)
+        cuerpo = {
             "success": True,
             "municipio": municipio,
-            "indice_sequia": round(indice * 100, 1),
-            "categoria": nivel_riesgo,
-            "nombre_categoria": nombre_nivel,
-            "modelo": {
-                "riesgo_modelo": round(modelo_res['riesgo'] * 100, 1) if modelo_res else None,
-                "categoria_modelo": modelo_res['categoria'] if modelo_res else None,
-                "nombre_categoria_modelo": modelo_res['nombre_categoria'] if modelo_res else None
-            },
-            "datos": {
-                "precipitacion_promedio": _mean(datos["precipitacion"]),
-                "temperatura_promedio": _mean(datos["temperatura"]),
-                "evapotranspiracion_promedio": _mean(datos["evapotranspiracion"])
+            "indice_actual": round(indice_actual * 100, 1),
+            "categoria_actual": actual["categoria"],
+            "indice_proyectado": round(indice_proyectado * 100, 1),
+            "categoria_proyectada": proyectada["categoria"],
+            "nombre_categoria_proyectada": proyectada["nombre"],
+            "horizonte": {
+                "desde": serie["fechas"][dias_archivo] if len(serie["fechas"]) > dias_archivo else None,
+                "hasta": serie["fechas"][-1],
+                "dias": len(serie["fechas"]) - dias_archivo,
             },
+            "pronostico_generado": datetime.fromtimestamp(entrada['marca_tiempo']).isoformat(timespec='seconds'),
             "series": {
-                "fechas": fechas,
-                "lluvia_mm": lluvia_lista,
-                "temperatura_c": temperatura_lista,
-                "evapotranspiracion_mm": evapotranspiracion_lista,
-                "riesgo_diario": [round(val * 100, 1) for val in indice_diario_serie] # Nueva serie de riesgo
+                "fechas": serie["fechas"],
+                "lluvia_mm": serie["precipitacion"],
+                "temperatura_c": serie["temperatura"],
+                "evapotranspiracion_mm": serie["evapotranspiracion"],
+                "riesgo_diario": [round(v * 100, 1) for v in riesgo_diario],
+                # Los primeros `dias_archivo` días son observados; el resto, pronóstico
+                "dias_archivo": dias_archivo,
             },
-            "promedio_mensual": promedio_mensual
-        })
+        }
+        if ubicacion is not None:
+            cuerpo["ubicacion"] = ubicacion
+        return respuesta_json(cuerpo, ultima_fecha=datos["fechas"][-1])
+    except limite_open_meteo.PresupuestoAgotado as e:
+        return _respuesta_sin_presupuesto(e)
+    except Exception as e:
+        print(f"[ERROR] {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+AGREGADOS = agregados.CacheAgregados()
+
+def _bloques_rango(municipio, desde, hasta):
+    """Bloques anuales de [desde, hasta] en orden, descargados en paralelo."""
+    return historico.bloques_en_paralelo(
+        lambda inicio, fin: _serie_rango(municipio, inicio, fin),
+        historico.rangos_anuales(desde, hasta),
+        concurrencia=CONCURRENCIA_HISTORICO)
+
+def _serie_larga(municipio, desde, hasta):
+    """Serie diaria completa de [desde, hasta], descargada por años en paralelo."""
+    serie = {"fechas": [], "precipitacion": [], "temperatura": [], "evapotranspiracion": []}
+    for bloque in _bloques_rango(municipio, desde, hasta):
+        for clave, valores in serie.items():
+            valores.extend(bloque[clave])
+    return serie
+
+def _calcular_agregados(serie):
+    _, riesgo = calcular_indice_sequia(serie["precipitacion"], serie["temperatura"], serie["evapotranspiracion"])
+    return agregados.redondear(agregados.agregar(serie["fechas"], {
+        "precipitacion": serie["precipitacion"],
+        "temperatura": serie["temperatura"],
+        "evapotranspiracion": serie["evapotranspiracion"],
+        "riesgo": [r * 100 for r in riesgo],
+    }))
+
+@app.route('/api/agregados')
+def analizar_agregados():
+    """Sumas, medias y extremos por semana, mes, temporada y año:
+    `?municipio=X&desde=2015-01-01&hasta=2024-12-31&resolucion=mensual,anual`.
+
+    Por defecto, el último año y todas las resoluciones. Los agregados se
+    guardan en memoria por versión de la serie."""
+    try:
+        municipio = request.args.get('municipio', 'Chihuahua')
+        if municipio not in MUNICIPIOS:
+            return jsonify({"error": f"Municipio '{municipio}' no encontrado"}), 400
+        resoluciones = [r.strip() for r in request.args.get('resolucion', ','.join(agregados.RESOLUCIONES)).split(',') if r.strip()]
+        invalidas = [r for r in resoluciones if r not in agregados.RESOLUCIONES]
+        if invalidas or not resoluciones:
+            return jsonify({"error": f"Resolución inválida; use {', '.join(agregados.RESOLUCIONES)}"}), 400
+        ayer = date.today() - timedelta(days=1)
+        try:
+            hasta = min(date.fromisoformat(request.args['hasta']), ayer) if request.args.get('hasta') else ayer
+            desde = date.fromisoformat(request.args['desde']) if request.args.get('desde') else hasta - timedelta(days=364)
+        except ValueError:
+            return jsonify({"error": "Fechas inválidas; use YYYY-MM-DD"}), 400
+        if desde < historico.FECHA_MINIMA or desde > hasta:
+            return jsonify({"error": f"Rango inválido: debe estar entre {historico.FECHA_MINIMA} y {ayer}"}), 400
+        serie = _serie_larga(municipio, desde, hasta)
+        if not serie["fechas"]:
+            return jsonify({"error": f"Sin datos disponibles para '{municipio}'"}), 503
+        version = AGREGADOS.version(municipio, serie["fechas"])
+        metricas.registrar_cache('agregados', 'acierto' if AGREGADOS.contiene(version) else 'fallo')
+        with metricas.etapa('agregados'):
+            resultado = AGREGADOS.obtener(version, lambda: _calcular_agregados(serie))
+        return respuesta_json({
+            "success": True,
+            "municipio": municipio,
+            "desde": serie["fechas"][0],
+            "hasta": serie["fechas"][-1],
+            "agregados": {r: resultado[r] for r in resoluciones}
+        }, ultima_fecha=serie["fechas"][-1])
+    except limite_open_meteo.PresupuestoAgotado as e:
+        return _respuesta_sin_presupuesto(e)
     except Exception as e:
         print(f"[ERROR] {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+# En despliegues con gunicorn el programador se activa con SEQUIA_PROGRAMADOR=1
+if os.environ.get('SEQUIA_PROGRAMADOR') == '1':
+    iniciar_programador()
+
 if __name__ == "__main__":
     print("=" * 60)
     print("API DE SEQUÍA - OPEN-METEO")
@@ -295,5 +1402,9 @@ if __name__ == "__main__":
     print("\nPrueba los endpoints:")
     print("  - GET /api/municipios")
     print("  - GET /api/analizar?municipio=Chihuahua")
+    print("  - GET /api/analizar_lote?municipios=Chihuahua,Juárez")
+    print("  - GET /api/historico?municipio=Chihuahua&desde=1990-01-01")
+    print("  - GET /api/pronostico?municipio=Chihuahua")
     print("\n" + "=" * 60 + "\n")
+    iniciar_programador()
     app.run(debug=False, port=5000, host='0.0.0.0', use_reloader=False)
@@ -0,0 +1,332 @@
+"""Modo de servicio asíncrono (ASGI) para la API de sequía.
+
+Con Flask síncrono una consulta lenta a Open-Meteo ocupa un hilo del
+servidor todo el tiempo que tarda. Aquí las rutas que consultan Open-Meteo
+primero esperan (`await`) la descarga de los días faltantes con un cliente
+HTTP asíncrono compartido (httpx, con tiempos límite de conexión y lectura)
+y la guardan en el almacén local; después la petición pasa a la aplicación
+Flask de `api.py`, que ya encuentra todos los días guardados y responde en
+milisegundos sin tocar la red. Todas las demás rutas pasan directo a Flask.
+
+Así cientos de análisis pueden estar esperando a Open-Meteo en un solo
+proceso sin agotar hilos, y las respuestas son idénticas a las del modo
+síncrono (instantáneas, ETag, formatos, etc.).
+
+Flask corre en un pool de hilos propio (`SEQUIA_HILOS_FLASK`, por defecto
+32): algunas rutas todavía pueden bloquear (la espera del presupuesto, una
+rejilla o un pronóstico en frío, los agregados, un NDJSON por rango) y con
+el adaptador de asgiref tal cual todas las peticiones compartirían un solo
+hilo, de modo que una ruta lenta detendría al servidor completo.
+
+Uso (requiere httpx, asgiref y uvicorn):
+
+    uvicorn api_async:app --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs
+
+import httpx
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+
+import api
+import cache_meteo
+import historico
+import indice_movil
+import limite_open_meteo
+import metricas
+
+TIMEOUT_ASYNC = httpx.Timeout(20.0, connect=5.0)  # lectura/escritura 20 s, conexión 5 s
+LIMITES_ASYNC = httpx.Limits(
+    max_connections=int(os.environ.get('SEQUIA_MAX_CONEXIONES', 50)),
+    max_keepalive_connections=20
+)
+
+HILOS_FLASK = int(os.environ.get('SEQUIA_HILOS_FLASK', 32))
+
+_cliente: Optional[httpx.AsyncClient] = None
+_vuelos = limite_open_meteo.VueloUnicoAsync()
+_ejecutor_flask = ThreadPoolExecutor(max_workers=HILOS_FLASK, thread_name_prefix='flask')
+
+
+class _InstanciaWsgi(WsgiToAsgiInstance):
+    """`WsgiToAsgiInstance` que llama a la aplicación WSGI en `_ejecutor_flask`.
+
+    asgiref la corre con `sync_to_async(thread_sensitive=True)`, es decir,
+    todas las peticiones en el mismo hilo, una tras otra."""
+
+    async def run_wsgi_app(self, body):
+        await sync_to_async(self._llamar_wsgi, thread_sensitive=False, executor=_ejecutor_flask)(body)
+
+    def _llamar_wsgi(self, body):
+        # Lo mismo que WsgiToAsgiInstance.run_wsgi_app (sin Content-Length
+        # parcial, que Flask no produce) y cerrando la respuesta al terminar
+        try:
+            environ = self.build_environ(self.scope, body)
+        except ValueError:
+            # Demasiados encabezados repetidos
+            self.sync_send({"type": "http.response.start", "status": 400,
+                            "headers": [(b"content-type", b"text/plain")]})
+            self.sync_send({"type": "http.response.body", "body": b"Bad Request"})
+            return
+        salida = self.wsgi_application(environ, self.start_response)
+        try:
+            for parte in salida:
+                if not self.response_started:
+                    self.response_started = True
+                    self.sync_send(self.response_start)
+                self.sync_send({"type": "http.response.body", "body": parte, "more_body": True})
+        finally:
+            if hasattr(salida, 'close'):
+                salida.close()
+        if not self.response_started:
+            self.response_started = True
+            self.sync_send(self.response_start)
+        self.sync_send({"type": "http.response.body"})
+
+
+class _FlaskEnPool(WsgiToAsgi):
+    async def __call__(self, scope, receive, send):
+        await _InstanciaWsgi(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+
+# Para cuando Flask recibe la petición, la mayoría de las rutas sólo leen el
+# almacén local y calculan, sin esperar a la red
+_flask = _FlaskEnPool(api.app)
+
+
+def _cliente_http() -> httpx.AsyncClient:
+    global _cliente
+    if _cliente is None:
+        _cliente = httpx.AsyncClient(timeout=TIMEOUT_ASYNC, limits=LIMITES_ASYNC)
+    return _cliente
+
+
+async def _descargar_archivo_lote_async(lista_coords, fecha_inicio, fecha_fin):
+    """Como `api._descargar_archivo_lote`: una ubicación por celda, un solo
+    vuelo por consulta idéntica y el mismo presupuesto de cuota que el modo síncrono."""
+    celdas, posiciones = api._agrupar_por_celda(lista_coords)
+
+    async def _consultar():
+        try:
+            await api.PRESUPUESTO.tomar_async(api._costo_consulta(celdas, fecha_inicio, fecha_fin))
+            with metricas.etapa('descarga'):
+                respuesta = await _cliente_http().get(
+                    api.URL_ARCHIVO, params=api._params_archivo(celdas, fecha_inicio, fecha_fin))
+                respuesta.raise_for_status()
+            with metricas.etapa('decodificacion_json'):
+                return api._bloques_respuesta(respuesta.json())
+        except (limite_open_meteo.PresupuestoAgotado, httpx.HTTPError, ValueError) as e:
+            metricas.ERRORES_OPEN_METEO.incrementar(tipo=_tipo_error(e))
+            raise
+    bloques = await _vuelos.ejecutar(api._clave_consulta(celdas, fecha_inicio, fecha_fin), _consultar)
+    return [bloques[i] for i in posiciones]
+
+
+def _tipo_error(e):
+    if isinstance(e, limite_open_meteo.PresupuestoAgotado):
+        return 'cuota'
+    if isinstance(e, httpx.TimeoutException):
+        return 'tiempo_agotado'
+    if isinstance(e, httpx.HTTPStatusError):
+        return f'http_{e.response.status_code}'
+    if isinstance(e, httpx.TransportError):
+        return 'conexion'
+    if isinstance(e, ValueError):
+        return 'decodificacion'
+    return 'otro'
+
+
+def _pendientes(municipios: List[str], fecha_inicio: date, fecha_fin: date) -> Dict[str, tuple]:
+    """{municipio: (desde, hasta)} con lo que falta en el almacén (lectura local)."""
+    faltantes = {}
+    for municipio in municipios:
+        clave = api._clave_almacen(municipio)
+        guardados = cache_meteo.leer_dias(clave, fecha_inicio, fecha_fin)
+        rango = api._rango_pendiente(clave, guardados, fecha_inicio, fecha_fin)
+        if rango is not None:
+            faltantes[municipio] = rango
+    return faltantes
+
+
+def _guardar_bloques(municipios, bloques):
+    for municipio, datos_diarios in zip(municipios, bloques):
+        api._guardar_bloque(api._clave_almacen(municipio), datos_diarios)
+
+
+def _registrar_fallo(municipios, desde, hasta):
+    for municipio in municipios:
+        cache_meteo.registrar_sin_dato(api._clave_almacen(municipio), cache_meteo.fechas_rango(desde, hasta))
+
+
+async def asegurar_datos(municipios: List[str], fecha_inicio: date, fecha_fin: date):
+    """Descarga de forma asíncrona (una petición multi-ubicación) los días
+    que faltan en el almacén para los municipios (o celdas) y el rango indicados."""
+    faltantes = await asyncio.to_thread(_pendientes, municipios, fecha_inicio, fecha_fin)
+    if not faltantes:
+        return
+    pendientes = list(faltantes)
+    desde = min(r[0] for r in faltantes.values())
+    hasta = max(r[1] for r in faltantes.values())
+    print(f"[ASYNC] Consultando Open-Meteo para {len(pendientes)} municipios ({desde} a {hasta})...")
+    try:
+        bloques = await _descargar_archivo_lote_async([api._coordenadas(m) for m in pendientes], desde, hasta)
+    except limite_open_meteo.PresupuestoAgotado as e:
+        # No se consultó nada; Flask responde con lo guardado o con 503
+        print(f"[ASYNC] {e}")
+        return
+    except (httpx.HTTPError, ValueError) as e:
+        # Se anota el fallo para que Flask no reintente de forma bloqueante
+        print(f"[ASYNC] Open-Meteo no respondió ({e})")
+        await asyncio.to_thread(_registrar_fallo, pendientes, desde, hasta)
+        return
+    await asyncio.to_thread(_guardar_bloques, pendientes, bloques)
+
+
+async def _asegurar_historico(municipio: str, desde: date, hasta: date):
+    """Descarga por años, con la misma concurrencia que el modo síncrono."""
+    limite = asyncio.Semaphore(api.CONCURRENCIA_HISTORICO)
+
+    async def _bloque(inicio, fin):
+        async with limite:
+            await asegurar_datos([municipio], inicio, fin)
+
+    await asyncio.gather(*(_bloque(i, f) for i, f in historico.rangos_anuales(desde, hasta)))
+
+
+def _pronostico(municipio: str):
+    """Llena la instantánea del pronóstico; si falla, Flask reintenta y responde el error."""
+    try:
+        api.PRONOSTICOS.obtener(municipio)
+    except Exception as e:
+        print(f"[ASYNC] Pronóstico no disponible ({e})")
+
+
+def _uno(params, nombre, defecto=None):
+    valores = params.get(nombre)
+    return valores[0] if valores else defecto
+
+
+async def _prefetch(ruta: str, params: Dict[str, List[str]], cuerpo: bytes):
+    """Asegura en el almacén los datos que necesitará la ruta de Flask.
+
+    Los parámetros inválidos se ignoran aquí: Flask devuelve el error."""
+    if ruta in ('/api/analizar', '/api/analizar_detalle'):
+        municipio = _uno(params, 'municipio', 'Chihuahua')
+        if ruta == '/api/analizar':
+            try:
+                consulta = api._ubicacion_consulta({k: v[0] for k, v in params.items()})
+            except ValueError:
+                return
+            if consulta is not None:
+                municipio = consulta[0]  # municipio más cercano o celda del reanálisis
+            elif municipio not in api.MUNICIPIOS:
+                return
+        elif municipio not in api.MUNICIPIOS or _uno(params, 'desde') or _uno(params, 'hasta'):
+            # Con rango, Flask lo descarga por años (y con ndjson lo envía conforme llega)
+            return
+        ventanas = None
+        dias = 90
+        if ruta == '/api/analizar':
+            try:
+                if _uno(params, 'ventana'):
+                    ventanas = indice_movil.parsear_ventanas(_uno(params, 'ventana'))
+                dias = int(_uno(params, 'dias') or api.DIAS_ANALISIS)
+            except ValueError:
+                return
+            if not api.DIAS_ANALISIS_LIMITES[0] <= dias <= api.DIAS_ANALISIS_LIMITES[1]:
+                return
+            # Los días consultados y, antes, los del SPI/SPEI o de la ventana mayor (ver _datos_con_historia)
+            dias += api._dias_previos(ventanas)
+        await asegurar_datos([municipio], *api._rango_fechas(dias))
+    elif ruta == '/api/analizar_lote':
+        municipios = None
+        if cuerpo:
+            try:
+                municipios = json.loads(cuerpo).get('municipios')
+            except (ValueError, AttributeError):
+                municipios = None
+        if municipios is None:
+            texto = _uno(params, 'municipios')
+            municipios = [m.strip() for m in texto.split(',') if m.strip()] if texto else list(api.MUNICIPIOS)
+        municipios = [m for m in municipios if m in api.MUNICIPIOS]
+        if municipios:
+            await asegurar_datos(municipios, *api._rango_fechas(90 + api._dias_previos()))
+    elif ruta == '/api/pronostico':
+        try:
+            municipio, _ = api._municipio_consulta({k: v[0] for k, v in params.items()})
+        except ValueError:
+            return
+        # Archivo y pronóstico a la vez, como en el modo síncrono
+        await asyncio.gather(asegurar_datos([municipio], *api._rango_fechas(90)),
+                             asyncio.to_thread(_pronostico, municipio))
+    elif ruta == '/api/historico':
+        municipio = _uno(params, 'municipio', 'Chihuahua')
+        ayer = date.today() - timedelta(days=1)
+        try:
+            desde = date.fromisoformat(_uno(params, 'desde'))
+            hasta = min(date.fromisoformat(_uno(params, 'hasta', ayer.isoformat())), ayer)
+        except (TypeError, ValueError):
+            return
+        if municipio in api.MUNICIPIOS and historico.FECHA_MINIMA <= desde <= hasta:
+            await _asegurar_historico(municipio, desde, hasta)
+
+
+async def _leer_cuerpo(receive) -> bytes:
+    partes = []
+    while True:
+        mensaje = await receive()
+        partes.append(mensaje.get('body', b''))
+        if not mensaje.get('more_body'):
+            return b''.join(partes)
+
+
+async def _ciclo_de_vida(receive, send):
+    while True:
+        mensaje = await receive()
+        if mensaje['type'] == 'lifespan.startup':
+            _cliente_http()
+            if os.environ.get('SEQUIA_PROGRAMADOR') == '1':
+                api.iniciar_programador()
+            await send({'type': 'lifespan.startup.complete'})
+        elif mensaje['type'] == 'lifespan.shutdown':
+            global _cliente
+            if _cliente is not None:
+                await _cliente.aclose()
+                _cliente = None
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """Aplicación ASGI."""
+    if scope['type'] == 'lifespan':
+        await _ciclo_de_vida(receive, send)
+        return
+    if scope['type'] != 'http' or not scope['path'].startswith('/api/'):
+        await _flask(scope, receive, send)
+        return
+
+    cuerpo = await _leer_cuerpo(receive)
+    params = parse_qs(scope.get('query_string', b'').decode('utf-8'))
+    try:
+        await _prefetch(scope['path'], params, cuerpo)
+    except Exception as e:
+        print(f"[ASYNC] Error al preparar datos: {e}")
+
+    entregado = False
+
+    async def _reenviar():
+        # Flask vuelve a leer el cuerpo ya consumido
+        nonlocal entregado
+        if entregado:
+            return {'type': 'http.disconnect'}
+        entregado = True
+        return {'type': 'http.request', 'body': cuerpo, 'more_body': False}
+
+    await _flask(scope, _reenviar, send)
@@ -0,0 +1,230 @@
+"""Benchmarks del servicio de sequía con líneas base en JSON.
+
+Mide las funciones de cálculo y el camino completo de `/api/analizar`
+contra el simulador local de Open-Meteo (`stub_open_meteo.py`), sin red:
+
+- indice_sequia_N, riesgo_modelo_N, algebra_lineal_N, promedio_mensual_N:
+  funciones puras sobre series de N días (90, 365 y 3650).
+- riesgo_entrenado_N: el modelo con coeficientes ya entrenados
+  (`modelos_riesgo.py`), para comparar con riesgo_modelo_N.
+- analizar_frio_N: almacén vacío → consulta al simulador → índice, modelo,
+  agregados → respuesta JSON comprimida (lo mismo que hace /api/analizar).
+- analizar_caliente_N: igual con los días ya guardados en el almacén.
+- ruta_analizar_N: petición GET a /api/analizar?dias=N (cliente de pruebas
+  de Flask) con el almacén lleno: lo mismo que analizar_caliente_N más el
+  enrutamiento, la validación y los días previos del SPI/SPEI.
+- pronostico_frio: GET a /api/pronostico con el almacén y la caché del
+  pronóstico vacíos; el archivo y el pronóstico se piden a la vez, así que
+  debe tardar como analizar_frio_90, no el doble.
+
+Cada caso se repite `--repeticiones` veces; se reportan la mediana y el
+mínimo en milisegundos.
+
+    py benchmarks/medir.py --guardar benchmarks/linea_base.json
+    py benchmarks/medir.py --comparar benchmarks/linea_base.json --tolerancia 0.25
+
+Con `--comparar` el código de salida es 1 si algún caso es más lento que la
+línea base por encima de la tolerancia (mediana).
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+DIR_BENCH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(DIR_BENCH))
+sys.path.insert(0, DIR_BENCH)
+
+import stub_open_meteo  # noqa: E402
+
+TAMANOS = (90, 365, 3650)
+MUNICIPIO = "Chihuahua"
+COORDENADAS = {"lat": 28.63, "lon": -106.08}  # las de MUNICIPIO en api.MUNICIPIOS
+
+
+def _series(dias: int) -> Dict[str, List]:
+    c = COORDENADAS
+    fin = date.today() - timedelta(days=1)
+    diario = stub_open_meteo.bloque_diario(c["lat"], c["lon"], fin - timedelta(days=dias - 1), fin)
+    return {
+        "fechas": diario["time"],
+        "precipitacion": diario["precipitation_sum"],
+        "temperatura": diario["temperature_2m_mean"],
+        "evapotranspiracion": diario["et0_fao_evapotranspiration"],
+    }
+
+
+def _medir(funcion: Callable[[], Any], repeticiones: int,
+           preparar: Optional[Callable[[], None]] = None) -> Dict[str, float]:
+    tiempos = []
+    with open(os.devnull, 'w') as nulo, redirect_stdout(nulo):
+        for _ in range(repeticiones):
+            if preparar:
+                preparar()
+            inicio = time.perf_counter()
+            funcion()
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+    return {"mediana_ms": round(statistics.median(tiempos), 3),
+            "minimo_ms": round(min(tiempos), 3),
+            "repeticiones": repeticiones}
+
+
+def _casos(api, analisis_sequia, repeticiones: int, filtro: Optional[str]) -> Dict[str, Dict[str, float]]:
+    casos: Dict[str, Callable[[], Dict[str, float]]] = {}
+    coeficientes = {"estadistico": {"beta0": 0.9, "beta1": -0.02},
+                    "algebra": {"precipitacion": -0.01, "temperatura": 0.01, "intercepto": 0.6}}
+
+    for n in TAMANOS:
+        s = _series(n)
+        p, t, e = s["precipitacion"], s["temperatura"], s["evapotranspiracion"]
+        historia = {"precipitacion": p, "temperatura": t}
+        X = [[p[i], t[i], 0.5] for i in range(n)]
+        y = [1 if v < 20 else 0 for v in p]
+        casos[f"indice_sequia_{n}"] = lambda p=p, t=t, e=e: _medir(
+            lambda: api.calcular_indice_sequia(p, t, e), repeticiones)
+        casos[f"riesgo_modelo_{n}"] = lambda p=p, t=t, h=historia: _medir(
+            lambda: analisis_sequia.calcular_riesgo_modelo(sum(p) / len(p), sum(t) / len(t), 0.5, h), repeticiones)
+        casos[f"riesgo_entrenado_{n}"] = lambda p=p, t=t, h=historia: _medir(
+            lambda: analisis_sequia.riesgo_con_coeficientes(coeficientes, sum(p) / len(p), sum(t) / len(t), h),
+            repeticiones)
+        casos[f"algebra_lineal_{n}"] = lambda X=X, y=y: _medir(
+            lambda: analisis_sequia.modelo_algebra_lineal(10.0, 25.0, 0.5, X=X, y=y), repeticiones)
+        casos[f"promedio_mensual_{n}"] = lambda s=s: _medir(
+            lambda: api._promedio_mensual(s["fechas"], s["precipitacion"]), repeticiones)
+
+    directorio = tempfile.mkdtemp(prefix='bench_sequia_')
+    contador = [0]
+
+    def _almacen_vacio():
+        contador[0] += 1
+        api.cache_meteo.RUTA_CACHE = os.path.join(directorio, f"frio_{contador[0]}.sqlite3")
+
+    def _ronda(n):
+        with api.app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+            datos = api.obtener_datos_meteo(MUNICIPIO, dias=n)
+            api._respuesta_analisis(api._analizar_datos(MUNICIPIO, datos))
+
+    for n in TAMANOS:
+        casos[f"analizar_frio_{n}"] = lambda n=n: _medir(lambda: _ronda(n), repeticiones, _almacen_vacio)
+
+    def _caliente(n):
+        api.cache_meteo.RUTA_CACHE = os.path.join(directorio, "caliente.sqlite3")
+        with open(os.devnull, 'w') as nulo, redirect_stdout(nulo):
+            _ronda(n)  # llena el almacén
+        return _medir(lambda: _ronda(n), repeticiones)
+
+    for n in TAMANOS:
+        casos[f"analizar_caliente_{n}"] = lambda n=n: _caliente(n)
+
+    def _ruta(n):
+        api.cache_meteo.RUTA_CACHE = os.path.join(directorio, "caliente.sqlite3")
+        cliente = api.app.test_client()
+        # Con `marg` no sale de la instantánea (ni con dias=90)
+        url = f"/api/analizar?municipio={MUNICIPIO}&dias={n}&marg=0.5"
+        with open(os.devnull, 'w') as nulo, redirect_stdout(nulo):
+            cliente.get(url)  # llena el almacén (incluidos los días previos)
+        return _medir(lambda: cliente.get(url, headers={"Accept-Encoding": "gzip"}), repeticiones)
+
+    for n in TAMANOS:
+        casos[f"ruta_analizar_{n}"] = lambda n=n: _ruta(n)
+
+    def _pronostico_vacio():
+        _almacen_vacio()
+        api.PRONOSTICOS = api.AlmacenInstantaneas(api._calcular_pronosticos, ttl=api.PRONOSTICOS.ttl,
+                                                  nombre='pronosticos')
+
+    def _pronostico():
+        cliente = api.app.test_client()
+        return _medir(lambda: cliente.get(f"/api/pronostico?municipio={MUNICIPIO}",
+                                          headers={"Accept-Encoding": "gzip"}), repeticiones, _pronostico_vacio)
+
+    casos["pronostico_frio"] = _pronostico
+
+    resultados = {}
+    for nombre, caso in casos.items():
+        if filtro and filtro not in nombre:
+            continue
+        resultados[nombre] = caso()
+        print(f"{nombre:<28} mediana {resultados[nombre]['mediana_ms']:>10.3f} ms", file=sys.stderr)
+    return resultados
+
+
+def comparar(actual: Dict[str, Any], base: Dict[str, Any], tolerancia: float) -> List[str]:
+    """Imprime la comparación y devuelve los casos con regresión."""
+    regresiones = []
+    print(f"{'caso':<28} {'base ms':>10} {'actual ms':>10} {'razón':>7}")
+    for nombre, medida in actual["casos"].items():
+        previa = base.get("casos", {}).get(nombre)
+        if previa is None:
+            print(f"{nombre:<28} {'-':>10} {medida['mediana_ms']:>10.3f}")
+            continue
+        razon = medida["mediana_ms"] / max(previa["mediana_ms"], 1e-6)
+        marca = ""
+        if razon > 1 + tolerancia:
+            marca = "  ← REGRESIÓN"
+            regresiones.append(nombre)
+        print(f"{nombre:<28} {previa['mediana_ms']:>10.3f} {medida['mediana_ms']:>10.3f} {razon:>7.2f}{marca}")
+    return regresiones
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Benchmarks del servicio de sequía')
+    parser.add_argument('--repeticiones', type=int, default=5)
+    parser.add_argument('--retraso', type=float, default=0.05, help='Latencia simulada de Open-Meteo (s)')
+    parser.add_argument('--dias-sin-dato', type=int, default=5,
+                        help='Días más recientes sin consolidar en el archivo simulado (nulos, como el real)')
+    parser.add_argument('--filtro', default=None, help='Sólo casos cuyo nombre contenga este texto')
+    parser.add_argument('--guardar', default=None, help='Escribir los resultados como línea base (JSON)')
+    parser.add_argument('--comparar', default=None, help='Línea base (JSON) contra la cual comparar')
+    parser.add_argument('--tolerancia', type=float, default=0.25, help='Lentitud relativa aceptada (0.25 = 25 %%)')
+    args = parser.parse_args()
+
+    if not stub_open_meteo.hay_grabacion(COORDENADAS["lat"], COORDENADAS["lon"]):
+        print(f"Aviso: no hay grabación para {MUNICIPIO}; se usa la serie sintética", file=sys.stderr)
+    _, url = stub_open_meteo.iniciar(retraso=args.retraso, dias_sin_dato=args.dias_sin_dato)
+    # Antes de importar api: apuntar al simulador y no limitar la cuota
+    os.environ['SEQUIA_URL_ARCHIVO'] = url
+    os.environ['SEQUIA_URL_PRONOSTICO'] = url.replace('/v1/archive', '/v1/forecast')
+    os.environ['SEQUIA_CACHE_DB'] = os.path.join(tempfile.mkdtemp(prefix='bench_sequia_'), 'inicial.sqlite3')
+    os.environ.setdefault('SEQUIA_CUOTA_DIARIA', str(10 ** 9))
+    os.environ.setdefault('SEQUIA_RAFAGA_OPEN_METEO', str(10 ** 9))
+    import analisis_sequia
+    import api
+    import motor_vectorizado
+
+    actual = {
+        "fecha": datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "numpy": motor_vectorizado.HAY_NUMPY,
+        "retraso_simulado_s": args.retraso,
+        "dias_sin_dato": args.dias_sin_dato,
+        "grabaciones": stub_open_meteo.celdas_grabadas(),
+        "casos": _casos(api, analisis_sequia, args.repeticiones, args.filtro),
+    }
+    if args.guardar:
+        with open(args.guardar, 'w', encoding='utf-8') as f:
+            json.dump(actual, f, ensure_ascii=False, indent=2)
+        print(f"Línea base guardada en {args.guardar}", file=sys.stderr)
+    if args.comparar:
+        with open(args.comparar, 'r', encoding='utf-8') as f:
+            base = json.load(f)
+        regresiones = comparar(actual, base, args.tolerancia)
+        if regresiones:
+            print(f"\n{len(regresiones)} caso(s) con regresión: {', '.join(regresiones)}")
+            return 1
+    elif not args.guardar:
+        json.dump(actual, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main_cli())
@@ -0,0 +1,238 @@
+"""Simulador local del archivo y del pronóstico de Open-Meteo para los benchmarks.
+
+Responde `GET /v1/archive` y `GET /v1/forecast` con el mismo formato que
+archive-api.open-meteo.com y api.open-meteo.com (un objeto por ubicación, o
+una lista si se piden varias) y con un retraso configurable que imita la
+latencia real. El pronóstico cubre `past_days` días antes de hoy y
+`forecast_days` desde hoy, con los mismos datos que el archivo.
+
+Los datos salen de las grabaciones de `benchmarks/grabaciones/` (un JSON por
+celda del reanálisis con el bloque `daily` de Open-Meteo). Como el archivo
+real, cualquier coordenada de una celda recibe la grabación de esa celda:
+la API pide los centros de celda y las grabaciones se hacen con las
+coordenadas de los municipios. Las fechas fuera del periodo grabado se toman
+del mismo día de otro año grabado; las celdas sin grabación reciben una
+serie sintética determinista, así que el simulador funciona sin red.
+
+El archivo real tarda unos días en consolidar el reanálisis y responde esos
+últimos días con valores nulos; `--dias-sin-dato N` hace lo mismo con los N
+días más recientes (hasta ayer), para recorrer el camino de los días sin
+dato de la API. El pronóstico siempre trae valores.
+
+El repositorio trae una muestra pequeña (Chihuahua, Juárez y Cuauhtémoc,
+2023) para que los benchmarks recorran el camino de las grabaciones; el
+campo `fuente` de cada archivo dice de dónde salió. `--grabar` la reemplaza
+con datos reales del archivo.
+
+    py benchmarks/stub_open_meteo.py --puerto 8099 --retraso 0.2
+    py benchmarks/stub_open_meteo.py --puerto 8099 --dias-sin-dato 5
+    py benchmarks/stub_open_meteo.py --grabar --desde 2015-01-01 --hasta 2024-12-31
+
+Para usarlo con la API: SEQUIA_URL_ARCHIVO=http://127.0.0.1:8099/v1/archive y
+SEQUIA_URL_PRONOSTICO=http://127.0.0.1:8099/v1/forecast
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+DIR_GRABACIONES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'grabaciones')
+VARIABLES = ("precipitation_sum", "temperature_2m_mean", "et0_fao_evapotranspiration")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from indice_espacial import celda_reanalisis  # noqa: E402  (misma malla que la API)
+
+
+def _nombre_grabacion(lat: float, lon: float) -> str:
+    """Archivo de la celda del reanálisis que contiene (lat, lon)."""
+    lat, lon = celda_reanalisis(lat, lon)
+    return os.path.join(DIR_GRABACIONES, f"{lat:.4f}_{lon:.4f}.json")
+
+
+class _Grabaciones:
+    """Grabaciones cargadas en memoria, indexadas por fecha."""
+
+    def __init__(self):
+        self._por_ubicacion: Dict[Tuple[float, float], Optional[Dict[str, Tuple]]] = {}
+        self._candado = threading.Lock()
+
+    def _cargar(self, lat: float, lon: float) -> Optional[Dict[str, Tuple]]:
+        ruta = _nombre_grabacion(lat, lon)
+        if not os.path.exists(ruta):
+            return None
+        with open(ruta, 'r', encoding='utf-8') as f:
+            diario = json.load(f)["daily"]
+        return {f: tuple(diario[v][i] for v in VARIABLES) for i, f in enumerate(diario["time"])}
+
+    def dias(self, lat: float, lon: float) -> Optional[Dict[str, Tuple]]:
+        clave = celda_reanalisis(lat, lon)
+        with self._candado:
+            if clave not in self._por_ubicacion:
+                self._por_ubicacion[clave] = self._cargar(lat, lon)
+            return self._por_ubicacion[clave]
+
+
+_GRABACIONES = _Grabaciones()
+
+
+def hay_grabacion(lat: float, lon: float) -> bool:
+    return _GRABACIONES.dias(lat, lon) is not None
+
+
+def celdas_grabadas() -> List[str]:
+    """Nombres de las grabaciones disponibles ('lat_lon' de cada celda)."""
+    if not os.path.isdir(DIR_GRABACIONES):
+        return []
+    return sorted(n[:-len('.json')] for n in os.listdir(DIR_GRABACIONES) if n.endswith('.json'))
+
+
+def _sintetico(lat: float, dia: date) -> Tuple[float, float, float]:
+    k = dia.toordinal() + int(lat * 10)
+    return (round(max(0.0, 10 * math.sin(k * 0.37)), 2),
+            round(20 + 8 * math.sin(k / 58.0), 2),
+            round(4 + 2 * math.cos(k / 40.0), 2))
+
+
+def _valor(grabados: Optional[Dict[str, Tuple]], anios: List[int], lat: float, dia: date) -> Tuple:
+    if grabados:
+        valor = grabados.get(dia.isoformat())
+        if valor is not None:
+            return valor
+        # Mismo día de un año grabado (el 29 de febrero cae en el 28)
+        anio = anios[dia.year % len(anios)]
+        sustituto = date(anio, dia.month, min(dia.day, 28) if dia.month == 2 else dia.day)
+        valor = grabados.get(sustituto.isoformat())
+        if valor is not None:
+            return valor
+    return _sintetico(lat, dia)
+
+
+def bloque_diario(lat: float, lon: float, inicio: date, fin: date,
+                  sin_dato_desde: Optional[date] = None) -> Dict[str, List]:
+    """Bloque `daily` de [inicio, fin] para una ubicación; desde
+    `sin_dato_desde` los días van con valores nulos, como los que el archivo
+    aún no consolida."""
+    grabados = _GRABACIONES.dias(lat, lon)
+    anios = sorted({int(f[:4]) for f in grabados}) if grabados else []
+    diario = {"time": []}
+    for v in VARIABLES:
+        diario[v] = []
+    dia = inicio
+    while dia <= fin:
+        diario["time"].append(dia.isoformat())
+        if sin_dato_desde is not None and dia >= sin_dato_desde:
+            valores = (None,) * len(VARIABLES)
+        else:
+            valores = _valor(grabados, anios, lat, dia)
+        for v, x in zip(VARIABLES, valores):
+            diario[v].append(x)
+        dia += timedelta(days=1)
+    return diario
+
+
+class _Manejador(BaseHTTPRequestHandler):
+    retraso = 0.0
+    dias_sin_dato = 0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path not in ('/v1/archive', '/v1/forecast'):
+            self.send_error(404)
+            return
+        params = parse_qs(url.query)
+        sin_dato_desde = None
+        try:
+            lats = [float(x) for x in params["latitude"][0].split(',')]
+            lons = [float(x) for x in params["longitude"][0].split(',')]
+            if url.path == '/v1/forecast':
+                hoy = date.today()
+                inicio = hoy - timedelta(days=int(params.get("past_days", ["0"])[0]))
+                fin = hoy + timedelta(days=int(params.get("forecast_days", ["7"])[0]) - 1)
+            else:
+                inicio = date.fromisoformat(params["start_date"][0])
+                fin = date.fromisoformat(params["end_date"][0])
+                if self.dias_sin_dato:
+                    sin_dato_desde = date.today() - timedelta(days=self.dias_sin_dato)
+        except (KeyError, ValueError):
+            self.send_error(400)
+            return
+        if self.retraso:
+            time.sleep(self.retraso)
+        ubicaciones = [{"latitude": la, "longitude": lo, "daily": bloque_diario(la, lo, inicio, fin, sin_dato_desde)}
+                       for la, lo in zip(lats, lons)]
+        cuerpo = json.dumps(ubicaciones[0] if len(ubicaciones) == 1 else ubicaciones).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, *args):
+        pass
+
+
+def iniciar(puerto: int = 0, retraso: float = 0.0, dias_sin_dato: int = 0) -> Tuple[ThreadingHTTPServer, str]:
+    """Levanta el simulador en un hilo. Devuelve (servidor, url del archivo);
+    el pronóstico está en la misma dirección con `/v1/forecast`. El archivo
+    responde con valores nulos los `dias_sin_dato` días hasta ayer."""
+    manejador = type('Manejador', (_Manejador,), {'retraso': retraso, 'dias_sin_dato': dias_sin_dato})
+    servidor = ThreadingHTTPServer(('127.0.0.1', puerto), manejador)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_address[1]}/v1/archive"
+
+
+def grabar(municipios: Dict[str, Dict[str, float]], desde: date, hasta: date):
+    """Descarga del archivo real y guarda una grabación por municipio (con el
+    nombre de su celda; dos municipios de una misma celda comparten archivo)."""
+    import requests
+
+    os.makedirs(DIR_GRABACIONES, exist_ok=True)
+    for nombre, c in municipios.items():
+        respuesta = requests.get("https://archive-api.open-meteo.com/v1/archive", params={
+            "latitude": c["lat"], "longitude": c["lon"],
+            "start_date": desde.isoformat(), "end_date": hasta.isoformat(),
+            "daily": list(VARIABLES), "timezone": "auto"
+        }, timeout=(5, 60))
+        respuesta.raise_for_status()
+        with open(_nombre_grabacion(c["lat"], c["lon"]), 'w', encoding='utf-8') as f:
+            json.dump({"municipio": nombre, "fuente": "archive-api.open-meteo.com",
+                       "daily": respuesta.json()["daily"]}, f, ensure_ascii=False)
+        print(f"{nombre}: {desde} a {hasta} grabado")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description='Simulador local del archivo de Open-Meteo')
+    parser.add_argument('--puerto', type=int, default=8099)
+    parser.add_argument('--retraso', type=float, default=0.0, help='Segundos de espera por respuesta')
+    parser.add_argument('--dias-sin-dato', type=int, default=0,
+                        help='Días más recientes (hasta ayer) que el archivo responde con valores nulos')
+    parser.add_argument('--grabar', action='store_true', help='Grabar datos reales en lugar de servir')
+    parser.add_argument('--municipio', action='append', help='Municipio a grabar (se puede repetir); por defecto todos')
+    parser.add_argument('--desde', default='2015-01-01')
+    parser.add_argument('--hasta', default='2024-12-31')
+    args = parser.parse_args()
+
+    if args.grabar:
+        from api import MUNICIPIOS
+        elegidos = {m: MUNICIPIOS[m] for m in (args.municipio or MUNICIPIOS)}
+        grabar(elegidos, date.fromisoformat(args.desde), date.fromisoformat(args.hasta))
+        return 0
+    servidor, url = iniciar(args.puerto, args.retraso, args.dias_sin_dato)
+    print(f"Simulador en {url} (retraso {args.retraso} s, {args.dias_sin_dato} días sin dato); Ctrl+C para terminar")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        servidor.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main_cli())
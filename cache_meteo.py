@@ -0,0 +1,217 @@
+"""Almacén local (SQLite) para las series diarias de Open-Meteo.
+
+Guarda un renglón por (municipio, fecha) con precipitación, temperatura y
+evapotranspiración. `api.obtener_datos_meteo` lee primero los días guardados
+y sólo descarga del archivo de Open-Meteo el rango que falta.
+
+El archivo consolida los días con unos cinco días de retraso: los más
+recientes llegan con valores nulos, no se guardan y siguen faltando. Para no
+volver a pedirlos en cada petición se anotan como sin dato y se omiten
+durante `VIGENCIA_SIN_DATO`; en el uso normal cada municipio descarga, a lo
+más una vez por ese lapso, los últimos días que el archivo aún no consolida
+(no sólo el día nuevo).
+
+Las claves son las de la celda del reanálisis (`api._clave_almacen`): un
+municipio, una consulta por coordenada y una celda de la rejilla que caen en
+la misma celda comparten los días guardados. `migrar_claves` pasa una sola
+vez a esas claves los días guardados con claves anteriores.
+
+La ruta del archivo se puede cambiar con la variable de entorno
+`SEQUIA_CACHE_DB`.
+"""
+import os
+import sqlite3
+import time
+from contextlib import closing
+from functools import lru_cache
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+RUTA_CACHE = os.environ.get(
+    'SEQUIA_CACHE_DB',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache_meteo.sqlite3')
+)
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS serie_diaria (
+    municipio TEXT NOT NULL,
+    fecha TEXT NOT NULL,
+    precipitacion REAL NOT NULL,
+    temperatura REAL NOT NULL,
+    evapotranspiracion REAL NOT NULL,
+    PRIMARY KEY (municipio, fecha)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS dias_sin_dato (
+    municipio TEXT NOT NULL,
+    fecha TEXT NOT NULL,
+    momento REAL NOT NULL,
+    PRIMARY KEY (municipio, fecha)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    clave TEXT PRIMARY KEY,
+    valor TEXT NOT NULL
+);
+"""
+VIGENCIA_SIN_DATO = 15 * 60  # segundos antes de volver a pedir un día sin dato
+
+
+def _conectar(ruta: Optional[str] = None) -> sqlite3.Connection:
+    """Abre la base (creándola si no existe). Una conexión por llamada para
+    poder usarse desde varios hilos de Flask sin compartir estado."""
+    con = sqlite3.connect(ruta or RUTA_CACHE, timeout=30)
+    con.executescript(_ESQUEMA)
+    return con
+
+
+def leer_dias(municipio: str, inicio: date, fin: date,
+              ruta: Optional[str] = None) -> Dict[str, Tuple[float, float, float]]:
+    """Devuelve {fecha: (precipitacion, temperatura, evapotranspiracion)}
+    con los días guardados dentro de [inicio, fin]."""
+    with closing(_conectar(ruta)) as con:
+        filas = con.execute(
+            "SELECT fecha, precipitacion, temperatura, evapotranspiracion "
+            "FROM serie_diaria WHERE municipio = ? AND fecha BETWEEN ? AND ? "
+            "ORDER BY fecha",
+            (municipio, inicio.isoformat(), fin.isoformat())
+        ).fetchall()
+    return {f: (p, t, e) for f, p, t, e in filas}
+
+
+def leer_varios(municipios: List[str], inicio: date, fin: date,
+                ruta: Optional[str] = None) -> Dict[str, Dict[str, Tuple[float, float, float]]]:
+    """`leer_dias` de varios municipios con una sola conexión."""
+    resultado = {m: {} for m in municipios}
+    with closing(_conectar(ruta)) as con:
+        for municipio in municipios:
+            filas = con.execute(
+                "SELECT fecha, precipitacion, temperatura, evapotranspiracion "
+                "FROM serie_diaria WHERE municipio = ? AND fecha BETWEEN ? AND ? "
+                "ORDER BY fecha",
+                (municipio, inicio.isoformat(), fin.isoformat())
+            ).fetchall()
+            resultado[municipio] = {f: (p, t, e) for f, p, t, e in filas}
+    return resultado
+
+
+def guardar_dias(municipio: str, fechas: List[str], precipitacion: List[Optional[float]],
+                 temperatura: List[Optional[float]], evapotranspiracion: List[Optional[float]],
+                 ruta: Optional[str] = None) -> int:
+    """Inserta (o reemplaza) los días recibidos. Los días con algún valor
+    nulo (el archivo aún no los consolida) no se guardan; se anotan como sin
+    dato para volver a pedirlos más adelante. Devuelve cuántos días se
+    guardaron."""
+    return guardar_varios({municipio: (fechas, precipitacion, temperatura, evapotranspiracion)}, ruta)
+
+
+def guardar_varios(bloques: Dict[str, Tuple[List[str], List, List, List]], ruta: Optional[str] = None) -> int:
+    """`guardar_dias` de varios municipios ({municipio: (fechas, p, t, e)})
+    en una sola transacción."""
+    filas = []
+    sin_dato = []
+    ahora = time.time()
+    for municipio, (fechas, precipitacion, temperatura, evapotranspiracion) in bloques.items():
+        for f, p, t, e in zip(fechas, precipitacion, temperatura, evapotranspiracion):
+            if p is not None and t is not None and e is not None:
+                filas.append((municipio, f, float(p), float(t), float(e)))
+            else:
+                sin_dato.append((municipio, f, ahora))
+    if not filas and not sin_dato:
+        return 0
+    with closing(_conectar(ruta)) as con:
+        with con:
+            con.executemany(
+                "INSERT OR REPLACE INTO serie_diaria "
+                "(municipio, fecha, precipitacion, temperatura, evapotranspiracion) "
+                "VALUES (?, ?, ?, ?, ?)",
+                filas
+            )
+            con.executemany(
+                "INSERT OR REPLACE INTO dias_sin_dato (municipio, fecha, momento) VALUES (?, ?, ?)",
+                sin_dato
+            )
+    return len(filas)
+
+
+def registrar_sin_dato(municipio: str, fechas: List[str], ruta: Optional[str] = None):
+    """Anota que estos días se pidieron y no se obtuvo valor."""
+    ahora = time.time()
+    with closing(_conectar(ruta)) as con:
+        with con:
+            con.executemany(
+                "INSERT OR REPLACE INTO dias_sin_dato (municipio, fecha, momento) VALUES (?, ?, ?)",
+                [(municipio, f, ahora) for f in fechas]
+            )
+
+
+def sin_dato_reciente(municipio: str, inicio: date, fin: date,
+                      vigencia: float = VIGENCIA_SIN_DATO, ruta: Optional[str] = None) -> Set[str]:
+    """Días de [inicio, fin] pedidos sin éxito hace menos de `vigencia` segundos."""
+    with closing(_conectar(ruta)) as con:
+        filas = con.execute(
+            "SELECT fecha FROM dias_sin_dato WHERE municipio = ? AND fecha BETWEEN ? AND ? AND momento > ?",
+            (municipio, inicio.isoformat(), fin.isoformat(), time.time() - vigencia)
+        ).fetchall()
+    return {f for (f,) in filas}
+
+
+def sin_dato_reciente_varios(municipios: List[str], inicio: date, fin: date,
+                             vigencia: float = VIGENCIA_SIN_DATO,
+                             ruta: Optional[str] = None) -> Dict[str, Set[str]]:
+    """`sin_dato_reciente` de varios municipios con una sola consulta."""
+    resultado = {m: set() for m in municipios}
+    with closing(_conectar(ruta)) as con:
+        filas = con.execute(
+            "SELECT municipio, fecha FROM dias_sin_dato WHERE fecha BETWEEN ? AND ? AND momento > ?",
+            (inicio.isoformat(), fin.isoformat(), time.time() - vigencia)
+        ).fetchall()
+    for municipio, f in filas:
+        if municipio in resultado:
+            resultado[municipio].add(f)
+    return resultado
+
+
+def migrar_claves(clave_nueva: Callable[[str], Optional[str]], version: str,
+                  ruta: Optional[str] = None) -> int:
+    """Renombra las claves guardadas con `clave_nueva(clave)` (None = se
+    deja igual); si dos claves van a dar a la misma, se conserva el día ya
+    guardado. Se hace una sola vez por `version` (anotada en `meta`).
+    Devuelve cuántas claves se renombraron."""
+    with closing(_conectar(ruta)) as con:
+        if con.execute("SELECT 1 FROM meta WHERE clave = 'claves' AND valor = ?", (version,)).fetchone():
+            return 0
+        renombradas = 0
+        with con:
+            for tabla in ('serie_diaria', 'dias_sin_dato'):
+                for (vieja,) in con.execute(f"SELECT DISTINCT municipio FROM {tabla}").fetchall():
+                    nueva = clave_nueva(vieja)
+                    if nueva is None or nueva == vieja:
+                        continue
+                    con.execute(f"UPDATE OR IGNORE {tabla} SET municipio = ? WHERE municipio = ?", (nueva, vieja))
+                    con.execute(f"DELETE FROM {tabla} WHERE municipio = ?", (vieja,))
+                    renombradas += tabla == 'serie_diaria'
+            con.execute("INSERT OR REPLACE INTO meta (clave, valor) VALUES ('claves', ?)", (version,))
+    return renombradas
+
+
+@lru_cache(maxsize=64)
+def _fechas_rango(inicio: date, fin: date) -> Tuple[str, ...]:
+    return tuple((inicio + timedelta(days=i)).isoformat() for i in range((fin - inicio).days + 1))
+
+
+def fechas_rango(inicio: date, fin: date) -> List[str]:
+    """Fechas ISO de [inicio, fin]."""
+    return list(_fechas_rango(inicio, fin))
+
+
+def rango_faltante(fechas_guardadas, inicio: date, fin: date, omitir=()) -> Optional[Tuple[date, date]]:
+    """Rango mínimo [desde, hasta] que cubre todos los días de [inicio, fin]
+    ausentes en `fechas_guardadas` (sin contar los de `omitir`). Devuelve
+    None si no falta ninguno. Es un solo rango: si faltan días separados, los
+    guardados entre ellos se vuelven a descargar."""
+    faltantes = [
+        f for f in _fechas_rango(inicio, fin)
+        if f not in fechas_guardadas and f not in omitir
+    ]
+    if not faltantes:
+        return None
+    return date.fromisoformat(faltantes[0]), date.fromisoformat(faltantes[-1])
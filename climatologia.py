@@ -0,0 +1,321 @@
+"""Climatología por municipio e índices estandarizados SPI / SPEI.
+
+A diferencia del índice min-max, que depende de la ventana consultada, el
+SPI y el SPEI comparan el acumulado reciente con la distribución histórica
+del mismo mes calendario, así que son comparables en el tiempo:
+
+- SPI: acumulado de precipitación en `escala` días, distribución gamma
+  (ajuste de máxima verosimilitud de Thom) con probabilidad de cero aparte.
+- SPEI: acumulado de precipitación menos `et0_fao_evapotranspiration`,
+  distribución log-logística de tres parámetros (momentos ponderados por
+  probabilidad, Vicente-Serrano et al. 2010).
+
+El ajuste es costoso y se hace una sola vez desde la línea de comandos:
+
+    py climatologia.py --desde 1991-01-01 --hasta 2020-12-31
+
+Treinta años de todos los municipios son unas 50,000 llamadas a Open-Meteo,
+varias veces la cuota diaria: la descarga va al ritmo del presupuesto
+(`descarga_pausada.py`, hasta `--espera-cuota` segundos) y cada municipio se
+guarda en cuanto termina. Si la cuota se acaba, el comando termina con
+código 1 y volver a correrlo sigue con los municipios que faltan.
+
+Los parámetros se guardan en `climatologia.json` (o `SEQUIA_CLIMATOLOGIA`).
+En cada petición sólo se evalúa la CDF y la inversa de la normal.
+"""
+import json
+import math
+import os
+import sys
+import tempfile
+from collections import deque
+from datetime import date
+from statistics import NormalDist
+from typing import Any, Dict, List, Optional
+
+from descarga_pausada import CUOTA_AGOTADA, ESPERA_CUOTA, DescargaPausada
+
+ESCALAS = (30, 90)  # días de acumulación (≈ 1 y 3 meses)
+RUTA_CLIMATOLOGIA = os.environ.get(
+    'SEQUIA_CLIMATOLOGIA',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'climatologia.json')
+)
+_NORMAL = NormalDist()
+_LIMITE_PROB = 1e-6  # evita ±infinito en la inversa de la normal
+
+
+# ---------------------------------------------------------------------------
+# Distribuciones
+
+def _gamma_inc_p(a: float, x: float) -> float:
+    """Función gamma incompleta regularizada P(a, x)."""
+    if x <= 0:
+        return 0.0
+    ln_prefactor = a * math.log(x) - x - math.lgamma(a)
+    if x < a + 1:
+        # serie
+        termino = suma = 1.0 / a
+        ap = a
+        for _ in range(500):
+            ap += 1
+            termino *= x / ap
+            suma += termino
+            if abs(termino) < abs(suma) * 1e-14:
+                break
+        return suma * math.exp(ln_prefactor)
+    # fracción continua (Lentz) para Q(a, x)
+    pequeno = 1e-300
+    b = x + 1 - a
+    c = 1 / pequeno
+    d = 1 / b
+    h = d
+    for i in range(1, 500):
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = pequeno if abs(d) < pequeno else d
+        c = b + an / c
+        c = pequeno if abs(c) < pequeno else c
+        d = 1 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-14:
+            break
+    return 1.0 - math.exp(ln_prefactor) * h
+
+
+def ajustar_gamma(valores: List[float]) -> Optional[Dict[str, float]]:
+    """Ajuste gamma de Thom sobre los valores positivos; `q` es la
+    proporción de ceros. Devuelve None si no hay datos suficientes."""
+    if not valores:
+        return None
+    positivos = [v for v in valores if v > 0]
+    q = 1 - len(positivos) / len(valores)
+    if len(positivos) < 3:
+        return None
+    media = sum(positivos) / len(positivos)
+    A = math.log(media) - sum(math.log(v) for v in positivos) / len(positivos)
+    if A <= 0:
+        return None
+    alpha = (1 + math.sqrt(1 + 4 * A / 3)) / (4 * A)
+    return {'alpha': alpha, 'beta': media / alpha, 'q': q}
+
+
+def cdf_gamma(x: float, p: Dict[str, float]) -> float:
+    return p['q'] + (1 - p['q']) * _gamma_inc_p(p['alpha'], max(x, 0.0) / p['beta'])
+
+
+def ajustar_log_logistica(valores: List[float]) -> Optional[Dict[str, float]]:
+    """Log-logística de tres parámetros por momentos ponderados por probabilidad."""
+    n = len(valores)
+    if n < 3:
+        return None
+    ordenados = sorted(valores)
+    w = [0.0, 0.0, 0.0]
+    for i, x in enumerate(ordenados, start=1):
+        f = (i - 0.35) / n
+        for s in range(3):
+            w[s] += (1 - f) ** s * x
+    w = [v / n for v in w]
+    denom = 6 * w[1] - w[0] - 6 * w[2]
+    if denom == 0:
+        return None
+    beta = (2 * w[1] - w[0]) / denom
+    if beta <= 1:
+        return None
+    g = math.gamma(1 + 1 / beta) * math.gamma(1 - 1 / beta)
+    alpha = (w[0] - 2 * w[1]) * beta / g
+    if alpha <= 0:
+        return None
+    return {'alpha': alpha, 'beta': beta, 'gamma': w[0] - alpha * g}
+
+
+def cdf_log_logistica(x: float, p: Dict[str, float]) -> float:
+    if x <= p['gamma']:
+        return 0.0
+    return 1.0 / (1.0 + (p['alpha'] / (x - p['gamma'])) ** p['beta'])
+
+
+def _a_normal(prob: float) -> float:
+    return _NORMAL.inv_cdf(min(max(prob, _LIMITE_PROB), 1 - _LIMITE_PROB))
+
+
+# ---------------------------------------------------------------------------
+# Ajuste desde la historia
+
+class MuestrasClimatologicas:
+    """Junta, en un recorrido día por día, los acumulados de `escala` días
+    agrupados por el mes calendario del último día. Sólo cuenta acumulados
+    de días consecutivos: un hueco en las fechas (días que Open-Meteo no
+    devolvió) vacía las ventanas, como en `retrospectiva.ReproduccionDiaria`."""
+
+    def __init__(self, escalas=ESCALAS):
+        self.escalas = tuple(escalas)
+        self.huecos = 0  # veces que las ventanas volvieron a empezar por días faltantes
+        self._ultimo_dia: Optional[int] = None  # ordinal del último día agregado
+        self._vaciar()
+        self.spi = {e: {m: [] for m in range(1, 13)} for e in self.escalas}
+        self.spei = {e: {m: [] for m in range(1, 13)} for e in self.escalas}
+
+    def _vaciar(self):
+        self._ventanas = {e: deque() for e in self.escalas}
+        self._sumas = {e: [0.0, 0.0] for e in self.escalas}  # [precipitación, balance]
+
+    def agregar_dia(self, fecha: str, precipitacion: float, evapotranspiracion: float):
+        dia = date.fromisoformat(fecha)
+        if self._ultimo_dia is not None and dia.toordinal() != self._ultimo_dia + 1:
+            self._vaciar()
+            self.huecos += 1
+        self._ultimo_dia = dia.toordinal()
+        balance = precipitacion - evapotranspiracion
+        mes = dia.month
+        for e in self.escalas:
+            ventana, sumas = self._ventanas[e], self._sumas[e]
+            ventana.append((precipitacion, balance))
+            sumas[0] += precipitacion
+            sumas[1] += balance
+            if len(ventana) > e:
+                p_vieja, b_vieja = ventana.popleft()
+                sumas[0] -= p_vieja
+                sumas[1] -= b_vieja
+            if len(ventana) == e:
+                self.spi[e][mes].append(max(sumas[0], 0.0))
+                self.spei[e][mes].append(sumas[1])
+
+    def agregar_bloque(self, bloque: Dict[str, List]):
+        for f, p, e in zip(bloque["fechas"], bloque["precipitacion"], bloque["evapotranspiracion"]):
+            self.agregar_dia(f, p, e)
+
+    def ajustar(self) -> Dict[str, Any]:
+        return {
+            'spi': {str(e): {str(m): ajustar_gamma(v) for m, v in meses.items()}
+                    for e, meses in self.spi.items()},
+            'spei': {str(e): {str(m): ajustar_log_logistica(v) for m, v in meses.items()}
+                     for e, meses in self.spei.items()},
+        }
+
+
+# ---------------------------------------------------------------------------
+# Parámetros persistidos y evaluación
+
+class Climatologia:
+    """Parámetros ajustados; se recargan solos si el archivo cambia."""
+
+    def __init__(self, ruta: str = RUTA_CLIMATOLOGIA):
+        self.ruta = ruta
+        self._mtime = None
+        self._datos: Dict[str, Any] = {'municipios': {}}
+
+    def _recargar_si_cambio(self):
+        try:
+            mtime = os.stat(self.ruta).st_mtime
+        except OSError:
+            return
+        if mtime != self._mtime:
+            with open(self.ruta, 'r', encoding='utf-8') as f:
+                self._datos = json.load(f)
+            self._mtime = mtime
+
+    def parametros(self, municipio: str) -> Optional[Dict[str, Any]]:
+        self._recargar_si_cambio()
+        return self._datos.get('municipios', {}).get(municipio)
+
+    def guardar(self, municipio: str, parametros: Dict[str, Any], desde: date, hasta: date):
+        """Agrega o reemplaza un municipio y escribe el archivo de forma atómica."""
+        self._recargar_si_cambio()
+        self._datos.setdefault('municipios', {})[municipio] = dict(
+            parametros, periodo={'desde': desde.isoformat(), 'hasta': hasta.isoformat()})
+        directorio = os.path.dirname(os.path.abspath(self.ruta))
+        fd, temporal = tempfile.mkstemp(dir=directorio, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(self._datos, f, ensure_ascii=False)
+        os.replace(temporal, self.ruta)
+        self._mtime = os.stat(self.ruta).st_mtime
+
+    def evaluar(self, municipio: str, fechas: List[str], precipitacion: List[float],
+                evapotranspiracion: List[float]) -> Optional[Dict[str, Optional[float]]]:
+        """SPI y SPEI del último día de la serie (el último consolidado) para
+        cada escala: {'fecha': .., 'spi_30': .., 'spei_30': .., ...}; None si
+        no hay climatología. Cada escala necesita sus `e` días consecutivos
+        terminando en ese día; si la serie es más corta o tiene huecos en
+        ellos, su valor es None."""
+        parametros = self.parametros(municipio)
+        if parametros is None or not fechas:
+            return None
+        fin = date.fromisoformat(fechas[-1])
+        mes = str(fin.month)
+        resultado = {'fecha': fechas[-1]}
+        for e in ESCALAS:
+            p_spi = parametros['spi'].get(str(e), {}).get(mes)
+            p_spei = parametros['spei'].get(str(e), {}).get(mes)
+            # Las fechas van en orden y sin repetir: si los últimos `e` días
+            # abarcan e - 1 días de calendario, son consecutivos
+            if len(fechas) < e or (fin - date.fromisoformat(fechas[-e])).days != e - 1:
+                resultado[f'spi_{e}'] = resultado[f'spei_{e}'] = None
+                continue
+            acumulado = sum(precipitacion[-e:])
+            balance = acumulado - sum(evapotranspiracion[-e:])
+            resultado[f'spi_{e}'] = round(_a_normal(cdf_gamma(acumulado, p_spi)), 2) if p_spi else None
+            resultado[f'spei_{e}'] = round(_a_normal(cdf_log_logistica(balance, p_spei)), 2) if p_spei else None
+        return resultado
+
+
+def main_cli(argv=None):
+    """Ajusta y guarda la climatología de uno o todos los municipios."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Ajuste de la climatología SPI/SPEI por municipio')
+    parser.add_argument('--desde', default='1991-01-01', help='Inicio del periodo de referencia (YYYY-MM-DD)')
+    parser.add_argument('--hasta', default='2020-12-31', help='Fin del periodo de referencia (YYYY-MM-DD)')
+    parser.add_argument('--municipio', action='append', help='Municipio a ajustar (se puede repetir); por defecto todos')
+    parser.add_argument('--salida', default=RUTA_CLIMATOLOGIA, help='Archivo de parámetros')
+    parser.add_argument('--espera-cuota', type=float, default=ESPERA_CUOTA,
+                        help='Segundos máximos esperando cuota de Open-Meteo; lo que falte se descarga al volver a correr')
+    parser.add_argument('--rehacer', action='store_true',
+                        help='Volver a ajustar los municipios que ya tienen climatología de este periodo')
+    args = parser.parse_args(argv)
+
+    import api  # importación tardía: trae Flask y el almacén de series
+    import limite_open_meteo
+
+    desde, hasta = date.fromisoformat(args.desde), date.fromisoformat(args.hasta)
+    municipios = args.municipio or list(api.MUNICIPIOS)
+    desconocidos = [m for m in municipios if m not in api.MUNICIPIOS]
+    if desconocidos:
+        print(f"Municipios no encontrados: {', '.join(desconocidos)}")
+        return 1
+    clima = Climatologia(args.salida)
+    periodo = {'desde': desde.isoformat(), 'hasta': hasta.isoformat()}
+    if not args.rehacer:
+        # Cada municipio se guarda al terminar: una corrida interrumpida sigue
+        # con los que faltan
+        hechos = [m for m in municipios if (clima.parametros(m) or {}).get('periodo') == periodo]
+        if hechos:
+            print(f"{len(hechos)} municipios ya tienen climatología de {desde} a {hasta} (use --rehacer para repetirlos)")
+        municipios = [m for m in municipios if m not in hechos]
+    descarga = DescargaPausada(desde, hasta, args.espera_cuota)
+    descarga.avisar(municipios)
+    errores = {}
+    for municipio in municipios:
+        muestras = MuestrasClimatologicas()
+        try:
+            for bloque in descarga.bloques(municipio):
+                muestras.agregar_bloque(bloque)
+        except limite_open_meteo.PresupuestoAgotado:
+            errores[municipio] = CUOTA_AGOTADA
+        except Exception as e:
+            errores[municipio] = str(e)
+        if municipio in errores:
+            print(f"{municipio}: {errores[municipio]}", file=sys.stderr)
+            continue
+        clima.guardar(municipio, muestras.ajustar(), desde, hasta)
+        huecos = f", {muestras.huecos} huecos en las fechas" if muestras.huecos else ""
+        print(f"{municipio}: climatología ajustada ({desde} a {hasta}{huecos})")
+    if errores:
+        print(f"{len(errores)} municipios sin ajustar", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main_cli())
@@ -0,0 +1,96 @@
+"""Descarga de historia larga al ritmo de la cuota de Open-Meteo.
+
+`retrospectiva.py`, `climatologia.py` y `modelos_riesgo.py` recorren
+décadas de todos los municipios: decenas de miles de llamadas, varias veces
+la cuota diaria. `DescargaPausada` baja cada municipio por años a través del
+almacén local y del presupuesto de `limite_open_meteo.py`:
+
+- antes de empezar un municipio espera a que el presupuesto tenga fichas
+  para todo lo que le falta, en lugar de agotarlo entre todos;
+- un fallo de Open-Meteo se lanza (sin anotar los días como sin dato) en
+  lugar de devolver sólo lo guardado;
+- sin cuota espera mientras no pase de `espera_cuota` segundos en total y
+  después lanza `PresupuestoAgotado`. Lo descargado queda en el almacén, así
+  que volver a correr el comando continúa donde se quedó.
+"""
+import sys
+import time
+from datetime import date
+from typing import Dict, Iterable, Iterator, List
+
+import cache_meteo
+import historico
+import limite_open_meteo
+
+ESPERA_CUOTA = 600  # segundos máximos esperando fichas de Open-Meteo por corrida
+CUOTA_AGOTADA = "Cuota de Open-Meteo agotada; vuelva a correr para continuar la descarga"
+
+
+def _serie_vacia() -> Dict[str, List]:
+    return {"fechas": [], "precipitacion": [], "temperatura": [], "evapotranspiracion": []}
+
+
+class DescargaPausada:
+    """Series de [desde, hasta] por municipio, en bloques anuales."""
+
+    def __init__(self, desde: date, hasta: date, espera_cuota: float = ESPERA_CUOTA, concurrencia: int = 4):
+        import api  # importación tardía: trae Flask y el almacén de series
+        self._api = api
+        self.rangos = historico.rangos_anuales(desde, hasta)
+        self.concurrencia = concurrencia
+        self.espera_cuota = espera_cuota
+        self._limite = time.monotonic() + max(0.0, espera_cuota)
+
+    def costo_pendiente(self, municipio: str) -> float:
+        """Llamadas que faltan para tener el rango del municipio en el almacén."""
+        clave = self._api._clave_almacen(municipio)
+        costo = 0.0
+        for a, b in self.rangos:
+            faltante = self._api._rango_pendiente(clave, cache_meteo.leer_dias(clave, a, b), a, b)
+            if faltante is not None:
+                costo += limite_open_meteo.costo_llamada(1, (faltante[1] - faltante[0]).days + 1)
+        return costo
+
+    def avisar(self, municipios: Iterable[str]) -> float:
+        """Muestra en stderr cuántas llamadas faltan para todos; las devuelve."""
+        pendiente = sum(self.costo_pendiente(m) for m in municipios)
+        if pendiente:
+            presupuesto = self._api.PRESUPUESTO
+            print(f"Faltan unas {round(pendiente)} llamadas a Open-Meteo "
+                  f"(cuota de {round(presupuesto.por_segundo * 86400)} por día); "
+                  f"se espera cuota hasta {self.espera_cuota:g} s", file=sys.stderr)
+        return pendiente
+
+    def _esperar(self, segundos: float):
+        if segundos <= 0:
+            return
+        if time.monotonic() + segundos > self._limite:
+            raise limite_open_meteo.PresupuestoAgotado(segundos)
+        time.sleep(segundos)
+
+    def _bloque(self, municipio: str, inicio: date, fin: date) -> Dict[str, List]:
+        while True:
+            try:
+                serie = self._api._series_lote({municipio: self._api.MUNICIPIOS[municipio]}, inicio, fin,
+                                               propagar_fallos=True)[municipio]
+                return serie or _serie_vacia()
+            except limite_open_meteo.PresupuestoAgotado as e:
+                self._esperar(e.reintentar_en)
+
+    def bloques(self, municipio: str) -> Iterator[Dict[str, List]]:
+        """Bloques anuales del municipio en orden cronológico."""
+        costo = self.costo_pendiente(municipio)
+        if costo:
+            self._esperar(self._api.PRESUPUESTO.espera_libre(costo))
+        yield from historico.bloques_en_paralelo(lambda a, b: self._bloque(municipio, a, b),
+                                                 self.rangos, self.concurrencia)
+
+    def serie(self, municipio: str) -> Dict[str, List]:
+        """Todo el rango del municipio en una sola serie."""
+        serie = _serie_vacia()
+        for bloque in self.bloques(municipio):
+            for campo in serie:
+                serie[campo].extend(bloque[campo])
+        if not serie["fechas"]:
+            raise RuntimeError("Sin datos disponibles")
+        return serie
@@ -0,0 +1,241 @@
+"""Modo por lotes de escenarios hipotéticos para `analisis_sequia.py`.
+
+Lee escenarios (precipitación, temperatura, marginación y, opcionalmente,
+la historia de cada uno) desde CSV o JSONL y escribe el riesgo de cada uno
+en el mismo orden, conforme se van calculando:
+
+    py analisis_sequia.py --lote escenarios.csv --salida riesgos.csv
+    py analisis_sequia.py --lote escenarios.jsonl --formato jsonl --barrido-marg 0:1:0.05
+
+Campos de entrada: `precip`, `temp` (obligatorios), `marg`, `hist_precip`,
+`hist_temp`. En CSV las historias van en una sola celda separadas por `;`,
+espacios o comas (entre comillas), o como arreglo JSON; en JSONL son
+arreglos. Los demás campos (p. ej. un `id`) se copian a la salida.
+
+La entrada se parte en bloques que se reparten entre un pool de procesos
+(`--procesos`); cada bloque agrupa sus escenarios por largo de historia y
+evalúa cada grupo con una sola llamada a
+`motor_vectorizado.riesgo_modelo_matriz`. Sólo hay unos cuantos bloques en
+vuelo a la vez, así que la memoria no crece con el tamaño de la entrada.
+Sin NumPy se usa `calcular_riesgo_modelo` escenario por escenario (también
+repartido entre los procesos).
+"""
+import csv
+import json
+import os
+import re
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from analisis_sequia import calcular_riesgo_modelo
+import motor_vectorizado
+
+CAMPOS_HISTORIA = ('hist_precip', 'hist_temp')
+CAMPOS_RESULTADO = ['riesgo', 'categoria', 'nombre_categoria', 'error']
+TAMANO_BLOQUE = 2000
+_SEPARADORES = re.compile(r'[;,\s]+')
+
+
+def _numero(fila: Dict[str, Any], campo: str, obligatorio: bool = False) -> Optional[float]:
+    valor = fila.get(campo)
+    if valor is None or (isinstance(valor, str) and not valor.strip()):
+        if obligatorio:
+            raise ValueError(f"falta '{campo}'")
+        return None
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        raise ValueError(f"'{campo}' no es un número: {valor!r}")
+
+
+def _lista(valor) -> List[float]:
+    return [float(x) for x in valor if x != '']
+
+
+@lru_cache(maxsize=4096)
+def _lista_de_texto(texto: str) -> Optional[List[float]]:
+    # Un barrido repite la misma celda de historia en cada escenario generado
+    texto = texto.strip()
+    if not texto:
+        return None
+    return _lista(json.loads(texto) if texto.startswith('[') else _SEPARADORES.split(texto))
+
+
+def _historia(fila: Dict[str, Any], campo: str) -> Optional[List[float]]:
+    valor = fila.get(campo)
+    if valor is None:
+        return None
+    try:
+        return _lista_de_texto(valor) if isinstance(valor, str) else _lista(valor)
+    except (TypeError, ValueError):
+        raise ValueError(f"'{campo}' debe ser una lista de números")
+
+
+def _escenario(fila: Dict[str, Any]) -> Tuple[float, float, Optional[float], Optional[List[float]], Optional[List[float]]]:
+    return (_numero(fila, 'precip', True), _numero(fila, 'temp', True), _numero(fila, 'marg'),
+            _historia(fila, 'hist_precip'), _historia(fila, 'hist_temp'))
+
+
+def _resultado(riesgo: float, categoria: str, nombre: str) -> Dict[str, Any]:
+    return {"riesgo": round(float(riesgo), 4), "categoria": categoria, "nombre_categoria": nombre}
+
+
+def evaluar_bloque(filas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Riesgo de cada escenario del bloque, en el mismo orden.
+
+    Los escenarios sin historia y los de historias de precipitación y
+    temperatura del mismo largo se evalúan en grupos con el motor
+    vectorizado; el resto (o todos, sin NumPy) con `calcular_riesgo_modelo`."""
+    resultados: List[Optional[Dict[str, Any]]] = [None] * len(filas)
+    grupos: Dict[int, List[int]] = {}  # largo de historia (0 = sin historia) -> posiciones
+    escenarios = []
+    for i, fila in enumerate(filas):
+        try:
+            if 'error' in fila:
+                raise ValueError(fila['error'])
+            escenario = _escenario(fila)
+        except ValueError as e:
+            escenarios.append(None)
+            resultados[i] = {"error": str(e)}
+            continue
+        escenarios.append(escenario)
+        precip, temp, marg, hp, ht = escenario
+        if motor_vectorizado.HAY_NUMPY:
+            if hp is None and ht is None:
+                grupos.setdefault(0, []).append(i)
+                continue
+            if hp is not None and ht is not None and len(hp) == len(ht) and hp:
+                grupos.setdefault(len(hp), []).append(i)
+                continue
+        historia = {}
+        if hp is not None:
+            historia['precipitacion'] = hp
+        if ht is not None:
+            historia['temperatura'] = ht
+        res = calcular_riesgo_modelo(precip, temp, marg=marg, historia=historia)
+        resultados[i] = _resultado(res['riesgo'], res['categoria'], res['nombre_categoria'])
+
+    for largo, posiciones in grupos.items():
+        precip = [escenarios[i][0] for i in posiciones]
+        temp = [escenarios[i][1] for i in posiciones]
+        marg = [0.5 if escenarios[i][2] is None else escenarios[i][2] for i in posiciones]
+        if largo == 0:
+            res = motor_vectorizado.riesgo_modelo_sin_historia(precip, marg)
+        else:
+            res = motor_vectorizado.riesgo_modelo_matriz(
+                [escenarios[i][3] for i in posiciones], [escenarios[i][4] for i in posiciones],
+                marg=marg, precip_actual=precip, temp_actual=temp)
+        for j, i in enumerate(posiciones):
+            resultados[i] = _resultado(res['riesgo'][j], res['categoria'][j], res['nombre_categoria'][j])
+    return resultados
+
+
+def valores_barrido(texto: str) -> List[float]:
+    """'0.2,0.5,0.8' o 'inicio:fin:paso' (fin incluido)."""
+    if ':' in texto:
+        inicio, fin, paso = (float(x) for x in texto.split(':'))
+        if paso <= 0 or fin < inicio:
+            raise ValueError("el barrido debe ser inicio:fin:paso con paso > 0 y fin >= inicio")
+        pasos = int(round((fin - inicio) / paso))
+        return [round(inicio + k * paso, 10) for k in range(pasos + 1)]
+    return [float(x) for x in texto.split(',') if x.strip()]
+
+
+def leer_escenarios(archivo, formato: str) -> Iterator[Dict[str, Any]]:
+    if formato == 'csv':
+        yield from csv.DictReader(archivo)
+        return
+    for numero, linea in enumerate(archivo, 1):
+        linea = linea.strip()
+        if not linea:
+            continue
+        try:
+            fila = json.loads(linea)
+        except json.JSONDecodeError:
+            fila = None
+        # Una línea ilegible se reporta como error en su lugar, sin detener el lote
+        yield fila if isinstance(fila, dict) else {"linea": numero, "error": "línea JSON inválida"}
+
+
+def _en_bloques(filas: Iterable[Dict[str, Any]], tamano: int) -> Iterator[List[Dict[str, Any]]]:
+    bloque = []
+    for fila in filas:
+        bloque.append(fila)
+        if len(bloque) >= tamano:
+            yield bloque
+            bloque = []
+    if bloque:
+        yield bloque
+
+
+def resultados_en_orden(bloques: Iterable[List[Dict[str, Any]]], procesos: int
+                        ) -> Iterator[Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]]:
+    """(bloque, resultados) en el orden de entrada, con a lo más 2 bloques
+    en vuelo por proceso (`Executor.map` enviaría toda la entrada de golpe)."""
+    if procesos <= 1:
+        for bloque in bloques:
+            yield bloque, evaluar_bloque(bloque)
+        return
+    with ProcessPoolExecutor(max_workers=procesos) as ejecutor:
+        pendientes = deque()
+        for bloque in bloques:
+            pendientes.append((bloque, ejecutor.submit(evaluar_bloque, bloque)))
+            if len(pendientes) >= 2 * procesos:
+                anterior, futuro = pendientes.popleft()
+                yield anterior, futuro.result()
+        while pendientes:
+            anterior, futuro = pendientes.popleft()
+            yield anterior, futuro.result()
+
+
+def ejecutar_lote(entrada: str, salida: str = '-', formato_entrada: Optional[str] = None,
+                  formato_salida: Optional[str] = None, procesos: Optional[int] = None,
+                  tamano_bloque: int = TAMANO_BLOQUE, barrido_marg: Optional[List[float]] = None) -> int:
+    """Evalúa los escenarios de `entrada` ('-' = entrada estándar) y escribe
+    los resultados en `salida`. Devuelve el código de salida del CLI."""
+    if formato_entrada is None:
+        formato_entrada = 'jsonl' if entrada.lower().endswith(('.jsonl', '.ndjson')) else 'csv'
+    formato_salida = formato_salida or formato_entrada
+    procesos = procesos or os.cpu_count() or 1
+    archivo_entrada = sys.stdin if entrada == '-' else open(entrada, 'r', encoding='utf-8-sig', newline='')
+    archivo_salida = sys.stdout if salida == '-' else open(salida, 'w', encoding='utf-8', newline='')
+
+    filas = leer_escenarios(archivo_entrada, formato_entrada)
+    if barrido_marg:
+        filas = (dict(fila, marg=m) for fila in filas for m in barrido_marg)
+
+    escritor = None
+    total = errores = 0
+    inicio = time.perf_counter()
+    try:
+        for bloque, resultados in resultados_en_orden(_en_bloques(filas, tamano_bloque), procesos):
+            for fila, resultado in zip(bloque, resultados):
+                salida_fila = {k: v for k, v in fila.items() if k not in CAMPOS_HISTORIA}
+                salida_fila.update(resultado)
+                total += 1
+                errores += 'error' in resultado
+                if formato_salida == 'jsonl':
+                    archivo_salida.write(json.dumps(salida_fila, ensure_ascii=False) + '\n')
+                    continue
+                if escritor is None:
+                    # Columnas: las de la primera fila (sin historias) y las del resultado
+                    columnas = [k for k in fila if k not in CAMPOS_HISTORIA and k not in CAMPOS_RESULTADO]
+                    escritor = csv.DictWriter(archivo_salida, fieldnames=columnas + CAMPOS_RESULTADO,
+                                              extrasaction='ignore')
+                    escritor.writeheader()
+                escritor.writerow(salida_fila)
+            archivo_salida.flush()
+    finally:
+        if archivo_entrada is not sys.stdin:
+            archivo_entrada.close()
+        if archivo_salida is not sys.stdout:
+            archivo_salida.close()
+
+    duracion = time.perf_counter() - inicio
+    print(f"{total} escenarios ({errores} con error) en {duracion:.2f} s con {procesos} proceso(s)",
+          file=sys.stderr)
+    return 0
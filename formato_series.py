@@ -0,0 +1,139 @@
+"""Representaciones compactas de las series diarias.
+
+En lugar de una lista de fechas ISO y listas de flotantes JSON, una serie se
+describe con la fecha inicial, el número de días y una columna float32
+little-endian por variable. Los días sin dato (huecos en el almacén) se
+rellenan con NaN para que la posición de cada valor sea su día.
+
+Formatos disponibles (parámetro `formato` o encabezado Accept):
+- json: el formato de siempre
+- compacto: JSON con las columnas float32 en base64
+- binario: cuerpo application/octet-stream con las columnas concatenadas;
+  el esquema viaja en los encabezados X-Serie-*
+- csv: texto CSV generado en flujo (sólo `/api/analizar_detalle`)
+- ndjson: un objeto JSON por día y por línea, generado en flujo conforme
+  llegan los bloques (sólo `/api/analizar_detalle`); el cliente puede ir
+  mostrando las filas sin esperar la respuesta completa
+"""
+import base64
+import json
+import math
+import sys
+from array import array
+from datetime import date
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+FORMATOS = ('json', 'compacto', 'binario', 'csv', 'ndjson')
+_POR_ACCEPT = {
+    'application/octet-stream': 'binario',
+    'text/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+}
+
+
+def elegir_formato(parametro: Optional[str], accept, permitidos: Sequence[str] = FORMATOS) -> str:
+    """Formato pedido por `?formato=` o, si no viene, por el encabezado Accept.
+
+    Lanza ValueError si el formato no está entre los permitidos."""
+    if parametro:
+        formato = parametro.strip().lower()
+    else:
+        # application/json va primero para que */* siga dando JSON
+        tipo = accept.best_match(['application/json'] + list(_POR_ACCEPT)) if accept else None
+        formato = _POR_ACCEPT.get(tipo, 'json')
+    if formato not in permitidos:
+        raise ValueError(f"Formato '{formato}' no soportado; use {', '.join(permitidos)}")
+    return formato
+
+
+def _columna_float32(fechas: List[str], valores: List[float], inicio: date, dias: int) -> array:
+    columna = array('f', [math.nan]) * dias
+    for f, v in zip(fechas, valores):
+        columna[(date.fromisoformat(f) - inicio).days] = v
+    return columna
+
+
+def _bytes_le(columna: array) -> bytes:
+    if sys.byteorder != 'little':
+        columna = array('f', columna)
+        columna.byteswap()
+    return columna.tobytes()
+
+
+def empaquetar(fechas: List[str], columnas: Dict[str, List[float]]) -> Dict[str, object]:
+    """Devuelve {'inicio', 'dias', 'columnas': {nombre: bytes float32 LE}}."""
+    if not fechas:
+        return {'inicio': None, 'dias': 0, 'columnas': {n: b'' for n in columnas}}
+    inicio = date.fromisoformat(fechas[0])
+    dias = (date.fromisoformat(fechas[-1]) - inicio).days + 1
+    return {
+        'inicio': inicio.isoformat(),
+        'dias': dias,
+        'columnas': {
+            nombre: _bytes_le(_columna_float32(fechas, valores, inicio, dias))
+            for nombre, valores in columnas.items()
+        }
+    }
+
+
+def serie_compacta(fechas: List[str], columnas: Dict[str, List[float]]) -> Dict[str, object]:
+    """Versión JSON del paquete: columnas float32 LE codificadas en base64."""
+    paquete = empaquetar(fechas, columnas)
+    return {
+        'inicio': paquete['inicio'],
+        'dias': paquete['dias'],
+        'tipo': 'float32-le',
+        'columnas': {n: base64.b64encode(b).decode('ascii') for n, b in paquete['columnas'].items()}
+    }
+
+
+def cuerpo_binario(fechas: List[str], columnas: Dict[str, List[float]]):
+    """Devuelve (bytes, encabezados) para una respuesta application/octet-stream.
+
+    El cuerpo es la concatenación de las columnas en el orden de
+    X-Serie-Columnas; cada una ocupa X-Serie-Dias * 4 bytes."""
+    paquete = empaquetar(fechas, columnas)
+    encabezados = {
+        'X-Serie-Inicio': paquete['inicio'] or '',
+        'X-Serie-Dias': str(paquete['dias']),
+        'X-Serie-Columnas': ','.join(paquete['columnas']),
+        'X-Serie-Tipo': 'float32-le',
+    }
+    return b''.join(paquete['columnas'].values()), encabezados
+
+
+def columnas_de_series(series: Dict[str, object]) -> Dict[str, List[float]]:
+    """Columnas numéricas del bloque `series` de /api/analizar (aplana
+    `indice_movil` como indice_movil_30, indice_movil_90, ...)."""
+    columnas = {}
+    for nombre, valores in series.items():
+        if nombre == 'fechas':
+            continue
+        if isinstance(valores, dict):
+            for sub, sub_valores in valores.items():
+                columnas[f"{nombre}_{sub}"] = sub_valores
+        else:
+            columnas[nombre] = valores
+    return columnas
+
+
+def csv_en_flujo(fechas: List[str], columnas: Dict[str, List[float]]) -> Iterator[str]:
+    """Genera el CSV renglón por renglón (sin armarlo completo en memoria)."""
+    nombres = list(columnas)
+    yield 'fecha,' + ','.join(nombres) + '\n'
+    for i, f in enumerate(fechas):
+        yield f + ',' + ','.join(f"{columnas[n][i]:.2f}" for n in nombres) + '\n'
+
+
+def ndjson_en_flujo(bloques: Iterable[Dict[str, List]], nombres: Sequence[str]) -> Iterator[str]:
+    """Genera una línea {"fecha", nombre: valor, ...} por día; entrega un
+    fragmento por bloque (p. ej. un año) en cuanto el bloque está listo."""
+    for bloque in bloques:
+        columnas = [(n, bloque[n]) for n in nombres]
+        lineas = []
+        for i, f in enumerate(bloque["fechas"]):
+            fila = {"fecha": f}
+            for nombre, valores in columnas:
+                fila[nombre] = round(float(valores[i]), 2)
+            lineas.append(json.dumps(fila, separators=(',', ':')) + '\n')
+        yield ''.join(lineas)
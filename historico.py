@@ -0,0 +1,182 @@
+"""Modo histórico de largo plazo (décadas) con memoria acotada.
+
+El rango [desde, hasta] se parte en bloques de un año que se obtienen varios
+a la vez en hilos (`bloques_en_paralelo`) y se entregan en orden mediante un
+generador. `ResumenHistorico` consume los bloques uno por uno y sólo guarda
+acumuladores, así que la memoria no depende de la longitud del rango:
+
+- El índice medio con normalización min-max sobre todo el rango es lineal en
+  los promedios: I = 0.6*(1 - (P̄-Pmin)/ΔP) + 0.2*(T̄-Tmin)/ΔT + 0.2*(Ē-Emin)/ΔE,
+  así que basta con mínimos, máximos y sumas.
+- El modelo de `calcular_riesgo_modelo` se reproduce con sumas para la
+  regresión simple y un `AcumuladorMinimosCuadrados` para el multivariable.
+- Se acumulan totales anuales y mensuales.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from analisis_sequia import (AcumuladorMinimosCuadrados, _clasificar_por_umbral,
+                             combinar_riesgo, modelo_algebra_lineal)
+
+FECHA_MINIMA = date(1940, 1, 1)  # inicio del archivo de Open-Meteo (ERA5)
+
+
+def rangos_anuales(desde: date, hasta: date) -> List[Tuple[date, date]]:
+    """Parte [desde, hasta] en bloques que no cruzan el cambio de año."""
+    rangos = []
+    inicio = desde
+    while inicio <= hasta:
+        fin = min(date(inicio.year, 12, 31), hasta)
+        rangos.append((inicio, fin))
+        inicio = fin + timedelta(days=1)
+    return rangos
+
+
+def bloques_en_paralelo(obtener_bloque: Callable[[date, date], Dict[str, List]],
+                        rangos: Iterable[Tuple[date, date]],
+                        concurrencia: int = 4) -> Iterator[Dict[str, List]]:
+    """Obtiene los bloques con hasta `concurrencia` descargas simultáneas y
+    los entrega en orden cronológico. Nunca hay más de `concurrencia`
+    bloques en memoria."""
+    with ThreadPoolExecutor(max_workers=concurrencia) as ejecutor:
+        pendientes = deque()
+        for inicio, fin in rangos:
+            pendientes.append(ejecutor.submit(obtener_bloque, inicio, fin))
+            if len(pendientes) >= concurrencia:
+                yield pendientes.popleft().result()
+        while pendientes:
+            yield pendientes.popleft().result()
+
+
+class _Estadistica:
+    """Mínimo, máximo y suma en línea de una variable."""
+
+    def __init__(self):
+        self.minimo = float('inf')
+        self.maximo = float('-inf')
+        self.suma = 0.0
+
+    def agregar(self, valor: float):
+        if valor < self.minimo:
+            self.minimo = valor
+        if valor > self.maximo:
+            self.maximo = valor
+        self.suma += valor
+
+    def normalizar(self, valor: float) -> float:
+        return (valor - self.minimo) / (self.maximo - self.minimo + 1e-10)
+
+
+class ResumenHistorico:
+    """Acumula bloques diarios y produce el resumen del rango completo."""
+
+    def __init__(self, marg: Optional[float] = None):
+        self.marg = 0.5 if marg is None else marg
+        self.n = 0
+        self.primera_fecha = None
+        self.ultima_fecha = None
+        self.precip = _Estadistica()
+        self.temp = _Estadistica()
+        self.evap = _Estadistica()
+        # regresión simple de y = (p < 20) contra x = 0..n-1
+        self._sum_y = 0.0
+        self._sum_xy = 0.0
+        self._ultimas_precip = deque(maxlen=2)
+        self._acumulador = AcumuladorMinimosCuadrados(3)
+        self.anual: Dict[str, Dict[str, float]] = {}
+        self.mensual: Dict[str, float] = {}
+
+    def agregar_bloque(self, bloque: Dict[str, List]):
+        for f, p, t, e in zip(bloque["fechas"], bloque["precipitacion"],
+                              bloque["temperatura"], bloque["evapotranspiracion"]):
+            self.agregar_dia(f, p, t, e)
+
+    def agregar_dia(self, fecha: str, p: float, t: float, e: float):
+        if self.primera_fecha is None:
+            self.primera_fecha = fecha
+        self.ultima_fecha = fecha
+        self.precip.agregar(p)
+        self.temp.agregar(t)
+        self.evap.agregar(e)
+
+        y = 1.0 if p < 20 else 0.0
+        self._sum_y += y
+        self._sum_xy += self.n * y
+        self._ultimas_precip.append(p)
+        self._acumulador.agregar([p, t, self.marg], y)
+        self.n += 1
+
+        anio = self.anual.setdefault(fecha[:4], {"lluvia_mm": 0.0, "temperatura": 0.0, "evapotranspiracion_mm": 0.0, "dias": 0})
+        anio["lluvia_mm"] += p
+        anio["temperatura"] += t
+        anio["evapotranspiracion_mm"] += e
+        anio["dias"] += 1
+        self.mensual[fecha[:7]] = self.mensual.get(fecha[:7], 0.0) + p
+
+    def _modelo(self, media_precip: float, media_temp: float) -> Dict[str, Any]:
+        n = self.n
+        tendencia = 0.0
+        if len(self._ultimas_precip) == 2:
+            tendencia = self._ultimas_precip[1] - self._ultimas_precip[0]
+        # mismas fórmulas que regresion_lineal_simple con x = 0..n-1
+        sum_x = n * (n - 1) / 2.0
+        sum_x2 = (n - 1) * n * (2 * n - 1) / 6.0
+        denom = n * sum_x2 - sum_x ** 2
+        if denom == 0:
+            beta0, beta1 = 0.0, 0.0
+        else:
+            beta1 = (n * self._sum_xy - sum_x * self._sum_y) / denom
+            beta0 = (self._sum_y - beta1 * sum_x) / n
+        pred_estad = max(0.0, min(1.0, beta0 + beta1 * n))
+        if n < 3:
+            pred_alg = modelo_algebra_lineal(media_precip, media_temp, self.marg)
+        else:
+            pred_alg = modelo_algebra_lineal(media_precip, media_temp, self.marg, acumulador=self._acumulador)
+        return combinar_riesgo(tendencia, pred_estad, pred_alg)
+
+    def resultado(self) -> Dict[str, Any]:
+        if self.n == 0:
+            raise ValueError("No hay datos en el rango solicitado")
+        medias = {
+            "precipitacion": self.precip.suma / self.n,
+            "temperatura": self.temp.suma / self.n,
+            "evapotranspiracion": self.evap.suma / self.n,
+        }
+        indice = (0.6 * (1 - self.precip.normalizar(medias["precipitacion"]))
+                  + 0.2 * self.temp.normalizar(medias["temperatura"])
+                  + 0.2 * self.evap.normalizar(medias["evapotranspiracion"]))
+        clas = _clasificar_por_umbral(indice)
+        modelo = self._modelo(medias["precipitacion"], medias["temperatura"])
+        return {
+            "desde": self.primera_fecha,
+            "hasta": self.ultima_fecha,
+            "dias": self.n,
+            "indice_sequia": round(indice * 100, 1),
+            "categoria": clas["categoria"],
+            "nombre_categoria": clas["nombre"],
+            "modelo": {
+                "riesgo_modelo": round(modelo["riesgo"] * 100, 1),
+                "categoria_modelo": modelo["categoria"],
+                "nombre_categoria_modelo": modelo["nombre_categoria"]
+            },
+            "datos": {
+                "precipitacion_promedio": medias["precipitacion"],
+                "temperatura_promedio": medias["temperatura"],
+                "evapotranspiracion_promedio": medias["evapotranspiracion"]
+            },
+            "anual": [
+                {
+                    "anio": anio,
+                    "lluvia_mm": round(v["lluvia_mm"], 2),
+                    "temperatura_c": round(v["temperatura"] / v["dias"], 2),
+                    "evapotranspiracion_mm": round(v["evapotranspiracion_mm"], 2),
+                    "dias": v["dias"]
+                }
+                for anio, v in sorted(self.anual.items())
+            ],
+            "promedio_mensual": [
+                {"mes": m, "lluvia_mm": round(v, 2)} for m, v in sorted(self.mensual.items())
+            ]
+        }
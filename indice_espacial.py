@@ -0,0 +1,100 @@
+"""Índice espacial de los municipios y celdas del reanálisis.
+
+- `IndiceEspacial`: árbol k-d sobre las coordenadas de los municipios.
+  `mas_cercano(lat, lon)` recorre O(log n) nodos en lugar de comparar contra
+  todos. Los puntos se guardan como vectores unitarios (x, y, z): la
+  distancia en línea recta entre ellos crece igual que la de círculo máximo,
+  así que el más cercano es exacto sin proyecciones.
+- `celda_reanalisis(lat, lon)`: punto de la malla del reanálisis que
+  contiene la coordenada. El archivo de Open-Meteo responde con el punto de
+  malla más cercano (ERA5-Land, 0.1°), así que todas las coordenadas de una
+  misma celda reciben la misma serie y basta con una descarga por celda.
+"""
+import math
+from typing import Dict, List, Optional, Tuple
+
+RESOLUCION_REANALISIS = 0.1  # grados (ERA5-Land)
+RADIO_TIERRA_KM = 6371.0
+PREFIJO_CELDA = 'celda:'
+
+
+def celda_reanalisis(lat: float, lon: float, resolucion: float = RESOLUCION_REANALISIS) -> Tuple[float, float]:
+    """(lat, lon) del punto de malla más cercano."""
+    return (round(round(lat / resolucion) * resolucion, 4),
+            round(round(lon / resolucion) * resolucion, 4))
+
+
+def clave_celda(lat: float, lon: float) -> str:
+    """Clave en el almacén local de la celda que contiene (lat, lon)."""
+    lat, lon = celda_reanalisis(lat, lon)
+    return f"{PREFIJO_CELDA}{lat:.4f},{lon:.4f}"
+
+
+def coordenadas_de_clave(clave: str) -> Optional[Dict[str, float]]:
+    """Inversa de `clave_celda`; None si la clave no es de una celda."""
+    if not clave.startswith(PREFIJO_CELDA):
+        return None
+    try:
+        lat, lon = (float(x) for x in clave[len(PREFIJO_CELDA):].split(','))
+    except ValueError:
+        return None
+    return {"lat": lat, "lon": lon}
+
+
+def distancia_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Distancia de círculo máximo (haversine)."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * RADIO_TIERRA_KM * math.asin(math.sqrt(a))
+
+
+def _vector_unitario(lat: float, lon: float) -> Tuple[float, float, float]:
+    p, l = math.radians(lat), math.radians(lon)
+    return (math.cos(p) * math.cos(l), math.cos(p) * math.sin(l), math.sin(p))
+
+
+class IndiceEspacial:
+    """Árbol k-d sobre {nombre: {"lat", "lon"}}."""
+
+    def __init__(self, puntos: Dict[str, Dict[str, float]]):
+        if not puntos:
+            raise ValueError("El índice espacial necesita al menos un punto")
+        self._puntos = puntos
+        vectores = [(_vector_unitario(c["lat"], c["lon"]), nombre) for nombre, c in puntos.items()]
+        self._raiz = self._construir(vectores, 0)
+
+    def _construir(self, puntos: List, eje: int):
+        # Nodo: (punto, nombre, eje, izquierda, derecha)
+        if not puntos:
+            return None
+        puntos.sort(key=lambda p: p[0][eje])
+        medio = len(puntos) // 2
+        siguiente = (eje + 1) % 3
+        return (puntos[medio][0], puntos[medio][1], eje,
+                self._construir(puntos[:medio], siguiente),
+                self._construir(puntos[medio + 1:], siguiente))
+
+    def mas_cercano(self, lat: float, lon: float) -> Tuple[str, float]:
+        """(nombre, distancia_km) del punto más cercano a (lat, lon)."""
+        objetivo = _vector_unitario(lat, lon)
+        mejor = [None, float('inf')]  # nombre, distancia² en línea recta
+
+        def _buscar(nodo):
+            if nodo is None:
+                return
+            punto, nombre, eje, izquierda, derecha = nodo
+            d2 = sum((a - b) ** 2 for a, b in zip(punto, objetivo))
+            if d2 < mejor[1]:
+                mejor[0], mejor[1] = nombre, d2
+            diferencia = objetivo[eje] - punto[eje]
+            cercano, lejano = (izquierda, derecha) if diferencia < 0 else (derecha, izquierda)
+            _buscar(cercano)
+            # La otra rama sólo puede mejorar si el plano de corte está más cerca que el mejor actual
+            if diferencia * diferencia < mejor[1]:
+                _buscar(lejano)
+
+        _buscar(self._raiz)
+        coords = self._puntos[mejor[0]]
+        return mejor[0], distancia_km(lat, lon, coords["lat"], coords["lon"])
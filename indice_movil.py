@@ -0,0 +1,95 @@
+"""Índice de sequía móvil con ventanas configurables.
+
+Para cada día t y cada ventana w el índice usa la misma fórmula que
+`api.calcular_indice_sequia`, pero normaliza con el mínimo y el máximo de
+los últimos w días (t-w+1..t) en lugar de toda la serie:
+
+    I_t = 0.6 * (1 - P_norm) + 0.2 * T_norm + 0.2 * E_norm
+
+Los mínimos y máximos deslizantes se mantienen con colas monótonas, así que
+cada día cuesta O(1) amortizado por ventana y todas las ventanas se calculan
+en un solo recorrido de la serie. En los primeros días, mientras la ventana
+aún no se llena, se usan los días disponibles.
+"""
+from collections import deque
+from typing import Dict, Iterable, List
+
+VENTANAS_VALIDAS = (30, 90, 180, 365)
+
+
+class MinMaxDeslizante:
+    """Mínimo y máximo de los últimos `ventana` valores con colas monótonas."""
+
+    def __init__(self, ventana: int):
+        if ventana < 1:
+            raise ValueError("La ventana debe ser de al menos 1 día")
+        self.ventana = ventana
+        self._minimos = deque()  # (posición, valor) con valores crecientes
+        self._maximos = deque()  # (posición, valor) con valores decrecientes
+        self._pos = -1
+
+    def agregar(self, valor: float):
+        self._pos += 1
+        while self._minimos and self._minimos[-1][1] >= valor:
+            self._minimos.pop()
+        self._minimos.append((self._pos, valor))
+        while self._maximos and self._maximos[-1][1] <= valor:
+            self._maximos.pop()
+        self._maximos.append((self._pos, valor))
+        limite = self._pos - self.ventana
+        if self._minimos[0][0] <= limite:
+            self._minimos.popleft()
+        if self._maximos[0][0] <= limite:
+            self._maximos.popleft()
+
+    def minimo(self) -> float:
+        return self._minimos[0][1]
+
+    def maximo(self) -> float:
+        return self._maximos[0][1]
+
+
+def _normalizar(valor: float, ventana: MinMaxDeslizante) -> float:
+    minimo = ventana.minimo()
+    return (valor - minimo) / (ventana.maximo() - minimo + 1e-10)
+
+
+def indice_movil(precipitacion: List[float], temperatura: List[float],
+                 evapotranspiracion: List[float],
+                 ventanas: Iterable[int] = VENTANAS_VALIDAS) -> Dict[int, List[float]]:
+    """Devuelve {ventana: [índice diario]} alineado con las series de entrada."""
+    ventanas = sorted(set(int(w) for w in ventanas))
+    estado = {
+        w: (MinMaxDeslizante(w), MinMaxDeslizante(w), MinMaxDeslizante(w))
+        for w in ventanas
+    }
+    resultado = {w: [] for w in ventanas}
+    for p, t, e in zip(precipitacion, temperatura, evapotranspiracion):
+        for w in ventanas:
+            mm_p, mm_t, mm_e = estado[w]
+            mm_p.agregar(p)
+            mm_t.agregar(t)
+            mm_e.agregar(e)
+            resultado[w].append(
+                0.6 * (1 - _normalizar(p, mm_p)) + 0.2 * _normalizar(t, mm_t) + 0.2 * _normalizar(e, mm_e)
+            )
+    return resultado
+
+
+def parsear_ventanas(texto: str) -> List[int]:
+    """Convierte '30,90' en [30, 90]; lanza ValueError si alguna no es válida."""
+    ventanas = []
+    for parte in texto.split(','):
+        parte = parte.strip()
+        if not parte:
+            continue
+        try:
+            w = int(parte)
+        except ValueError:
+            raise ValueError(f"Ventana inválida: '{parte}'")
+        if w not in VENTANAS_VALIDAS:
+            raise ValueError(f"Ventana {w} no permitida; use {', '.join(map(str, VENTANAS_VALIDAS))}")
+        ventanas.append(w)
+    if not ventanas:
+        raise ValueError("Debe indicar al menos una ventana")
+    return sorted(set(ventanas))
@@ -0,0 +1,259 @@
+"""Instantáneas de `/api/analizar` compartidas entre procesos.
+
+Con varios workers (gunicorn) cada proceso tiene su propio
+`AlmacenInstantaneas`: cada respuesta se calcula una vez por worker, ocupa
+memoria una vez por worker y dos workers pueden responder números distintos
+mientras uno se refresca. Aquí un solo proceso (el del programador,
+`SEQUIA_PROGRAMADOR=1`, o `py instantanea_compartida.py`) escribe las
+instantáneas de todos los municipios en un archivo y los demás lo mapean en
+memoria (`mmap`): el sistema operativo comparte las páginas entre procesos,
+así que ningún worker guarda su propia copia. Cada respuesta copia sólo las
+series de su municipio, porque el cuerpo JSON necesita listas.
+
+`SEQUIA_PROGRAMADOR=1` llega a todos los workers de gunicorn; escribe sólo
+el que toma el candado exclusivo de `<archivo>.lock` (`CandadoEscritor`). Si
+ese proceso muere, el sistema suelta el candado y otro worker lo toma. El
+escritor vuelve a publicar cada `SEQUIA_TTL_INSTANTANEA` segundos, y los
+lectores descartan un archivo con más de dos veces esa edad (p. ej. si el
+escritor se detuvo). Sin programador, `py instantanea_compartida.py` desde
+cron con el mismo periodo hace lo mismo.
+
+Formato del archivo (little-endian):
+
+    cabecera   'SEQC', versión (uint32), bytes de la tabla (uint64)
+    tabla      JSON UTF-8: columnas, marca de tiempo y, por municipio, el
+               desplazamiento de sus series, el número de días, la fecha
+               inicial y el resto del cuerpo de /api/analizar
+    relleno    hasta múltiplo de 8 bytes
+    datos      float64: por municipio, una columna de `dias` valores tras otra
+
+El archivo se escribe completo en un temporal y se reemplaza con
+`os.replace`, así que un lector ve la versión anterior o la nueva, nunca una
+mezcla; los lectores vuelven a mapearlo cuando cambia.
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional
+
+import metricas
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin candado (ahí conviene un solo worker)
+    fcntl = None
+
+MAGIA = b'SEQC'
+VERSION = 1
+_CABECERA = struct.Struct('<4sIQ')
+EDAD_MAXIMA = 2 * 6 * 3600  # segundos; dos periodos de publicación (SEQUIA_TTL_INSTANTANEA)
+
+
+def _fechas_consecutivas(fechas: List[str]) -> bool:
+    if not fechas:
+        return True
+    inicio = date.fromisoformat(fechas[0])
+    return fechas[-1] == (inicio + timedelta(days=len(fechas) - 1)).isoformat()
+
+
+def escribir(ruta: str, cuerpos: Dict[str, Dict[str, Any]], marca_tiempo: Optional[float] = None) -> int:
+    """Escribe las instantáneas {municipio: cuerpo} de forma atómica.
+
+    Se guardan como arreglos las columnas numéricas de `series`; lo demás
+    (índice, categoría, modelo, promedios, ...) va en la tabla. Devuelve el
+    tamaño del archivo en bytes."""
+    datos = array('d')
+    entradas = {}
+    columnas: List[str] = []
+    for municipio, cuerpo in cuerpos.items():
+        series = cuerpo["series"]
+        fechas = series["fechas"]
+        numericas = [n for n, v in series.items() if n != 'fechas' and isinstance(v, list)]
+        for nombre in numericas:
+            if nombre not in columnas:
+                columnas.append(nombre)
+        entrada = {
+            "desplazamiento": len(datos),
+            "dias": len(fechas),
+            "inicio": fechas[0] if fechas else None,
+            "columnas": numericas,
+            # Lo que no es una columna numérica (p. ej. índices móviles anidados) viaja tal cual
+            "series_extra": {n: v for n, v in series.items() if n != 'fechas' and n not in numericas},
+            "cuerpo": {k: v for k, v in cuerpo.items() if k != 'series'},
+        }
+        if not _fechas_consecutivas(fechas):
+            entrada["fechas"] = fechas
+        for nombre in numericas:
+            datos.extend(float(v) for v in series[nombre])
+        entradas[municipio] = entrada
+
+    tabla = json.dumps({
+        "marca_tiempo": time.time() if marca_tiempo is None else marca_tiempo,
+        "columnas": columnas,
+        "municipios": entradas,
+    }, ensure_ascii=False).encode('utf-8')
+    relleno = -(_CABECERA.size + len(tabla)) % 8
+    if sys.byteorder != 'little':
+        datos.byteswap()
+
+    directorio = os.path.dirname(os.path.abspath(ruta))
+    os.makedirs(directorio, exist_ok=True)
+    fd, temporal = tempfile.mkstemp(dir=directorio, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_CABECERA.pack(MAGIA, VERSION, len(tabla)))
+            f.write(tabla)
+            f.write(b'\0' * relleno)
+            f.write(datos.tobytes())
+        os.replace(temporal, ruta)
+    except BaseException:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+    return _CABECERA.size + len(tabla) + relleno + len(datos) * 8
+
+
+class CandadoEscritor:
+    """Elige, entre los procesos que comparten `ruta`, al único que la
+    escribe: el que tiene el candado exclusivo de `<ruta>.lock`. El candado
+    dura lo que el proceso; sin `fcntl` cualquiera lo obtiene."""
+
+    def __init__(self, ruta: str):
+        self.ruta = ruta + '.lock'
+        self._archivo = None
+        self._candado = threading.Lock()
+
+    def tomar(self) -> bool:
+        """True si este proceso es (o acaba de volverse) el escritor."""
+        with self._candado:
+            if self._archivo is not None or fcntl is None:
+                return True
+            os.makedirs(os.path.dirname(os.path.abspath(self.ruta)), exist_ok=True)
+            archivo = open(self.ruta, 'a')
+            try:
+                fcntl.flock(archivo.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                archivo.close()
+                return False
+            self._archivo = archivo
+            return True
+
+
+class InstantaneaCompartida:
+    """Lector del archivo de instantáneas; lo vuelve a mapear si cambia."""
+
+    def __init__(self, ruta: str, edad_maxima: float = EDAD_MAXIMA):
+        self.ruta = ruta
+        self.edad_maxima = edad_maxima
+        self._firma = None
+        # (tabla, memoryview float64 sobre el mapa, fechas ya armadas); se
+        # reemplaza completo para que una petición nunca mezcle dos versiones
+        self._estado = ({"municipios": {}}, None, {})
+        self._candado = threading.Lock()
+
+    def _recargar_si_cambio(self):
+        try:
+            st = os.stat(self.ruta)
+        except OSError:
+            return
+        firma = (st.st_mtime_ns, st.st_size, st.st_ino)
+        if firma == self._firma:
+            return
+        with self._candado:
+            if firma == self._firma:
+                return
+            try:
+                with open(self.ruta, 'rb') as f:
+                    mapa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                magia, version, largo = _CABECERA.unpack_from(mapa, 0)
+                if magia != MAGIA or version != VERSION:
+                    raise ValueError(f"formato desconocido ({magia!r}, versión {version})")
+                tabla = json.loads(bytes(mapa[_CABECERA.size:_CABECERA.size + largo]).decode('utf-8'))
+                inicio = _CABECERA.size + largo
+                inicio += -inicio % 8
+                datos = memoryview(mapa)[inicio:].cast('d')
+                if sys.byteorder != 'little':
+                    # Sin lectura directa: una copia con los bytes invertidos
+                    copia = array('d', datos.tobytes())
+                    copia.byteswap()
+                    datos = memoryview(copia)
+            except (OSError, ValueError, struct.error) as e:
+                # Se conserva la versión anterior; no se reintenta hasta el siguiente cambio
+                print(f"[COMPARTIDA] No se pudo leer {self.ruta}: {e}")
+            else:
+                # El mapa anterior se libera cuando ninguna petición lo usa
+                self._estado = (tabla, datos, {})
+            self._firma = firma
+
+    @property
+    def marca_tiempo(self) -> Optional[float]:
+        self._recargar_si_cambio()
+        return self._estado[0].get("marca_tiempo")
+
+    def municipios(self) -> List[str]:
+        self._recargar_si_cambio()
+        return list(self._estado[0]["municipios"])
+
+    @staticmethod
+    def _fechas_de(entrada: Dict[str, Any]) -> List[str]:
+        fechas = entrada.get("fechas")
+        if fechas is None and entrada["inicio"]:
+            inicio = date.fromisoformat(entrada["inicio"])
+            fechas = [(inicio + timedelta(days=i)).isoformat() for i in range(entrada["dias"])]
+        return fechas or []
+
+    def obtener(self, municipio: str) -> Optional[Dict[str, Any]]:
+        """Cuerpo de /api/analizar del municipio; None si no está o si el
+        archivo tiene más de `edad_maxima` segundos."""
+        self._recargar_si_cambio()
+        tabla, datos, fechas = self._estado
+        entrada = tabla["municipios"].get(municipio)
+        if entrada is None:
+            metricas.registrar_cache('compartida', 'fallo')
+            return None
+        if time.time() - tabla["marca_tiempo"] > self.edad_maxima:
+            metricas.registrar_cache('compartida', 'vencida')
+            return None
+        metricas.registrar_cache('compartida', 'acierto')
+        dias = entrada["dias"]
+        if municipio not in fechas:
+            fechas[municipio] = self._fechas_de(entrada)
+        series = {"fechas": fechas[municipio]}
+        for i, nombre in enumerate(entrada["columnas"]):
+            desde = entrada["desplazamiento"] + i * dias
+            series[nombre] = datos[desde:desde + dias].tolist()
+        series.update(entrada["series_extra"])
+        return dict(entrada["cuerpo"], series=series)
+
+
+def main_cli():
+    """Calcula las instantáneas de todos los municipios y escribe el archivo
+    compartido (alternativa a `SEQUIA_PROGRAMADOR=1`, desde cron cada
+    `SEQUIA_TTL_INSTANTANEA` segundos)."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Escribe las instantáneas compartidas de /api/analizar')
+    parser.add_argument('--salida', default=os.environ.get('SEQUIA_INSTANTANEA_COMPARTIDA'),
+                        help='Archivo a escribir (por defecto SEQUIA_INSTANTANEA_COMPARTIDA)')
+    args = parser.parse_args()
+    if not args.salida:
+        print("Indique --salida o SEQUIA_INSTANTANEA_COMPARTIDA")
+        return 1
+
+    import api  # importación tardía: trae Flask y el almacén de series
+
+    cuerpos = api._calcular_instantaneas(list(api.MUNICIPIOS))
+    tamano = escribir(args.salida, cuerpos)
+    print(f"{len(cuerpos)} municipios escritos en {args.salida} ({tamano / 1024:.0f} KiB)")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main_cli())
@@ -0,0 +1,128 @@
+"""Instantáneas en memoria de las respuestas de `/api/analizar`.
+
+`AlmacenInstantaneas` guarda el cuerpo JSON completo de cada municipio con
+la hora en que se generó. Las peticiones se responden desde ahí; si una
+instantánea está vencida se entrega de todos modos y se recalcula en un hilo
+de fondo (stale-while-revalidate), así que la latencia es la de una
+consulta a un diccionario y los picos de tráfico no llegan a Open-Meteo.
+
+Un hilo programador refresca todos los municipios una vez al día, poco
+después de la actualización diaria del archivo de Open-Meteo.
+"""
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import metricas
+
+
+class AlmacenInstantaneas:
+    """Almacén de instantáneas por municipio.
+
+    - calcular_lote: función que recibe una lista de municipios y devuelve
+      {municipio: cuerpo_json}; los municipios sin datos se omiten.
+    - ttl: segundos tras los cuales una instantánea se considera vencida.
+      También se vence al cambiar el día, porque el archivo agrega un día nuevo.
+    - nombre: etiqueta `cache` en las métricas de aciertos.
+    - completo: función que dice si un cuerpo está completo; uno incompleto
+      (p. ej. un mapa con celdas aún sin descargar) se entrega pero cuenta
+      como vencido, así que cada petición lo vuelve a calcular en segundo plano.
+    """
+
+    def __init__(self, calcular_lote: Callable[[List[str]], Dict[str, Any]], ttl: float = 6 * 3600,
+                 nombre: str = 'instantaneas', completo: Optional[Callable[[Any], bool]] = None):
+        self._calcular_lote = calcular_lote
+        self.ttl = ttl
+        self.nombre = nombre
+        self._completo = completo
+        self._datos: Dict[str, Dict[str, Any]] = {}
+        self._candado = threading.Lock()
+        self._revalidando = set()
+        self._programador: Optional[threading.Thread] = None
+
+    def _vencida(self, entrada: Dict[str, Any]) -> bool:
+        return (not entrada['completo']
+                or time.time() - entrada['marca_tiempo'] > self.ttl
+                or entrada['dia'] != date.today())
+
+    def refrescar(self, municipios: Iterable[str]) -> int:
+        """Recalcula y guarda las instantáneas indicadas. Devuelve cuántas se guardaron."""
+        municipios = list(municipios)
+        resultados = self._calcular_lote(municipios)
+        ahora = time.time()
+        with self._candado:
+            for municipio, cuerpo in resultados.items():
+                self._datos[municipio] = {
+                    'marca_tiempo': ahora, 'dia': date.today(), 'cuerpo': cuerpo,
+                    'completo': self._completo is None or self._completo(cuerpo),
+                }
+        return len(resultados)
+
+    def _revalidar(self, municipio: str):
+        try:
+            self.refrescar([municipio])
+        except Exception as e:
+            print(f"[INSTANTANEAS] Error al revalidar {municipio}: {e}")
+        finally:
+            with self._candado:
+                self._revalidando.discard(municipio)
+
+    def _revalidar_en_segundo_plano(self, municipio: str):
+        with self._candado:
+            if municipio in self._revalidando:
+                return
+            self._revalidando.add(municipio)
+        threading.Thread(target=self._revalidar, args=(municipio,), daemon=True).start()
+
+    def obtener(self, municipio: str) -> Optional[Dict[str, Any]]:
+        """Devuelve {'cuerpo', 'marca_tiempo'} del municipio.
+
+        Sin instantánea previa se calcula en el momento; si está vencida se
+        entrega la que hay y se lanza la revalidación en segundo plano."""
+        entrada = self._datos.get(municipio)
+        if entrada is None:
+            metricas.registrar_cache(self.nombre, 'fallo')
+            self.refrescar([municipio])
+            entrada = self._datos.get(municipio)
+            if entrada is None:
+                return None
+        elif self._vencida(entrada):
+            metricas.registrar_cache(self.nombre, 'vencida')
+            self._revalidar_en_segundo_plano(municipio)
+        else:
+            metricas.registrar_cache(self.nombre, 'acierto')
+        return entrada
+
+    def iniciar_programador(self, municipios: Iterable[str], hora: str = "03:00",
+                            al_refrescar: Optional[Callable[[Dict[str, Any]], None]] = None,
+                            intervalo: Optional[float] = None):
+        """Lanza el hilo que refresca todos los municipios al arrancar y luego
+        cada día a la hora local `hora` (HH:MM), y además cada `intervalo`
+        segundos si se indica. `al_refrescar` recibe {municipio: cuerpo} tras
+        cada actualización (p. ej. para publicarlas a otros procesos)."""
+        if self._programador is not None:
+            return
+        municipios = list(municipios)
+        horas, minutos = (int(x) for x in hora.split(':'))
+
+        def _ciclo():
+            while True:
+                try:
+                    total = self.refrescar(municipios)
+                    print(f"[INSTANTANEAS] {total} municipios actualizados")
+                    if al_refrescar is not None:
+                        with self._candado:
+                            cuerpos = {m: self._datos[m]['cuerpo'] for m in municipios if m in self._datos}
+                        al_refrescar(cuerpos)
+                except Exception as e:
+                    print(f"[INSTANTANEAS] Error en la actualización programada: {e}")
+                ahora = datetime.now()
+                siguiente = ahora.replace(hour=horas, minute=minutos, second=0, microsecond=0)
+                if siguiente <= ahora:
+                    siguiente += timedelta(days=1)
+                espera = (siguiente - ahora).total_seconds()
+                time.sleep(min(espera, intervalo) if intervalo else espera)
+
+        self._programador = threading.Thread(target=_ciclo, name='programador-instantaneas', daemon=True)
+        self._programador.start()
@@ -0,0 +1,138 @@
+"""Control de las consultas a Open-Meteo: vuelo único y presupuesto de cuota.
+
+- `VueloUnico` / `VueloUnicoAsync`: si llegan varias peticiones idénticas
+  (mismas coordenadas y mismo rango de fechas) mientras una está en curso,
+  sólo la primera consulta Open-Meteo; las demás esperan y reciben el mismo
+  resultado (o la misma excepción).
+- `CuboFichas`: cubeta de fichas que se rellena al ritmo de la cuota diaria.
+  Si no alcanzan las fichas la consulta espera en fila hasta `espera_maxima`
+  segundos; si la espera sería mayor se lanza `PresupuestoAgotado` sin tocar
+  Open-Meteo, y quien llama responde con los días guardados o con un 503.
+
+Open-Meteo cuenta como varias llamadas las consultas con varias ubicaciones
+o con más de dos semanas de datos; `costo_llamada` aproxima ese conteo.
+"""
+import asyncio
+import math
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+import requests
+
+CUOTA_DIARIA = 10000  # llamadas por día del plan gratuito de Open-Meteo
+RAFAGA = 600  # llamadas por minuto; capacidad de la cubeta
+ESPERA_MAXIMA = 10.0  # segundos que una consulta puede esperar en fila
+
+
+class PresupuestoAgotado(requests.RequestException):
+    """No quedan fichas para consultar Open-Meteo sin exceder la cuota."""
+
+    def __init__(self, reintentar_en: float):
+        super().__init__(f"Cuota de Open-Meteo agotada; reintente en {math.ceil(reintentar_en)} s")
+        self.reintentar_en = reintentar_en
+
+
+def costo_llamada(ubicaciones: int, dias: int) -> float:
+    """Llamadas que Open-Meteo descuenta por una consulta (cada 14 días de
+    datos y cada ubicación cuentan como una llamada más)."""
+    return ubicaciones * max(1.0, dias / 14.0)
+
+
+class CuboFichas:
+    """Cubeta de fichas segura entre hilos."""
+
+    def __init__(self, capacidad: float = RAFAGA, por_segundo: float = CUOTA_DIARIA / 86400.0,
+                 espera_maxima: float = ESPERA_MAXIMA):
+        self.capacidad = capacidad
+        self.por_segundo = por_segundo
+        self.espera_maxima = espera_maxima
+        self._fichas = float(capacidad)
+        self._marca = time.monotonic()
+        self._candado = threading.Lock()
+
+    def reservar(self, costo: float) -> float:
+        """Descuenta `costo` fichas y devuelve cuántos segundos hay que esperar
+        antes de consultar. Las fichas pueden quedar negativas: eso es la fila
+        de las consultas ya reservadas que aún esperan."""
+        with self._candado:
+            ahora = time.monotonic()
+            self._fichas = min(self.capacidad, self._fichas + (ahora - self._marca) * self.por_segundo)
+            self._marca = ahora
+            # Una consulta mayor que la cubeta nunca cabría: se cobra la cubeta llena
+            costo = min(costo, self.capacidad)
+            espera = max(0.0, (costo - self._fichas) / self.por_segundo)
+            if espera > self.espera_maxima:
+                raise PresupuestoAgotado(espera)
+            self._fichas -= costo
+            return espera
+
+    def espera_libre(self, costo: float, reserva: float = 0.0) -> float:
+        """Segundos hasta que haya `costo` fichas además de `reserva`, sin
+        descontar nada (0 si ya las hay). Para consultas de fondo que sólo
+        deben usar las fichas que sobran."""
+        with self._candado:
+            fichas = min(self.capacidad, self._fichas + (time.monotonic() - self._marca) * self.por_segundo)
+        return max(0.0, (min(costo, self.capacidad) + reserva - fichas) / self.por_segundo)
+
+    def tomar(self, costo: float):
+        espera = self.reservar(costo)
+        if espera > 0:
+            time.sleep(espera)
+
+    async def tomar_async(self, costo: float):
+        espera = self.reservar(costo)
+        if espera > 0:
+            await asyncio.sleep(espera)
+
+
+class _Vuelo:
+    def __init__(self):
+        self.listo = threading.Event()
+        self.resultado: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class VueloUnico:
+    """Agrupa las llamadas simultáneas con la misma clave (versión con hilos)."""
+
+    def __init__(self):
+        self._candado = threading.Lock()
+        self._vuelos: Dict[Hashable, _Vuelo] = {}
+
+    def ejecutar(self, clave: Hashable, funcion: Callable[[], Any]) -> Any:
+        with self._candado:
+            vuelo = self._vuelos.get(clave)
+            lider = vuelo is None
+            if lider:
+                vuelo = self._vuelos[clave] = _Vuelo()
+        if not lider:
+            vuelo.listo.wait()
+            if vuelo.error is not None:
+                raise vuelo.error
+            return vuelo.resultado
+        try:
+            vuelo.resultado = funcion()
+            return vuelo.resultado
+        except BaseException as e:
+            vuelo.error = e
+            raise
+        finally:
+            with self._candado:
+                del self._vuelos[clave]
+            vuelo.listo.set()
+
+
+class VueloUnicoAsync:
+    """Igual que `VueloUnico` para corrutinas dentro de un mismo ciclo de eventos."""
+
+    def __init__(self):
+        self._vuelos: Dict[Hashable, asyncio.Future] = {}
+
+    async def ejecutar(self, clave: Hashable, funcion: Callable[[], Awaitable[Any]]) -> Any:
+        tarea = self._vuelos.get(clave)
+        if tarea is None:
+            tarea = self._vuelos[clave] = asyncio.ensure_future(funcion())
+            tarea.add_done_callback(lambda _: self._vuelos.pop(clave, None))
+        # shield: si una petición se cancela, las demás siguen esperando la consulta
+        return await asyncio.shield(tarea)
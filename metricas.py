@@ -0,0 +1,136 @@
+"""Métricas del servicio en formato de texto de Prometheus.
+
+Registro en memoria, seguro entre hilos y sin dependencias:
+
+- Histogramas de duración por etapa (`etapa('descarga')`, ...) y por ruta.
+- Contadores de aciertos/fallos de las cachés y de errores de Open-Meteo.
+
+`exposicion()` produce el texto que sirve `/api/metrics`. Cada proceso
+lleva su propio registro; con varios workers de gunicorn Prometheus debe
+consultar cada uno (o usar un solo worker con hilos).
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+LIMITES_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Etiquetas = Tuple[Tuple[str, str], ...]
+
+
+def _etiquetas(etiquetas: Dict[str, str]) -> Etiquetas:
+    return tuple(sorted(etiquetas.items()))
+
+
+def _texto_etiquetas(etiquetas: Etiquetas, extra: str = '') -> str:
+    partes = ['{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in etiquetas]
+    if extra:
+        partes.append(extra)
+    return '{' + ','.join(partes) + '}' if partes else ''
+
+
+class Histograma:
+    def __init__(self, nombre: str, ayuda: str, limites=LIMITES_SEGUNDOS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.limites = tuple(limites)
+        self._series: Dict[Etiquetas, List[float]] = {}  # cubetas..., suma, cuenta
+        self._candado = threading.Lock()
+
+    def observar(self, valor: float, **etiquetas: str):
+        clave = _etiquetas(etiquetas)
+        with self._candado:
+            serie = self._series.get(clave)
+            if serie is None:
+                serie = self._series[clave] = [0.0] * (len(self.limites) + 2)
+            for i, limite in enumerate(self.limites):
+                if valor <= limite:
+                    serie[i] += 1
+                    break
+            serie[-2] += valor
+            serie[-1] += 1
+
+    def exponer(self) -> Iterator[str]:
+        yield f"# HELP {self.nombre} {self.ayuda}"
+        yield f"# TYPE {self.nombre} histogram"
+        with self._candado:
+            series = {k: list(v) for k, v in self._series.items()}
+        for clave, serie in sorted(series.items()):
+            acumulado = 0.0
+            for limite, cuenta in zip(self.limites, serie):
+                acumulado += cuenta
+                etiquetas = _texto_etiquetas(clave, 'le="%g"' % limite)
+                yield f"{self.nombre}_bucket{etiquetas} {acumulado:g}"
+            etiquetas = _texto_etiquetas(clave, 'le="+Inf"')
+            yield f"{self.nombre}_bucket{etiquetas} {serie[-1]:g}"
+            yield f"{self.nombre}_sum{_texto_etiquetas(clave)} {serie[-2]:.6f}"
+            yield f"{self.nombre}_count{_texto_etiquetas(clave)} {serie[-1]:g}"
+
+
+class Contador:
+    def __init__(self, nombre: str, ayuda: str):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self._valores: Dict[Etiquetas, float] = {}
+        self._candado = threading.Lock()
+
+    def incrementar(self, cantidad: float = 1, **etiquetas: str):
+        clave = _etiquetas(etiquetas)
+        with self._candado:
+            self._valores[clave] = self._valores.get(clave, 0.0) + cantidad
+
+    def valores(self) -> Dict[Etiquetas, float]:
+        with self._candado:
+            return dict(self._valores)
+
+    def exponer(self) -> Iterator[str]:
+        yield f"# HELP {self.nombre} {self.ayuda}"
+        yield f"# TYPE {self.nombre} counter"
+        for clave, valor in sorted(self.valores().items()):
+            yield f"{self.nombre}{_texto_etiquetas(clave)} {valor:g}"
+
+
+ETAPAS = Histograma('sequia_etapa_segundos',
+                    'Duración de cada etapa (descarga, decodificacion_json, indice, modelo_riesgo, ...)')
+PETICIONES = Histograma('sequia_peticion_segundos', 'Duración de las peticiones HTTP por ruta')
+CACHE = Contador('sequia_cache_consultas_total', 'Consultas a las cachés por resultado')
+ERRORES_OPEN_METEO = Contador('sequia_open_meteo_errores_total', 'Consultas a Open-Meteo fallidas por tipo')
+
+
+@contextmanager
+def etapa(nombre: str):
+    """Mide la duración del bloque y la registra en `sequia_etapa_segundos`."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        ETAPAS.observar(time.perf_counter() - inicio, etapa=nombre)
+
+
+def registrar_cache(cache: str, resultado: str):
+    """resultado: 'acierto', 'vencida' (entregada y revalidada) o 'fallo'."""
+    CACHE.incrementar(cache=cache, resultado=resultado)
+
+
+def _proporcion_aciertos() -> Iterator[str]:
+    nombre = 'sequia_cache_proporcion_aciertos'
+    yield f"# HELP {nombre} Proporción de consultas respondidas desde la caché (incluye vencidas)"
+    yield f"# TYPE {nombre} gauge"
+    totales: Dict[str, List[float]] = {}
+    for clave, valor in CACHE.valores().items():
+        etiquetas = dict(clave)
+        total = totales.setdefault(etiquetas['cache'], [0.0, 0.0])
+        total[1] += valor
+        if etiquetas['resultado'] != 'fallo':
+            total[0] += valor
+    for cache, (aciertos, total) in sorted(totales.items()):
+        yield f'{nombre}{{cache="{cache}"}} {aciertos / total if total else 0.0:.4f}'
+
+
+def exposicion() -> str:
+    lineas: List[str] = []
+    for metrica in (ETAPAS, PETICIONES, CACHE, ERRORES_OPEN_METEO):
+        lineas.extend(metrica.exponer())
+    lineas.extend(_proporcion_aciertos())
+    return '\n'.join(lineas) + '\n'
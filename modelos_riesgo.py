@@ -0,0 +1,298 @@
+"""Modelo de riesgo entrenado fuera de línea, con artefactos versionados.
+
+`calcular_riesgo_modelo` ajusta en cada petición la regresión simple y los
+mínimos cuadrados con la ventana consultada. Aquí los coeficientes de cada
+municipio se ajustan una vez sobre la historia larga y la predicción en
+línea (`analisis_sequia.riesgo_con_coeficientes`) se reduce a dos productos
+punto, la tendencia de los dos últimos días y la clasificación:
+
+- estadístico: regresión simple de la variable objetivo del día (sequía si
+  p < 20, la misma de `calcular_riesgo_modelo`) contra la lluvia media de
+  los `VENTANA` días previos; se evalúa con la lluvia media de la consulta.
+- álgebra lineal: mínimos cuadrados de la misma variable contra
+  [precipitación, temperatura] con intercepto. La marginación no varía en
+  la historia, así que no entra en el ajuste. Una consulta con `marg`
+  explícito no usa estos coeficientes: se ajusta en línea con
+  `calcular_riesgo_modelo`, como sin modelo entrenado.
+
+El entrenamiento recorre la historia por años (memoria acotada) y escribe
+un artefacto nuevo en `SEQUIA_MODELOS` (por defecto `modelos/`):
+
+    py modelos_riesgo.py --desde 1991-01-01 --hasta 2020-12-31
+    py modelos_riesgo.py --listar
+    py modelos_riesgo.py --activar 20240101T030000
+
+Toda la historia de todos los municipios son decenas de miles de llamadas a
+Open-Meteo, varias veces la cuota diaria: la descarga va al ritmo del
+presupuesto (`descarga_pausada.py`, hasta `--espera-cuota` segundos) y cada
+municipio ajustado se anota en un archivo de progreso (`Progreso`). Si la
+cuota se acaba, el comando termina con código 1 sin publicar; volver a
+correrlo continúa con los que faltan y publica la versión al completarlos.
+
+Cada artefacto (`riesgo_<version>.json`) es inmutable; el archivo `ACTIVO`
+indica cuál se usa. Entrenar o `--activar` lo reemplazan de forma atómica y
+`ModelosRiesgo` lo vuelve a leer en la siguiente predicción, sin reiniciar
+el servidor.
+"""
+import json
+import os
+import sys
+import tempfile
+from collections import deque
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional
+
+from analisis_sequia import AcumuladorMinimosCuadrados
+from descarga_pausada import CUOTA_AGOTADA, ESPERA_CUOTA, DescargaPausada
+
+VENTANA = 90  # días, la ventana por defecto de /api/analizar
+UMBRAL_SEQUIA_MM = 20  # variable objetivo de calcular_riesgo_modelo
+DIRECTORIO_MODELOS = os.environ.get(
+    'SEQUIA_MODELOS',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'modelos')
+)
+ARCHIVO_ACTIVO = 'ACTIVO'
+
+
+class EntrenamientoRiesgo:
+    """Acumula los ajustes de un municipio bloque por bloque (en orden)."""
+
+    def __init__(self, ventana: int = VENTANA):
+        self._previos = deque(maxlen=ventana)
+        self._suma_previos = 0.0
+        self._simple = [0.0] * 5  # n, Σx, Σy, Σx², Σxy
+        self._algebra = AcumuladorMinimosCuadrados(2)
+
+    def agregar_bloque(self, bloque: Dict[str, List]):
+        for p, t in zip(bloque["precipitacion"], bloque["temperatura"]):
+            self.agregar_dia(p, t)
+
+    def agregar_dia(self, p: float, t: float):
+        y = 1.0 if p < UMBRAL_SEQUIA_MM else 0.0
+        if len(self._previos) == self._previos.maxlen:
+            x = self._suma_previos / len(self._previos)
+            s = self._simple
+            s[0] += 1
+            s[1] += x
+            s[2] += y
+            s[3] += x * x
+            s[4] += x * y
+            self._suma_previos -= self._previos[0]
+        self._previos.append(p)
+        self._suma_previos += p
+        self._algebra.agregar([p, t], y)
+
+    def ajustar(self) -> Optional[Dict[str, Any]]:
+        """Coeficientes del municipio; None si la historia es más corta que la ventana."""
+        n, sx, sy, sxx, sxy = self._simple
+        if n < 3:
+            return None
+        denom = n * sxx - sx ** 2
+        beta1 = (n * sxy - sx * sy) / denom if denom else 0.0
+        beta0 = (sy - beta1 * sx) / n
+        try:
+            b_precip, b_temp, intercepto = self._algebra.coeficientes()
+        except (ValueError, ZeroDivisionError):
+            return None
+        return {
+            "estadistico": {"beta0": beta0, "beta1": beta1},
+            "algebra": {"precipitacion": b_precip, "temperatura": b_temp, "intercepto": intercepto},
+            "dias": self._algebra.n,
+        }
+
+
+def _escribir_atomico(ruta: str, contenido: str):
+    directorio = os.path.dirname(os.path.abspath(ruta))
+    fd, temporal = tempfile.mkstemp(dir=directorio, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(contenido)
+    os.replace(temporal, ruta)
+
+
+class ModelosRiesgo:
+    """Artefacto activo; se vuelve a leer si `ACTIVO` cambia."""
+
+    def __init__(self, directorio: str = DIRECTORIO_MODELOS):
+        self.directorio = directorio
+        self._mtime = None
+        self._datos: Dict[str, Any] = {'municipios': {}}
+
+    def _ruta(self, version: str) -> str:
+        return os.path.join(self.directorio, f"riesgo_{version}.json")
+
+    def _recargar_si_cambio(self):
+        puntero = os.path.join(self.directorio, ARCHIVO_ACTIVO)
+        try:
+            mtime = os.stat(puntero).st_mtime
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(puntero, 'r', encoding='utf-8') as f:
+                version = f.read().strip()
+            with open(self._ruta(version), 'r', encoding='utf-8') as f:
+                self._datos = json.load(f)
+        except (OSError, ValueError) as e:
+            # Se conserva el modelo anterior; no se reintenta hasta el siguiente cambio
+            print(f"[MODELOS] No se pudo cargar el modelo activo: {e}")
+        self._mtime = mtime
+
+    @property
+    def version(self) -> Optional[str]:
+        self._recargar_si_cambio()
+        return self._datos.get('version')
+
+    def coeficientes(self, municipio: str) -> Optional[Dict[str, Any]]:
+        self._recargar_si_cambio()
+        return self._datos.get('municipios', {}).get(municipio)
+
+    def municipios(self) -> Dict[str, Dict[str, Any]]:
+        """Coeficientes de todos los municipios de la versión activa."""
+        self._recargar_si_cambio()
+        return dict(self._datos.get('municipios', {}))
+
+    def versiones(self) -> List[str]:
+        try:
+            nombres = os.listdir(self.directorio)
+        except OSError:
+            return []
+        return sorted(n[len('riesgo_'):-len('.json')] for n in nombres
+                      if n.startswith('riesgo_') and n.endswith('.json'))
+
+    def activar(self, version: str):
+        if not os.path.exists(self._ruta(version)):
+            raise ValueError(f"No existe la versión '{version}'")
+        _escribir_atomico(os.path.join(self.directorio, ARCHIVO_ACTIVO), version + '\n')
+
+    def publicar(self, municipios: Dict[str, Dict[str, Any]]) -> str:
+        """Escribe un artefacto nuevo, lo activa y devuelve su versión."""
+        os.makedirs(self.directorio, exist_ok=True)
+        version = base = datetime.now().strftime('%Y%m%dT%H%M%S')
+        n = 1
+        while os.path.exists(self._ruta(version)):
+            # Dos publicaciones en el mismo segundo: no pisar un artefacto
+            n += 1
+            version = f"{base}-{n}"
+        artefacto = {
+            "version": version,
+            "creado": datetime.now().isoformat(timespec='seconds'),
+            "ventana": VENTANA,
+            "municipios": municipios,
+        }
+        _escribir_atomico(self._ruta(version), json.dumps(artefacto, ensure_ascii=False))
+        self.activar(version)
+        return version
+
+
+class Progreso:
+    """Coeficientes ya ajustados de un entrenamiento en curso.
+
+    Entrenar todos los municipios excede la cuota diaria de Open-Meteo, así
+    que cada municipio se anota en `entrenamiento_<desde>_<hasta>.json` en
+    cuanto termina (None si su historia no alcanzó); una corrida interrumpida
+    sigue con los que faltan y la versión se publica cuando están todos."""
+
+    def __init__(self, directorio: str, desde: date, hasta: date):
+        self.ruta = os.path.join(directorio, f"entrenamiento_{desde.isoformat()}_{hasta.isoformat()}.json")
+        self.municipios: Dict[str, Optional[Dict[str, Any]]] = {}
+        try:
+            with open(self.ruta, 'r', encoding='utf-8') as f:
+                self.municipios = json.load(f)["municipios"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def guardar(self, municipio: str, coeficientes: Optional[Dict[str, Any]]):
+        self.municipios[municipio] = coeficientes
+        os.makedirs(os.path.dirname(os.path.abspath(self.ruta)), exist_ok=True)
+        _escribir_atomico(self.ruta, json.dumps({"municipios": self.municipios}, ensure_ascii=False))
+
+    def terminar(self):
+        try:
+            os.remove(self.ruta)
+        except OSError:
+            pass
+
+
+def main_cli(argv=None):
+    """Entrena los coeficientes de uno o todos los municipios y publica una versión nueva."""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Entrenamiento del modelo de riesgo por municipio')
+    parser.add_argument('--desde', default='1991-01-01', help='Inicio de la historia de entrenamiento (YYYY-MM-DD)')
+    parser.add_argument('--hasta', default='2020-12-31', help='Fin de la historia de entrenamiento (YYYY-MM-DD)')
+    parser.add_argument('--municipio', action='append', help='Municipio a entrenar (se puede repetir); por defecto todos')
+    parser.add_argument('--directorio', default=DIRECTORIO_MODELOS, help='Directorio de artefactos')
+    parser.add_argument('--listar', action='store_true', help='Mostrar las versiones disponibles y la activa')
+    parser.add_argument('--activar', metavar='VERSION', help='Activar una versión existente (p. ej. para regresar a la anterior)')
+    parser.add_argument('--espera-cuota', type=float, default=ESPERA_CUOTA,
+                        help='Segundos máximos esperando cuota de Open-Meteo; lo que falte se descarga al volver a correr')
+    args = parser.parse_args(argv)
+
+    modelos = ModelosRiesgo(args.directorio)
+    if args.listar:
+        activa = modelos.version
+        for version in modelos.versiones():
+            print(f"{version}{'  (activa)' if version == activa else ''}")
+        return 0
+    if args.activar:
+        try:
+            modelos.activar(args.activar)
+        except ValueError as e:
+            print(e)
+            return 1
+        print(f"Versión activa: {args.activar}")
+        return 0
+
+    import api  # importación tardía: trae Flask y el almacén de series
+    import limite_open_meteo
+
+    desde, hasta = date.fromisoformat(args.desde), date.fromisoformat(args.hasta)
+    municipios = args.municipio or list(api.MUNICIPIOS)
+    desconocidos = [m for m in municipios if m not in api.MUNICIPIOS]
+    if desconocidos:
+        print(f"Municipios no encontrados: {', '.join(desconocidos)}")
+        return 1
+    progreso = Progreso(args.directorio, desde, hasta)
+    if progreso.municipios:
+        print(f"Se continúa el entrenamiento en curso: {len(progreso.municipios)} municipios ya ajustados")
+    pendientes = [m for m in municipios if m not in progreso.municipios]
+    descarga = DescargaPausada(desde, hasta, args.espera_cuota)
+    descarga.avisar(pendientes)
+    errores = {}
+    for municipio in pendientes:
+        entrenamiento = EntrenamientoRiesgo()
+        try:
+            for bloque in descarga.bloques(municipio):
+                entrenamiento.agregar_bloque(bloque)
+        except limite_open_meteo.PresupuestoAgotado:
+            errores[municipio] = CUOTA_AGOTADA
+        except Exception as e:
+            errores[municipio] = str(e)
+        if municipio in errores:
+            print(f"{municipio}: {errores[municipio]}", file=sys.stderr)
+            continue
+        resultado = entrenamiento.ajustar()
+        progreso.guardar(municipio, resultado)
+        if resultado is None:
+            print(f"{municipio}: historia insuficiente, se omite")
+        else:
+            print(f"{municipio}: {resultado['dias']} días")
+    if errores:
+        print(f"{len(errores)} municipios sin entrenar; vuelva a correr el mismo comando para continuar "
+              f"(lo ajustado está en {progreso.ruta})", file=sys.stderr)
+        return 1
+    # Los municipios no incluidos conservan los coeficientes de la versión activa
+    coeficientes = modelos.municipios()
+    periodo = {'desde': desde.isoformat(), 'hasta': hasta.isoformat()}
+    for municipio, resultado in progreso.municipios.items():
+        if resultado is not None:
+            coeficientes[municipio] = dict(resultado, periodo=periodo)
+    version = modelos.publicar(coeficientes)
+    progreso.terminar()
+    print(f"Versión {version} publicada y activa ({len(coeficientes)} municipios)")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main_cli())
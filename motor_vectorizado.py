@@ -0,0 +1,190 @@
+"""Motor vectorizado (NumPy) para el índice de sequía y el modelo de riesgo.
+
+Procesa muchas series a la vez: cada argumento es una matriz
+(municipios × días) y cada cálculo se hace para todas las filas en una sola
+llamada. Reproduce, dentro de la tolerancia numérica, los resultados de
+`api.calcular_indice_sequia` y `analisis_sequia.calcular_riesgo_modelo`.
+
+NumPy es opcional: si no está instalado `HAY_NUMPY` es False y quien llame
+debe usar las funciones originales con listas, que siguen siendo la ruta de
+referencia.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # NumPy es opcional
+    np = None
+
+from analisis_sequia import _clasificar_por_umbral
+
+HAY_NUMPY = np is not None
+
+
+def _requiere_numpy():
+    if not HAY_NUMPY:
+        raise RuntimeError("El motor vectorizado requiere NumPy; use las funciones con listas")
+
+
+def _matriz(datos) -> "np.ndarray":
+    """Convierte a matriz 2-D float64 (una serie por fila)."""
+    M = np.asarray(datos, dtype=float)
+    if M.ndim == 1:
+        M = M[np.newaxis, :]
+    return M
+
+
+def normalizar_min_max(M) -> "np.ndarray":
+    """Normalización min-max por fila (mismo épsilon que la versión con listas)."""
+    _requiere_numpy()
+    M = _matriz(M)
+    minimo = M.min(axis=1, keepdims=True)
+    maximo = M.max(axis=1, keepdims=True)
+    return (M - minimo) / (maximo - minimo + 1e-10)
+
+
+def indice_sequia_matriz(precipitacion, temperatura, evapotranspiracion) -> Tuple["np.ndarray", "np.ndarray"]:
+    """Índice ponderado I = 0.6*(1 - P_norm) + 0.2*T_norm + 0.2*E_norm por fila.
+
+    Devuelve (promedios, indices_diarios) con formas (m,) y (m, n)."""
+    _requiere_numpy()
+    indices = (0.6 * (1 - normalizar_min_max(precipitacion))
+               + 0.2 * normalizar_min_max(temperatura)
+               + 0.2 * normalizar_min_max(evapotranspiracion))
+    return indices.mean(axis=1), indices
+
+
+def tendencia_matriz(M) -> "np.ndarray":
+    """Diferencia entre los dos últimos puntos de cada fila (0 si hay menos de 2)."""
+    _requiere_numpy()
+    M = _matriz(M)
+    if M.shape[1] < 2:
+        return np.zeros(M.shape[0])
+    return M[:, -1] - M[:, -2]
+
+
+def regresion_simple_matriz(Y) -> Tuple["np.ndarray", "np.ndarray"]:
+    """Regresión lineal simple de cada fila contra x = 0..n-1.
+
+    Devuelve (beta0, beta1); ambas son 0 cuando el sistema es degenerado."""
+    _requiere_numpy()
+    Y = _matriz(Y)
+    m, n = Y.shape
+    if n < 2:
+        return np.zeros(m), np.zeros(m)
+    x = np.arange(n, dtype=float)
+    sum_x = x.sum()
+    sum_x2 = (x * x).sum()
+    sum_y = Y.sum(axis=1)
+    sum_xy = Y @ x
+    denom = n * sum_x2 - sum_x ** 2
+    beta1 = (n * sum_xy - sum_x * sum_y) / denom
+    beta0 = (sum_y - beta1 * sum_x) / n
+    return beta0, beta1
+
+
+def minimos_cuadrados_lote(X, y) -> "np.ndarray":
+    """Ajuste de mínimos cuadrados (con intercepto al final) para cada fila.
+
+    X tiene forma (m, n, k) e y (m, n); devuelve betas de forma (m, k+1).
+    Usa la pseudoinversa de X^T X, así que los sistemas singulares (por
+    ejemplo una columna constante junto al intercepto) dan la solución de
+    norma mínima en lugar de fallar."""
+    _requiere_numpy()
+    X = np.asarray(X, dtype=float)
+    y = np.asarray(y, dtype=float)
+    unos = np.ones(X.shape[:2] + (1,))
+    Xc = np.concatenate([X, unos], axis=2)
+    XtX = np.einsum('mnk,mnj->mkj', Xc, Xc)
+    Xty = np.einsum('mnk,mn->mk', Xc, y)
+    return (np.linalg.pinv(XtX, rcond=1e-10) @ Xty[:, :, np.newaxis])[:, :, 0]
+
+
+def riesgo_modelo_matriz(precipitacion, temperatura, marg=None,
+                         precip_actual=None, temp_actual=None) -> Dict[str, Any]:
+    """Equivalente vectorizado de `calcular_riesgo_modelo` con historia.
+
+    - precipitacion, temperatura: historias (m × n)
+    - marg: escalar o vector (m,); por defecto 0.5
+    - precip_actual, temp_actual: valores actuales (m,); por defecto el
+      promedio de cada fila, como hace `/api/analizar`
+
+    Devuelve {'riesgo': array (m,), 'categoria': [...], 'nombre_categoria': [...]}."""
+    _requiere_numpy()
+    P = _matriz(precipitacion)
+    T = _matriz(temperatura)
+    n = min(P.shape[1], T.shape[1])
+    P, T = P[:, :n], T[:, :n]
+    m = P.shape[0]
+    marg = np.broadcast_to(np.asarray(0.5 if marg is None else marg, dtype=float), (m,))
+    precip_actual = P.mean(axis=1) if precip_actual is None else np.broadcast_to(np.asarray(precip_actual, dtype=float), (m,))
+    temp_actual = T.mean(axis=1) if temp_actual is None else np.broadcast_to(np.asarray(temp_actual, dtype=float), (m,))
+
+    # Tendencia (derivada simple)
+    tendencia = tendencia_matriz(P)
+
+    # Regresión simple sobre la variable objetivo binaria (sequía si p < 20)
+    y = (P < 20).astype(float)
+    beta0, beta1 = regresion_simple_matriz(y)
+    pred_estad = np.clip(beta0 + beta1 * n, 0.0, 1.0)
+
+    # Álgebra lineal: X = [precip, temp, marg]
+    if n < 3:
+        pred_alg = np.where((precip_actual < 20) & (marg > 0.7), 0.9,
+                            np.where(precip_actual < 30, 0.5, 0.1))
+    else:
+        X = np.stack([P, T, np.repeat(marg[:, np.newaxis], n, axis=1)], axis=2)
+        beta = minimos_cuadrados_lote(X, y)
+        punto = np.stack([precip_actual, temp_actual, marg, np.ones(m)], axis=1)
+        pred_alg = np.clip((beta * punto).sum(axis=1), 0.0, 1.0)
+
+    riesgo = np.clip((np.maximum(0.0, -tendencia / 10.0) + pred_estad + pred_alg) / 3.0, 0.0, 1.0)
+    clases = [_clasificar_por_umbral(float(r)) for r in riesgo]
+    return {
+        'riesgo': riesgo,
+        'categoria': [c['categoria'] for c in clases],
+        'nombre_categoria': [c['nombre'] for c in clases]
+    }
+
+
+def riesgo_modelo_sin_historia(precip_actual, marg=None) -> Dict[str, Any]:
+    """Equivalente vectorizado de `calcular_riesgo_modelo` sin historia:
+    tendencia 0, predicción estadística 0.5 y la regla de respaldo del
+    álgebra lineal. Mismo formato de salida que `riesgo_modelo_matriz`."""
+    _requiere_numpy()
+    precip_actual = np.asarray(precip_actual, dtype=float).reshape(-1)
+    m = precip_actual.shape[0]
+    marg = np.broadcast_to(np.asarray(0.5 if marg is None else marg, dtype=float), (m,))
+    pred_alg = np.where((precip_actual < 20) & (marg > 0.7), 0.9,
+                        np.where(precip_actual < 30, 0.5, 0.1))
+    riesgo = np.clip((0.5 + pred_alg) / 3.0, 0.0, 1.0)
+    clases = [_clasificar_por_umbral(float(r)) for r in riesgo]
+    return {
+        'riesgo': riesgo,
+        'categoria': [c['categoria'] for c in clases],
+        'nombre_categoria': [c['nombre'] for c in clases]
+    }
+
+
+def analizar_matriz(precipitacion, temperatura, evapotranspiracion,
+                    marg: Optional[float] = None, con_modelo: bool = True) -> List[Dict[str, Any]]:
+    """Índice y modelo de riesgo para todas las filas en una sola pasada.
+
+    Devuelve una lista (una entrada por fila) con `indice`, `indice_diario`
+    (lista) y `modelo` (mismo formato que `calcular_riesgo_modelo`, o None
+    con `con_modelo=False`, p. ej. si hay coeficientes entrenados)."""
+    _requiere_numpy()
+    promedios, diarios = indice_sequia_matriz(precipitacion, temperatura, evapotranspiracion)
+    modelo = riesgo_modelo_matriz(precipitacion, temperatura, marg=marg) if con_modelo else None
+    return [
+        {
+            'indice': float(promedios[i]),
+            'indice_diario': diarios[i].tolist(),
+            'modelo': {
+                'riesgo': float(modelo['riesgo'][i]),
+                'categoria': modelo['categoria'][i],
+                'nombre_categoria': modelo['nombre_categoria'][i]
+            } if modelo is not None else None
+        }
+        for i in range(len(promedios))
+    ]
@@ -0,0 +1,59 @@
+"""Rejilla regular lat/lon sobre Chihuahua para el mapa de calor de sequía.
+
+La rejilla cubre el rectángulo que contiene al estado, alineado a múltiplos
+del paso (así las celdas de distintas consultas coinciden y cada celda tiene
+una clave estable en el almacén local). Las celdas se ordenan como un
+ráster: fila 0 al norte, columna 0 al oeste.
+
+El archivo de Open-Meteo (ERA5) tiene resolución de 0.25°; ERA5-Land llega a
+0.1°, así que pasos menores no agregan información. No se ofrece 0.1°: sus
+~3,600 celdas costarían unas 24,000 llamadas en frío (más que la cuota
+diaria) y unas 3,600 por día para mantenerla.
+"""
+import math
+import sys
+from array import array
+from typing import List, Sequence, Tuple
+
+LIMITES_CHIHUAHUA = (25.55, 31.80, -109.10, -103.30)  # lat_min, lat_max, lon_min, lon_max
+PASOS = (0.25, 0.5)  # grados; 0.25 ≈ 600 celdas, 0.5 ≈ 160
+
+
+class Rejilla:
+    def __init__(self, paso: float, limites: Tuple[float, float, float, float] = LIMITES_CHIHUAHUA):
+        self.paso = paso
+        lat_min, lat_max, lon_min, lon_max = limites
+        # Bordes alineados a múltiplos del paso
+        self.sur = round(math.floor(lat_min / paso) * paso, 6)
+        self.norte = round(math.ceil(lat_max / paso) * paso, 6)
+        self.oeste = round(math.floor(lon_min / paso) * paso, 6)
+        self.este = round(math.ceil(lon_max / paso) * paso, 6)
+        self.filas = int(round((self.norte - self.sur) / paso))
+        self.columnas = int(round((self.este - self.oeste) / paso))
+
+    def centros(self) -> List[Tuple[float, float]]:
+        """(lat, lon) del centro de cada celda en orden de ráster."""
+        return [
+            (round(self.norte - (i + 0.5) * self.paso, 4), round(self.oeste + (j + 0.5) * self.paso, 4))
+            for i in range(self.filas)
+            for j in range(self.columnas)
+        ]
+
+    def descripcion(self) -> dict:
+        return {
+            "paso": self.paso, "filas": self.filas, "columnas": self.columnas,
+            "norte": self.norte, "sur": self.sur, "oeste": self.oeste, "este": self.este,
+        }
+
+
+def clave_celda(lat: float, lon: float) -> str:
+    """Clave de la celda en el almacén local (junto a las de los municipios)."""
+    return f"rejilla:{lat:.4f},{lon:.4f}"
+
+
+def raster_float32(valores: Sequence[float]) -> bytes:
+    """Valores en orden de ráster como float32 little-endian (NaN = sin dato)."""
+    columna = array('f', valores)
+    if sys.byteorder != 'little':
+        columna.byteswap()
+    return columna.tobytes()
@@ -0,0 +1,73 @@
+"""Respuestas JSON con validación condicional y compresión.
+
+`respuesta_json` (y `respuesta_binaria`) serializa el cuerpo, le asigna un
+ETag calculado a partir del contenido y un Last-Modified ligado a la última
+fecha de los datos, y responde 304 cuando el cliente ya tiene esa versión (If-None-Match /
+If-Modified-Since). Si no, comprime con brotli (si el módulo está instalado)
+o gzip según el encabezado Accept-Encoding.
+"""
+import gzip
+import hashlib
+from datetime import date, datetime, timezone
+from typing import Any, Dict, Optional
+
+from flask import current_app, request
+
+import metricas
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional; sin él sólo se ofrece gzip
+    brotli = None
+
+TAMANO_MINIMO_COMPRESION = 1024  # bytes; por debajo no vale la pena comprimir
+
+
+def _comprimir(respuesta, cuerpo: bytes):
+    if len(cuerpo) < TAMANO_MINIMO_COMPRESION:
+        return
+    ofrecidas = ['br', 'gzip'] if brotli is not None else ['gzip']
+    codificacion = request.accept_encodings.best_match(ofrecidas)
+    if codificacion == 'br':
+        respuesta.set_data(brotli.compress(cuerpo, quality=5))
+    elif codificacion == 'gzip':
+        respuesta.set_data(gzip.compress(cuerpo, compresslevel=6))
+    else:
+        return
+    respuesta.headers['Content-Encoding'] = codificacion
+
+
+def _respuesta_condicional(datos: bytes, mimetype: str, ultima_fecha: Optional[str],
+                           encabezados: Optional[Dict[str, str]] = None):
+    respuesta = current_app.response_class(datos, mimetype=mimetype)
+    respuesta.headers.update(encabezados or {})
+    respuesta.set_etag(hashlib.sha256(datos).hexdigest()[:32], weak=True)
+    if ultima_fecha:
+        dia = date.fromisoformat(ultima_fecha)
+        respuesta.last_modified = datetime(dia.year, dia.month, dia.day, tzinfo=timezone.utc)
+    # El navegador puede guardar la respuesta pero debe revalidarla siempre
+    respuesta.cache_control.no_cache = True
+    respuesta.vary.add('Accept-Encoding')
+    respuesta.vary.add('Accept')
+    respuesta.make_conditional(request)
+    if respuesta.status_code == 200:
+        with metricas.etapa('compresion'):
+            _comprimir(respuesta, datos)
+    return respuesta
+
+
+def respuesta_json(cuerpo: Any, ultima_fecha: Optional[str] = None, estado: int = 200):
+    """Construye la respuesta JSON condicional y comprimida.
+
+    - ultima_fecha: 'YYYY-MM-DD' del último día de los datos (Last-Modified).
+    """
+    with metricas.etapa('serializacion'):
+        datos = current_app.json.dumps(cuerpo).encode('utf-8')
+    if estado != 200:
+        return current_app.response_class(datos, status=estado, mimetype='application/json')
+    return _respuesta_condicional(datos, 'application/json', ultima_fecha)
+
+
+def respuesta_binaria(datos: bytes, encabezados: Dict[str, str], ultima_fecha: Optional[str] = None):
+    """Igual que `respuesta_json` para un cuerpo application/octet-stream."""
+    return _respuesta_condicional(datos, 'application/octet-stream', ultima_fecha, encabezados)
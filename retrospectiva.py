@@ -0,0 +1,433 @@
+"""Prueba retrospectiva (backtest) del índice y del modelo de riesgo.
+
+Reproduce, para cada día de un rango largo y cada municipio, lo que
+`/api/analizar` habría respondido ese día usando sólo los datos disponibles
+hasta entonces (la ventana de los `dias` + 1 días que terminan en él, como
+`obtener_datos_meteo`), clasifica el índice y el riesgo en D0..D4 y los
+compara contra una serie de referencia:
+
+    py retrospectiva.py --desde 2000-01-01 --hasta 2020-12-31 --referencia msm.csv
+    py retrospectiva.py --referencia msm.csv --umbrales-indice 0.4,0.55,0.7,0.85 --json
+
+La referencia es un CSV con columnas `municipio,fecha,categoria`; sólo se
+comparan los días que aparecen en ella (p. ej. las fechas de publicación
+del Monitor de Sequía). Sin referencia se reporta la distribución de
+categorías. `--diario` escribe el índice y el riesgo de cada día para
+probar otros umbrales sin repetir la reproducción.
+
+Reproducir ventana por ventana cuesta O(días × ventana). Aquí cada día nuevo
+actualiza estadísticas de la ventana deslizante en O(1):
+
+- índice: la media de la serie normalizada es la normalización de la media
+  (igual que en `historico.ResumenHistorico`), así que bastan sumas y el
+  mínimo/máximo deslizante de `indice_movil.MinMaxDeslizante`. La
+  normalización divide entre max - min, que en una ventana casi constante
+  amplifica cualquier residuo de redondeo, así que las sumas llevan
+  compensación (Neumaier) y Σ - n·mínimo se resta sin cancelación.
+- regresión simple: Σy y Σxy con x relativo al inicio de la ventana; al
+  avanzar un día todas las x bajan en 1, así que Σxy baja en Σy.
+- mínimos cuadrados: `AcumuladorMinimosCuadrados.agregar`/`quitar`; el
+  acumulador y las sumas se reconstruyen cada `RECONSTRUIR` días para no
+  acumular error de redondeo.
+
+La ventana es de días del calendario: si a la serie le faltan días (Open-Meteo
+no los tiene), la ventana vuelve a empezar después del hueco, como la
+respuesta de ese día no habría tenido la ventana completa. Si hay un modelo
+entrenado (`modelos_riesgo.py`), el riesgo se calcula con sus coeficientes,
+igual que `/api/analizar`.
+
+Los municipios se descargan en hilos y se reproducen en un pool de procesos.
+Todo el rango desde 2000 para todos los municipios cuesta unas 45,000
+llamadas a Open-Meteo, varias veces la cuota diaria: la descarga respeta el
+presupuesto de `limite_open_meteo.py` (espera fichas hasta `--espera-cuota`
+segundos en total), lo ya descargado queda en el almacén local, y los
+municipios que no alcanzaron cuota se reportan como error (código de salida
+1). Volver a correr el mismo comando continúa donde se quedó. Los mensajes
+de la descarga van a stderr, así que `--json` deja en stdout sólo el reporte.
+"""
+import argparse
+import csv
+import json
+import math
+import os
+import sys
+import time
+from bisect import bisect_right
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import redirect_stdout
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from analisis_sequia import (AcumuladorMinimosCuadrados, combinar_riesgo, modelo_algebra_lineal,
+                             riesgo_con_coeficientes)
+from descarga_pausada import CUOTA_AGOTADA, ESPERA_CUOTA, DescargaPausada
+from indice_movil import MinMaxDeslizante
+
+DIAS = 90  # mismo valor por defecto que /api/analizar
+UMBRALES = (0.35, 0.50, 0.65, 0.80)  # _clasificar_por_umbral y analizar_sequia
+CATEGORIAS = ('D0', 'D1', 'D2', 'D3', 'D4')
+RECONSTRUIR = 365  # días entre reconstrucciones de las sumas deslizantes
+_PARTIR = 134217729.0  # 2^27 + 1: parte un float en dos mitades de 26 bits (Veltkamp)
+
+
+class ReproduccionDiaria:
+    """Índice y riesgo de la ventana que termina en cada día agregado.
+
+    Con `coeficientes` (los de `ModelosRiesgo.coeficientes`) el riesgo es el
+    de `riesgo_con_coeficientes`; sin ellos, el de `calcular_riesgo_modelo`."""
+
+    def __init__(self, ventana: int, marg: Optional[float] = None,
+                 coeficientes: Optional[Dict[str, Any]] = None):
+        if ventana < 2:
+            raise ValueError("La ventana debe ser de al menos 2 días")
+        self.ventana = ventana
+        self.marg = 0.5 if marg is None else marg
+        self.coeficientes = coeficientes
+        self.huecos = 0  # veces que la ventana volvió a empezar por días faltantes
+        self._ultimo_dia: Optional[int] = None  # ordinal del último día agregado
+        n = ventana
+        sum_x = n * (n - 1) / 2.0
+        sum_x2 = (n - 1) * n * (2 * n - 1) / 6.0
+        self._sum_x = sum_x
+        self._denom = n * sum_x2 - sum_x ** 2
+        self._vaciar()
+
+    def _vaciar(self):
+        self._dias = deque()  # (p, t, e) de la ventana
+        self._minmax = (MinMaxDeslizante(self.ventana), MinMaxDeslizante(self.ventana),
+                        MinMaxDeslizante(self.ventana))
+        self._desde_reconstruccion = 0
+        self._reiniciar_sumas()
+
+    def _reiniciar_sumas(self):
+        self._sumas = [0.0, 0.0, 0.0]  # p, t, e
+        self._compensacion = [0.0, 0.0, 0.0]  # error de redondeo acumulado de cada suma
+        self._sum_y = 0.0
+        self._sum_xy = 0.0
+        self._acumulador = AcumuladorMinimosCuadrados(3)
+        for x, (p, t, e) in enumerate(self._dias):
+            self._sumar(x, p, t, e)
+
+    def _sumar(self, x: int, p: float, t: float, e: float):
+        y = 1.0 if p < 20 else 0.0
+        self._acumular(p, t, e)
+        self._sum_y += y
+        self._sum_xy += x * y
+        self._acumulador.agregar([p, t, self.marg], y)
+
+    def _acumular(self, *valores: float):
+        for i, v in enumerate(valores):
+            suma = self._sumas[i]
+            nueva = suma + v
+            if abs(suma) >= abs(v):
+                self._compensacion[i] += (suma - nueva) + v
+            else:
+                self._compensacion[i] += (v - nueva) + suma
+            self._sumas[i] = nueva
+
+    def _media(self, i: int) -> float:
+        return (self._sumas[i] + self._compensacion[i]) / self.ventana
+
+    def _media_sobre(self, i: int, minimo: float) -> float:
+        """Media de la ventana menos `minimo`. n·minimo se escribe como dos
+        productos exactos y todo se suma con `math.fsum`."""
+        n = self.ventana
+        c = _PARTIR * minimo
+        alto = c - (c - minimo)
+        return math.fsum((self._sumas[i], self._compensacion[i], -n * alto, -n * (minimo - alto))) / n
+
+    def agregar_dia(self, p: float, t: float, e: float,
+                    fecha: Optional[str] = None) -> Optional[Tuple[float, float]]:
+        """(índice, riesgo) de la ventana que termina hoy; None mientras no se llena.
+
+        Con `fecha` (YYYY-MM-DD), un día que no sigue al anterior vacía la
+        ventana: sólo cuenta una ventana de días consecutivos."""
+        if fecha is not None:
+            dia = date.fromisoformat(fecha).toordinal()
+            if self._ultimo_dia is not None and dia != self._ultimo_dia + 1:
+                self._vaciar()
+                self.huecos += 1
+            self._ultimo_dia = dia
+        for mm, v in zip(self._minmax, (p, t, e)):
+            mm.agregar(v)
+        if len(self._dias) == self.ventana:
+            viejo_p, viejo_t, viejo_e = self._dias.popleft()
+            viejo_y = 1.0 if viejo_p < 20 else 0.0
+            self._acumular(-viejo_p, -viejo_t, -viejo_e)
+            self._sum_y -= viejo_y
+            self._sum_xy -= self._sum_y  # el que sale tenía x = 0; los demás bajan una posición
+            self._acumulador.quitar([viejo_p, viejo_t, self.marg], viejo_y)
+        self._dias.append((p, t, e))
+        self._sumar(len(self._dias) - 1, p, t, e)
+        self._desde_reconstruccion += 1
+        if self._desde_reconstruccion >= RECONSTRUIR:
+            self._reiniciar_sumas()
+            self._desde_reconstruccion = 0
+        if len(self._dias) < self.ventana:
+            return None
+        return self._indice(), self._riesgo()
+
+    def _indice(self) -> float:
+        # = promedio de calcular_indice_sequia sobre la ventana
+        partes = []
+        for i, mm in enumerate(self._minmax):
+            minimo, maximo = mm.minimo(), mm.maximo()
+            partes.append(self._media_sobre(i, minimo) / (maximo - minimo + 1e-10))
+        return 0.6 * (1 - partes[0]) + 0.2 * partes[1] + 0.2 * partes[2]
+
+    def _riesgo(self) -> float:
+        n = self.ventana
+        media_p, media_t = self._media(0), self._media(1)
+        if self.coeficientes is not None:
+            # = _modelo_entrenado de api.py
+            return riesgo_con_coeficientes(self.coeficientes, media_p, media_t,
+                                           historia={'precipitacion': [self._dias[-2][0], self._dias[-1][0]]})['riesgo']
+        # = calcular_riesgo_modelo(media_p, media_t, marg, historia=ventana), como _modelo_municipio
+        tendencia = self._dias[-1][0] - self._dias[-2][0]
+        if self._denom == 0:
+            beta0, beta1 = 0.0, 0.0
+        else:
+            beta1 = (n * self._sum_xy - self._sum_x * self._sum_y) / self._denom
+            beta0 = (self._sum_y - beta1 * self._sum_x) / n
+        pred_estad = max(0.0, min(1.0, beta0 + beta1 * n))
+        if n < 3:
+            pred_alg = modelo_algebra_lineal(media_p, media_t, self.marg)
+        else:
+            pred_alg = modelo_algebra_lineal(media_p, media_t, self.marg, acumulador=self._acumulador)
+        return combinar_riesgo(tendencia, pred_estad, pred_alg)['riesgo']
+
+
+def reproducir(serie: Dict[str, List], ventana: int, marg: Optional[float] = None,
+               desde: Optional[str] = None, coeficientes: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """{'fechas', 'indice', 'riesgo', 'huecos'} de cada día con la ventana
+    completa de días consecutivos (y a partir de `desde`, si se indica; los
+    días previos sólo llenan la ventana)."""
+    reproduccion = ReproduccionDiaria(ventana, marg, coeficientes)
+    resultado = {"fechas": [], "indice": [], "riesgo": []}
+    for f, p, t, e in zip(serie["fechas"], serie["precipitacion"],
+                          serie["temperatura"], serie["evapotranspiracion"]):
+        valores = reproduccion.agregar_dia(p, t, e, f)
+        if valores is None or (desde is not None and f < desde):
+            continue
+        resultado["fechas"].append(f)
+        resultado["indice"].append(valores[0])
+        resultado["riesgo"].append(valores[1])
+    resultado["huecos"] = reproduccion.huecos
+    return resultado
+
+
+def _reproducir_medido(serie: Dict[str, List], ventana: int, marg: Optional[float],
+                       desde: Optional[str], coeficientes: Optional[Dict[str, Any]]) -> Tuple[Dict[str, Any], float]:
+    t0 = time.perf_counter()
+    resultado = reproducir(serie, ventana, marg, desde, coeficientes)
+    return resultado, time.perf_counter() - t0
+
+
+def clasificar(valor: float, umbrales: Sequence[float] = UMBRALES) -> str:
+    """D0..D4 con umbrales crecientes (valor < umbrales[0] → D0)."""
+    return CATEGORIAS[bisect_right(umbrales, valor)]
+
+
+def parsear_umbrales(texto: str) -> Tuple[float, ...]:
+    try:
+        umbrales = tuple(float(x) for x in texto.split(','))
+    except ValueError:
+        raise ValueError(f"Umbrales inválidos: '{texto}'")
+    if len(umbrales) != 4 or list(umbrales) != sorted(umbrales):
+        raise ValueError("Se esperan 4 umbrales crecientes (D1, D2, D3, D4)")
+    return umbrales
+
+
+def leer_referencia(ruta: str) -> Dict[Tuple[str, str], str]:
+    """{(municipio, fecha): categoria} desde un CSV municipio,fecha,categoria."""
+    referencia = {}
+    with open(ruta, 'r', encoding='utf-8-sig', newline='') as f:
+        for fila in csv.DictReader(f):
+            categoria = (fila.get('categoria') or '').strip().upper()
+            if categoria:
+                referencia[(fila['municipio'].strip(), fila['fecha'].strip())] = categoria
+    return referencia
+
+
+class MatrizConfusion:
+    def __init__(self):
+        self.conteos: Counter = Counter()  # (referencia, predicha) -> días
+
+    def agregar(self, referencia: str, predicha: str):
+        self.conteos[(referencia, predicha)] += 1
+
+    def resumen(self) -> Dict[str, Any]:
+        total = sum(self.conteos.values())
+        etiquetas = sorted({c for par in self.conteos for c in par} | set(CATEGORIAS))
+        aciertos = sum(n for (r, p), n in self.conteos.items() if r == p)
+        return {
+            "dias": total,
+            "exactitud": round(aciertos / total, 4) if total else None,
+            "etiquetas": etiquetas,
+            # filas = referencia, columnas = predicha
+            "matriz": [[self.conteos.get((r, p), 0) for p in etiquetas] for r in etiquetas],
+        }
+
+
+def _texto_matriz(nombre: str, resumen: Dict[str, Any]) -> str:
+    etiquetas = resumen["etiquetas"]
+    lineas = [f"{nombre}: exactitud {resumen['exactitud']} en {resumen['dias']} días (filas = referencia)",
+              "      " + "".join(f"{e:>9}" for e in etiquetas)]
+    for e, fila in zip(etiquetas, resumen["matriz"]):
+        lineas.append(f"{e:>6}" + "".join(f"{n:>9}" for n in fila))
+    return "\n".join(lineas)
+
+
+def main_cli(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Prueba retrospectiva del índice y del modelo de riesgo')
+    parser.add_argument('--desde', default='2000-01-01', help='Primer día evaluado (YYYY-MM-DD)')
+    parser.add_argument('--hasta', default=(date.today() - timedelta(days=1)).isoformat(),
+                        help='Último día evaluado (YYYY-MM-DD)')
+    parser.add_argument('--municipio', action='append', help='Municipio a evaluar (se puede repetir); por defecto todos')
+    parser.add_argument('--dias', type=int, default=DIAS, help='Días de la ventana, como en /api/analizar')
+    parser.add_argument('--marg', type=float, default=None, help='Índice de marginación (0-1)')
+    parser.add_argument('--referencia', help='CSV municipio,fecha,categoria con la serie de referencia')
+    parser.add_argument('--umbrales-indice', default=None, help='Umbrales D1..D4 del índice (p. ej. 0.35,0.5,0.65,0.8)')
+    parser.add_argument('--umbrales-modelo', default=None, help='Umbrales D1..D4 del riesgo del modelo')
+    parser.add_argument('--diario', help='CSV con el índice y el riesgo de cada municipio y día')
+    parser.add_argument('--procesos', type=int, default=None, help='Procesos de cálculo (por defecto uno por CPU)')
+    parser.add_argument('--concurrencia', type=int, default=4, help='Municipios descargándose a la vez')
+    parser.add_argument('--espera-cuota', type=float, default=ESPERA_CUOTA,
+                        help='Segundos máximos esperando cuota de Open-Meteo; lo que falte se descarga al volver a correr')
+    parser.add_argument('--json', action='store_true', help='Imprimir el reporte en JSON')
+    args = parser.parse_args(argv)
+
+    try:
+        desde, hasta = date.fromisoformat(args.desde), date.fromisoformat(args.hasta)
+        umbrales_indice = parsear_umbrales(args.umbrales_indice) if args.umbrales_indice else UMBRALES
+        umbrales_modelo = parsear_umbrales(args.umbrales_modelo) if args.umbrales_modelo else UMBRALES
+        if desde > hasta or args.dias < 1:
+            raise ValueError("Se requiere desde <= hasta y --dias >= 1")
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    referencia = leer_referencia(args.referencia) if args.referencia else {}
+
+    # Los mensajes de api.py (descargas, migraciones) van a stderr para no
+    # mezclarse con el reporte
+    with redirect_stdout(sys.stderr):
+        import api  # importación tardía: trae Flask y el almacén de series
+    import limite_open_meteo
+
+    municipios = args.municipio or list(api.MUNICIPIOS)
+    desconocidos = [m for m in municipios if m not in api.MUNICIPIOS]
+    if desconocidos:
+        print(f"Municipios no encontrados: {', '.join(desconocidos)}", file=sys.stderr)
+        return 1
+
+    ventana = args.dias + 1  # obtener_datos_meteo(dias) incluye ambos extremos
+    inicio_datos = desde - timedelta(days=ventana - 1)
+    descarga = DescargaPausada(inicio_datos, hasta, args.espera_cuota)
+
+    procesos = args.procesos or os.cpu_count() or 1
+    inicio = time.perf_counter()
+    tiempo_descarga = tiempo_calculo = 0.0
+    resultados: Dict[str, Dict[str, Any]] = {}
+    errores: Dict[str, str] = {}
+    # Con un modelo entrenado se reproduce el riesgo que daría /api/analizar
+    # (que con `marg` ajusta en línea, ver api._coeficientes_consulta)
+    coeficientes = {m: api._coeficientes_consulta(m, args.marg) for m in municipios}
+
+    def _descargar(municipio):
+        t0 = time.perf_counter()
+        serie = descarga.serie(municipio)
+        return serie, time.perf_counter() - t0
+
+    descarga.avisar(municipios)
+
+    with redirect_stdout(sys.stderr), ThreadPoolExecutor(max_workers=max(1, args.concurrencia)) as descargas, \
+            ProcessPoolExecutor(max_workers=procesos) as calculo:
+        descargando = {descargas.submit(_descargar, m): m for m in municipios}
+        calculando = {}
+        for futuro in as_completed(descargando):
+            municipio = descargando[futuro]
+            try:
+                serie, segundos = futuro.result()
+            except limite_open_meteo.PresupuestoAgotado:
+                errores[municipio] = CUOTA_AGOTADA
+                continue
+            except Exception as e:
+                errores[municipio] = str(e)
+                continue
+            tiempo_descarga += segundos
+            calculando[calculo.submit(_reproducir_medido, serie, ventana, args.marg, desde.isoformat(),
+                                      coeficientes[municipio])] = municipio
+        for futuro in as_completed(calculando):
+            resultados[calculando[futuro]], segundos = futuro.result()
+            tiempo_calculo += segundos
+
+    matriz_indice, matriz_modelo = MatrizConfusion(), MatrizConfusion()
+    distribucion = {"indice": Counter(), "modelo": Counter()}
+    dias = 0
+    archivo_diario = open(args.diario, 'w', encoding='utf-8', newline='') if args.diario else None
+    try:
+        escritor = None
+        if archivo_diario is not None:
+            escritor = csv.writer(archivo_diario)
+            escritor.writerow(['municipio', 'fecha', 'indice', 'riesgo', 'categoria', 'categoria_modelo', 'referencia'])
+        for municipio in municipios:
+            resultado = resultados.get(municipio)
+            if resultado is None:
+                continue
+            for f, indice, riesgo in zip(resultado["fechas"], resultado["indice"], resultado["riesgo"]):
+                cat_indice = clasificar(indice, umbrales_indice)
+                cat_modelo = clasificar(riesgo, umbrales_modelo)
+                distribucion["indice"][cat_indice] += 1
+                distribucion["modelo"][cat_modelo] += 1
+                dias += 1
+                ref = referencia.get((municipio, f))
+                if ref is not None:
+                    matriz_indice.agregar(ref, cat_indice)
+                    matriz_modelo.agregar(ref, cat_modelo)
+                if escritor is not None:
+                    escritor.writerow([municipio, f, round(indice, 6), round(riesgo, 6), cat_indice, cat_modelo, ref or ''])
+    finally:
+        if archivo_diario is not None:
+            archivo_diario.close()
+
+    total = time.perf_counter() - inicio
+    reporte = {
+        "desde": desde.isoformat(),
+        "hasta": hasta.isoformat(),
+        "ventana_dias": ventana,
+        "municipios": len(resultados),
+        "dias_evaluados": dias,
+        "version_modelo": api.MODELOS.version if any(c is not None for c in coeficientes.values()) else None,
+        # veces que la ventana volvió a empezar por días faltantes en la serie
+        "huecos": {m: r["huecos"] for m, r in resultados.items() if r["huecos"]},
+        "umbrales": {"indice": list(umbrales_indice), "modelo": list(umbrales_modelo)},
+        "distribucion": {k: {c: v.get(c, 0) for c in CATEGORIAS} for k, v in distribucion.items()},
+        "confusion": {"indice": matriz_indice.resumen(), "modelo": matriz_modelo.resumen()} if referencia else None,
+        "tiempos_s": {
+            "total": round(total, 3),
+            # sumas por municipio (en paralelo, así que pueden superar al total)
+            "descarga": round(tiempo_descarga, 3),
+            "calculo": round(tiempo_calculo, 3),
+            "dias_por_segundo": round(dias / total) if total > 0 else None,
+        },
+        "errores": errores,
+    }
+    if args.json:
+        print(json.dumps(reporte, ensure_ascii=False, indent=2))
+    else:
+        print(f"{reporte['municipios']} municipios, {dias} días ({reporte['desde']} a {reporte['hasta']}, ventana de {ventana} días)")
+        for nombre, conteo in reporte["distribucion"].items():
+            print(f"  {nombre}: " + ", ".join(f"{c}={n}" for c, n in conteo.items()))
+        if referencia:
+            print(_texto_matriz("Índice", reporte["confusion"]["indice"]))
+            print(_texto_matriz("Modelo", reporte["confusion"]["modelo"]))
+        tiempos = reporte["tiempos_s"]
+        print(f"Tiempo: {tiempos['total']} s (cálculo {tiempos['calculo']} s, {tiempos['dias_por_segundo']} días/s)")
+        for municipio, error in errores.items():
+            print(f"  {municipio}: {error}", file=sys.stderr)
+    return 1 if errores else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main_cli())
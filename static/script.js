@@ -4,6 +4,11 @@
  */
 
 const API_URL = 'http://127.0.0.1:5000/api';
+// Puntos máximos por serie para las gráficas; el servidor submuestrea (LTTB) las series más largas
+const PUNTOS_GRAFICA = 500;
+// Días analizados por defecto (la ventana de /api/analizar sin `dias`)
+const DIAS_ANALISIS = 90;
+const DIA_MS = 24 * 60 * 60 * 1000;
 
 const RECOMENDACIONES = {
     "D0": {
@@ -31,6 +36,7 @@ const RECOMENDACIONES = {
 // Elementos del DOM
 const form = document.getElementById('analyzeForm');
 const municipioSelect = document.getElementById('municipio');
+const periodoSelect = document.getElementById('periodo');
 const loading = document.getElementById('loading');
 const error = document.getElementById('error');
 const result = document.getElementById('result');
@@ -65,14 +71,16 @@ async function handleFormSubmit(e) {
         return;
     }
 
-    await analyzeSequia(municipio);
+    const dias = periodoSelect ? Number(periodoSelect.value) : DIAS_ANALISIS;
+    await analyzeSequia(municipio, dias);
 }
 
 /**
  * Realiza el análisis de sequía consultando la API
  * @param {string} municipio - Nombre del municipio a analizar
+ * @param {number} dias - Días analizados hasta ayer
  */
-async function analyzeSequia(municipio) {
+async function analyzeSequia(municipio, dias = DIAS_ANALISIS) {
     // Limpiar errores anteriores
     error.classList.remove('show');
     result.classList.remove('show');
@@ -83,7 +91,7 @@ async function analyzeSequia(municipio) {
     try {
         console.log(`Analizando: ${municipio}`);
         
-        const response = await fetch(`${API_URL}/analizar?municipio=${municipio}`);
+        const response = await fetch(`${API_URL}/analizar?municipio=${encodeURIComponent(municipio)}&dias=${dias}&puntos=${PUNTOS_GRAFICA}`);
         
         if (!response.ok) {
             throw new Error(`Error ${response.status}: ${response.statusText}`);
@@ -93,7 +101,7 @@ async function analyzeSequia(municipio) {
 
         if (data.success) {
             console.log('Análisis completado');
-            displayResult(municipio, data);
+            displayResult(municipio, data, dias);
         } else {
             showError(data.error || 'Error desconocido');
         }
@@ -109,8 +117,9 @@ async function analyzeSequia(municipio) {
  * Muestra los resultados del análisis en la interfaz
  * @param {string} municipio - Nombre del municipio
  * @param {object} data - Datos del análisis
+ * @param {number} dias - Días analizados
  */
-function displayResult(municipio, data) {
+function displayResult(municipio, data, dias = DIAS_ANALISIS) {
     document.getElementById('municipioName').textContent = municipio;
     document.getElementById('indiceValue').textContent = `${data.indice_sequia}%`;
     
@@ -184,7 +193,13 @@ function displayResult(municipio, data) {
     const linkDatosDiarios = document.getElementById('linkDatosDiarios');
     if (linkDatosDiarios) {
         // Usamos encodeURIComponent para manejar nombres con espacios o caracteres especiales
-        linkDatosDiarios.href = `static/diferencial/diferencial.html?municipio=${encodeURIComponent(municipio)}`;
+        let href = `static/diferencial/diferencial.html?municipio=${encodeURIComponent(municipio)}`;
+        // Para periodos largos, la tabla pide el mismo rango (en flujo, año por año)
+        const fechas = (data.series && data.series.fechas) || [];
+        if (dias !== DIAS_ANALISIS && fechas.length > 0) {
+            href += `&desde=${fechas[0]}&hasta=${fechas[fechas.length - 1]}`;
+        }
+        linkDatosDiarios.href = href;
         linkDatosDiarios.style.display = 'block';
     }
     
@@ -248,7 +263,7 @@ function renderLineChart(labels, valores) {
     const currentLang = localStorage.getItem('preferredLanguage') || 'es';
     const chartTitle = translations && translations[currentLang] && translations[currentLang].lineChartTitle 
         ? translations[currentLang].lineChartTitle 
-        : 'Precipitación Diaria (Últimos 90 Días)';
+        : 'Precipitación Diaria';
     
     window.lineChart = new Chart(ctx, {
         type: 'line',
@@ -429,9 +444,12 @@ function renderRegressionChart(fechas, lluvia) {
         ? translations[currentLang].regressionChart 
         : 'Regresión Lineal y Predicción de Precipitación';
     
-    // Preparar datos: usar índices numéricos como x
+    // Preparar datos: días transcurridos como x (las series largas llegan
+    // submuestreadas, así que el índice no equivale al día)
     const n = fechas.length;
-    const x = Array.from({length: n}, (_, i) => i);
+    const inicio = new Date(fechas[0]).getTime();
+    const x = fechas.map(f => Math.round((new Date(f).getTime() - inicio) / DIA_MS));
+    const ultimoX = x[n - 1];
     
     // Calcular regresión lineal
     const {slope, intercept, r2} = calcularRegresionLineal(x, lluvia);
@@ -441,14 +459,14 @@ function renderRegressionChart(fechas, lluvia) {
     
     // Predicción futura (próximos 30 días)
     const diasFuturos = 30;
-    const xFuturo = Array.from({length: diasFuturos}, (_, i) => n + i);
+    const xFuturo = Array.from({length: diasFuturos}, (_, i) => ultimoX + 1 + i);
     const prediccionFutura = xFuturo.map(xi => Math.max(0, slope * xi + intercept));
     
     // Fechas futuras (aproximadas)
     const ultimaFecha = new Date(fechas[fechas.length - 1]);
     const fechasFuturas = xFuturo.map(i => {
         const fecha = new Date(ultimaFecha);
-        fecha.setDate(fecha.getDate() + i - n + 1);
+        fecha.setDate(fecha.getDate() + i - ultimoX);
         return fecha.toISOString().split('T')[0];
     });
     
@@ -587,17 +605,26 @@ function dibujarModeloMatematico(apiData) {
 
     // --- MEJORA: Dibujar la curva del Riesgo Real ---
     if (apiData.series && apiData.series.riesgo_diario && apiData.series.riesgo_diario.length > 0) {
-        const riesgoDiario = apiData.series.riesgo_diario;
-        
         // --- CORRECCIÓN: Lógica para dibujar la curva de los últimos 90 días ---
         const mesesACubrir = 3; // 90 días son aprox. 3 meses
-        
+
+        // Con periodos largos la serie trae más días (submuestreados): se
+        // ubica cada punto por su fecha y sólo se dibujan los últimos 90 días
+        const fechas = apiData.series.fechas || [];
+        const ultima = new Date(fechas[fechas.length - 1]).getTime();
+        const puntosCurva = [];
+        apiData.series.riesgo_diario.forEach((riesgo, i) => {
+            const diasAtras = (ultima - new Date(fechas[i]).getTime()) / DIA_MS;
+            if (diasAtras < DIAS_ANALISIS) {
+                puntosCurva.push({ t: mesActual - (diasAtras / DIAS_ANALISIS) * mesesACubrir, riesgo });
+            }
+        });
+
         // 1. Dibujar el área sombreada
         ctx.beginPath();
-        const firstPoint = { t: (mesActual - mesesACubrir), x: tToX(mesActual - mesesACubrir), y: rToY(riesgoDiario[0]/100) };
+        const firstPoint = { t: puntosCurva[0].t, x: tToX(puntosCurva[0].t), y: rToY(puntosCurva[0].riesgo/100) };
         ctx.moveTo(firstPoint.x, firstPoint.y);
-        riesgoDiario.forEach((riesgo, i) => {
-            const t = (mesActual - mesesACubrir) + (i / riesgoDiario.length) * mesesACubrir;
+        puntosCurva.forEach(({ t, riesgo }) => {
             const xPos = tToX(t);
             const yPos = rToY(riesgo / 100); // Convertir de % a 0-1
             ctx.lineTo(xPos, yPos);
@@ -617,8 +644,7 @@ function dibujarModeloMatematico(apiData) {
         ctx.strokeStyle = 'rgba(220, 53, 69, 1)'; // Rojo más sólido
         ctx.lineWidth = 2;
         ctx.beginPath();
-        riesgoDiario.forEach((riesgo, i) => {
-            const t = (mesActual - mesesACubrir) + (i / riesgoDiario.length) * mesesACubrir;
+        puntosCurva.forEach(({ t, riesgo }, i) => {
             const xPos = tToX(t);
             const yPos = rToY(riesgo / 100);
             if (i === 0) ctx.moveTo(xPos, yPos); else ctx.lineTo(xPos, yPos);
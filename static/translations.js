@@ -12,6 +12,11 @@ const translations = {
         // Form
         selectMunicipality: "Selecciona un municipio:",
         chooseMunicipality: "-- Elige un municipio --",
+        selectPeriod: "Periodo:",
+        period90: "Últimos 90 días",
+        period365: "Último año",
+        period1825: "Últimos 5 años",
+        period3650: "Últimos 10 años",
         analyzeButton: "Analizar Sequía",
         loadingMessage: "Consultando datos meteorológicos...",
         
@@ -21,7 +26,7 @@ const translations = {
         category: "Categoría:",
         
         // Climate Data
-        climateData: "Datos Climáticos (Promedio últimos 90 días)",
+        climateData: "Datos Climáticos (Promedio del periodo)",
         precipitation: "Precipitación",
         temperature: "Temperatura",
         evapotranspiration: "Evapotranspiración",
@@ -33,7 +38,7 @@ const translations = {
         
         // Charts
         charts: "Gráficas",
-        lineChartTitle: "Precipitación Diaria (Últimos 90 Días)",
+        lineChartTitle: "Precipitación Diaria",
         scatterChartTitle: "Relación Precipitación vs Temperatura",
         barChartTitle: "Precipitación Mensual Acumulada",
         regressionChart: "Regresión Lineal y Predicción",
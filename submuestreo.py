@@ -0,0 +1,99 @@
+"""Submuestreo de series diarias para las gráficas (LTTB).
+
+Una gráfica de unos cientos de píxeles de ancho no puede mostrar más puntos
+que píxeles; enviar años de días sólo agranda la respuesta y el tiempo de
+dibujo. LTTB (Largest-Triangle-Three-Buckets, Steinarsson 2013) parte la
+serie en `puntos - 2` cubetas y de cada una conserva el punto que forma el
+triángulo de mayor área con el punto elegido en la cubeta anterior y el
+promedio de la siguiente: a diferencia de tomar uno de cada k días, conserva
+los picos (p. ej. un día de lluvia fuerte). El primero y el último se
+conservan siempre.
+
+`submuestrear_series` aplica LTTB a cada columna y se queda con la unión de
+los días elegidos, así todas las columnas siguen compartiendo las mismas
+fechas.
+"""
+from typing import Dict, List, Sequence
+
+METODO = 'lttb'
+
+
+def lttb_indices(valores: Sequence[float], puntos: int) -> List[int]:
+    """Posiciones (crecientes) que LTTB conserva de `valores`; x = posición."""
+    n = len(valores)
+    if puntos >= n or n <= 2:
+        return list(range(n))
+    if puntos < 3:
+        return [0, n - 1][:max(puntos, 0)]
+    elegidos = [0]
+    cubeta = (n - 2) / (puntos - 2)
+    a = 0
+    for i in range(puntos - 2):
+        # Promedio de la cubeta siguiente (el último punto para la última cubeta)
+        inicio_sig = int((i + 1) * cubeta) + 1
+        fin_sig = min(int((i + 2) * cubeta) + 1, n)
+        if inicio_sig >= fin_sig:
+            inicio_sig, fin_sig = n - 1, n
+        cuenta = fin_sig - inicio_sig
+        x_prom = (inicio_sig + fin_sig - 1) / 2.0
+        y_prom = sum(valores[inicio_sig:fin_sig]) / cuenta
+
+        x_a, y_a = a, valores[a]
+        mejor, mejor_area = -1, -1.0
+        for j in range(int(i * cubeta) + 1, int((i + 1) * cubeta) + 1):
+            # Doble del área del triángulo (a, j, promedio); el factor no cambia el máximo
+            area = abs((x_a - x_prom) * (valores[j] - y_a) - (x_a - j) * (y_prom - y_a))
+            if area > mejor_area:
+                mejor, mejor_area = j, area
+        elegidos.append(mejor)
+        a = mejor
+    elegidos.append(n - 1)
+    return elegidos
+
+
+def submuestrear_series(series: Dict[str, object], puntos: int) -> Dict[str, object]:
+    """Bloque `series` de /api/analizar (o las columnas de
+    /api/analizar_detalle) con a lo más ~`puntos` días.
+
+    Columnas anidadas (como `indice_movil`) se submuestrean igual. Si la
+    serie ya es corta se devuelve sin cambios."""
+    fechas = series.get("fechas") or []
+    if len(fechas) <= puntos:
+        return series
+    columnas = []
+    for nombre, valores in series.items():
+        if nombre == 'fechas':
+            continue
+        if isinstance(valores, dict):
+            columnas.extend(valores.values())
+        else:
+            columnas.append(valores)
+
+    def _union(presupuesto):
+        elegidos = set()
+        for valores in columnas:
+            elegidos.update(lttb_indices(valores, presupuesto))
+        return elegidos
+
+    # Las columnas suelen coincidir en varios días (picos de lluvia y de
+    # riesgo), así que el presupuesto por columna se busca de modo que la
+    # unión quede lo más cerca posible de `puntos` sin pasarse.
+    bajo = max(3, puntos // max(len(columnas), 1))
+    alto = puntos
+    mejor = _union(bajo)
+    while bajo < alto:
+        medio = (bajo + alto + 1) // 2
+        elegidos = _union(medio)
+        if len(elegidos) <= puntos:
+            bajo, mejor = medio, elegidos
+        else:
+            alto = medio - 1
+    posiciones = sorted(mejor)
+
+    def _tomar(valores):
+        return [valores[i] for i in posiciones]
+
+    return {
+        nombre: ({k: _tomar(v) for k, v in valores.items()} if isinstance(valores, dict) else _tomar(valores))
+        for nombre, valores in series.items()
+    }
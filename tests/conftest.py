@@ -0,0 +1,51 @@
+"""Configuración común de las pruebas.
+
+La API lee el almacén local y las URL de Open-Meteo al importarse, así que
+antes de cualquier importación se apunta el almacén a un archivo temporal
+(nunca al `cache_meteo.sqlite3` del repositorio) y se desactiva el
+programador. Las pruebas que tocan Open-Meteo usan el simulador de
+`benchmarks/stub_open_meteo.py`, sin red.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.join(RAIZ, 'benchmarks'))
+
+os.environ['SEQUIA_CACHE_DB'] = os.path.join(tempfile.mkdtemp(prefix='sequia-pruebas-'), 'cache.sqlite3')
+os.environ.pop('SEQUIA_PROGRAMADOR', None)
+os.environ.pop('SEQUIA_INSTANTANEA_COMPARTIDA', None)
+
+
+@pytest.fixture(scope='session')
+def simulador():
+    """URL base (http://127.0.0.1:puerto/v1) del simulador de Open-Meteo."""
+    import stub_open_meteo
+    servidor, url_archivo = stub_open_meteo.iniciar()
+    yield url_archivo.rsplit('/', 1)[0]
+    servidor.shutdown()
+
+
+@pytest.fixture
+def almacen(tmp_path, monkeypatch):
+    """Almacén local vacío para una prueba."""
+    import cache_meteo
+    monkeypatch.setattr(cache_meteo, 'RUTA_CACHE', str(tmp_path / 'cache.sqlite3'))
+    return cache_meteo
+
+
+@pytest.fixture(autouse=True)
+def presupuesto(monkeypatch):
+    """Cuota de Open-Meteo llena para cada prueba: las descargas al simulador
+    también gastan fichas, y sin esto una prueba que descarga años dejaría a
+    las siguientes esperando a que se rellene la cubeta."""
+    import api
+    import limite_open_meteo
+    original = api.PRESUPUESTO
+    monkeypatch.setattr(api, 'PRESUPUESTO', limite_open_meteo.CuboFichas(
+        original.capacidad, original.por_segundo, original.espera_maxima))
+    return api.PRESUPUESTO
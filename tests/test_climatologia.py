@@ -0,0 +1,109 @@
+"""SPI/SPEI: ajuste de la climatología y evaluación en /api/analizar."""
+from datetime import date, timedelta
+
+import pytest
+
+import api
+import climatologia
+import limite_open_meteo
+import stub_open_meteo
+from climatologia import ESCALAS, Climatologia, MuestrasClimatologicas
+
+DIAS_SIN_DATO = 5  # como el archivo real, los últimos días llegan nulos
+
+
+@pytest.fixture(scope='module')
+def archivo_sin_consolidar():
+    servidor, url_archivo = stub_open_meteo.iniciar(dias_sin_dato=DIAS_SIN_DATO)
+    yield url_archivo
+    servidor.shutdown()
+
+
+@pytest.fixture
+def clima(archivo_sin_consolidar, almacen, tmp_path, monkeypatch):
+    """Climatología de Chihuahua ajustada con 2015-2020 del simulador."""
+    monkeypatch.setattr(api, 'URL_ARCHIVO', archivo_sin_consolidar)
+    desde, hasta = date(2015, 1, 1), date(2020, 12, 31)
+    muestras = MuestrasClimatologicas()
+    muestras.agregar_bloque(api._serie_rango('Chihuahua', desde, hasta))
+    clima = Climatologia(str(tmp_path / 'climatologia.json'))
+    clima.guardar('Chihuahua', muestras.ajustar(), desde, hasta)
+    monkeypatch.setattr(api, 'CLIMATOLOGIA', clima)
+    return clima
+
+
+def _ultimo_consolidado():
+    return date.today() - timedelta(days=DIAS_SIN_DATO + 1)
+
+
+def test_spi_90_en_analizar(clima):
+    r = api.app.test_client().get('/api/analizar?municipio=Chihuahua&marg=0.5')
+    assert r.status_code == 200
+    cuerpo = r.get_json()
+    # La serie de la gráfica termina en el último día consolidado y tiene menos de 90 días
+    assert cuerpo["series"]["fechas"][-1] == _ultimo_consolidado().isoformat()
+    assert len(cuerpo["series"]["fechas"]) < max(ESCALAS)
+
+    # (El SPEI puede quedar sin ajuste con las pocas grabaciones del simulador,
+    # que repiten un mismo año; el SPI siempre se ajusta)
+    indices = cuerpo["indices_estandarizados"]
+    assert indices["fecha"] == _ultimo_consolidado().isoformat()
+    for e in ESCALAS:
+        assert indices[f"spi_{e}"] is not None
+
+    # Es la evaluación de los 90 días consecutivos que terminan en esa fecha
+    fin = _ultimo_consolidado()
+    serie = api._serie_rango('Chihuahua', fin - timedelta(days=max(ESCALAS) - 1), fin)
+    assert len(serie["fechas"]) == max(ESCALAS)
+    assert indices == clima.evaluar('Chihuahua', serie["fechas"], serie["precipitacion"],
+                                    serie["evapotranspiracion"])
+
+
+def test_spi_en_instantaneas(clima):
+    cuerpo = api._calcular_instantaneas(['Chihuahua'])['Chihuahua']
+    assert cuerpo["indices_estandarizados"]["spi_90"] is not None
+
+
+def test_hueco_anula_solo_la_escala_que_lo_cruza(clima):
+    fin = _ultimo_consolidado()
+    serie = api._serie_rango('Chihuahua', fin - timedelta(days=119), fin)
+    hueco = len(serie["fechas"]) - 60  # dentro de los últimos 90 días, fuera de los últimos 30
+    fechas, p, e = (serie[c][:hueco] + serie[c][hueco + 1:]
+                    for c in ("fechas", "precipitacion", "evapotranspiracion"))
+    indices = clima.evaluar('Chihuahua', fechas, p, e)
+    assert indices["spi_30"] is not None
+    assert indices["spi_90"] is None and indices["spei_90"] is None
+
+
+def test_muestras_no_cruzan_huecos():
+    inicio = date(2010, 1, 1)
+    muestras = MuestrasClimatologicas(escalas=(30,))
+    for i in range(100):
+        if i != 40:  # un día faltante
+            muestras.agregar_dia((inicio + timedelta(days=i)).isoformat(), 1.0, 0.5)
+    assert muestras.huecos == 1
+    # Ventanas completas: días 29..39 y, tras el hueco, 70..99
+    acumulados = [v for meses in muestras.spi[30].values() for v in meses]
+    assert len(acumulados) == 11 + 30
+    assert set(acumulados) == {30.0}
+
+
+def test_ajuste_sin_cuota_reanuda(simulador, almacen, tmp_path, monkeypatch):
+    monkeypatch.setattr(api, 'URL_ARCHIVO', simulador + '/archive')
+    salida = str(tmp_path / 'climatologia.json')
+    argumentos = ['--desde', '2019-01-01', '--hasta', '2019-12-31', '--salida', salida,
+                  '--municipio', 'Chihuahua', '--municipio', 'Delicias', '--espera-cuota', '0']
+
+    # Alcanza para un municipio (un año) y no se recarga
+    monkeypatch.setattr(api, 'PRESUPUESTO', limite_open_meteo.CuboFichas(
+        capacidad=30, por_segundo=1e-6, espera_maxima=0))
+    assert climatologia.main_cli(argumentos) == 1
+    clima = Climatologia(salida)
+    assert clima.parametros('Chihuahua') is not None  # se guardó al terminar
+    assert clima.parametros('Delicias') is None
+
+    # La siguiente corrida sólo ajusta (y descarga) el que faltó
+    monkeypatch.setattr(api, 'PRESUPUESTO', limite_open_meteo.CuboFichas(
+        capacidad=30, por_segundo=1e-6, espera_maxima=0))
+    assert climatologia.main_cli(argumentos) == 0
+    assert clima.parametros('Delicias')["periodo"] == {'desde': '2019-01-01', 'hasta': '2019-12-31'}
@@ -0,0 +1,48 @@
+"""Archivo de instantáneas compartido entre workers."""
+import os
+import time
+
+import pytest
+
+import instantanea_compartida
+from instantanea_compartida import CandadoEscritor, InstantaneaCompartida, escribir
+
+CUERPO = {
+    "success": True,
+    "municipio": "Chihuahua",
+    "indice_sequia": 61.2,
+    "series": {
+        "fechas": ["2024-01-01", "2024-01-02", "2024-01-03"],
+        "lluvia_mm": [0.0, 1.5, 3.25],
+        "temperatura_c": [12.0, 13.5, 11.0],
+    },
+}
+
+
+def test_lectura(tmp_path):
+    ruta = str(tmp_path / 'instantaneas.bin')
+    escribir(ruta, {"Chihuahua": CUERPO})
+    lector = InstantaneaCompartida(ruta)
+    assert lector.obtener("Chihuahua") == CUERPO
+    assert lector.obtener("Juárez") is None
+
+
+def test_edad_maxima(tmp_path):
+    ruta = str(tmp_path / 'instantaneas.bin')
+    escribir(ruta, {"Chihuahua": CUERPO}, marca_tiempo=time.time() - 120)
+    assert InstantaneaCompartida(ruta, edad_maxima=60).obtener("Chihuahua") is None
+    assert InstantaneaCompartida(ruta, edad_maxima=600).obtener("Chihuahua") == CUERPO
+
+
+@pytest.mark.skipif(instantanea_compartida.fcntl is None, reason="sin fcntl no hay candado")
+def test_un_solo_escritor(tmp_path):
+    ruta = str(tmp_path / 'instantaneas.bin')
+    primero, segundo = CandadoEscritor(ruta), CandadoEscritor(ruta)
+    assert primero.tomar()
+    assert primero.tomar()  # sigue siendo el escritor
+    assert not segundo.tomar()
+    assert os.path.exists(ruta + '.lock')
+
+    # Al cerrarse el escritor (p. ej. el worker muere) otro toma su lugar
+    primero._archivo.close()
+    assert segundo.tomar()
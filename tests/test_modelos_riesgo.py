@@ -0,0 +1,99 @@
+"""Entrenamiento por municipio y versiones del modelo de riesgo."""
+import os
+from datetime import date
+
+import pytest
+
+import api
+import limite_open_meteo
+import modelos_riesgo
+from modelos_riesgo import ModelosRiesgo
+
+
+@pytest.fixture
+def archivo(simulador, almacen, monkeypatch):
+    monkeypatch.setattr(api, 'URL_ARCHIVO', simulador + '/archive')
+
+
+def test_sin_cuota_no_publica_y_reanuda(archivo, tmp_path, monkeypatch):
+    directorio = str(tmp_path / 'modelos')
+    argumentos = ['--desde', '2019-01-01', '--hasta', '2019-12-31', '--directorio', directorio,
+                  '--municipio', 'Chihuahua', '--municipio', 'Delicias', '--espera-cuota', '0']
+
+    # Alcanza para un municipio (un año) y no se recarga
+    monkeypatch.setattr(api, 'PRESUPUESTO', limite_open_meteo.CuboFichas(
+        capacidad=30, por_segundo=1e-6, espera_maxima=0))
+    assert modelos_riesgo.main_cli(argumentos) == 1
+    modelos = ModelosRiesgo(directorio)
+    assert modelos.versiones() == []
+    progreso = modelos_riesgo.Progreso(directorio, date(2019, 1, 1), date(2019, 12, 31))
+    assert list(progreso.municipios) == ['Chihuahua']
+
+    # La siguiente corrida sólo entrena el que faltó y publica los dos
+    monkeypatch.setattr(api, 'PRESUPUESTO', limite_open_meteo.CuboFichas(
+        capacidad=30, por_segundo=1e-6, espera_maxima=0))
+    assert modelos_riesgo.main_cli(argumentos) == 0
+    assert len(modelos.versiones()) == 1
+    assert set(modelos.municipios()) == {'Chihuahua', 'Delicias'}
+    assert not os.path.exists(progreso.ruta)
+
+
+COEFICIENTES = {
+    "estadistico": {"beta0": 0.9, "beta1": -0.02},
+    "algebra": {"precipitacion": -0.015, "temperatura": 0.01, "intercepto": 0.4},
+}
+
+
+@pytest.fixture
+def cliente(archivo, tmp_path, monkeypatch):
+    """Cliente de la API con un directorio de modelos vacío."""
+    monkeypatch.setattr(api, 'MODELOS', ModelosRiesgo(str(tmp_path / 'modelos')))
+    return api.app.test_client()
+
+
+def _modelo(cliente, consulta=''):
+    # Con `ventana` se calcula en la petición en lugar de salir de la
+    # instantánea (que toma la versión nueva al vencer)
+    r = cliente.get('/api/analizar?municipio=Chihuahua&ventana=30' + consulta)
+    assert r.status_code == 200
+    return r.get_json()["modelo"]
+
+
+def test_publicar_y_activar_sin_reiniciar(cliente):
+    assert _modelo(cliente)["version_modelo"] is None  # sin modelo: ajuste en línea
+
+    # Otro proceso (el comando de entrenamiento) publica: la API lo toma en la siguiente consulta
+    publicador = ModelosRiesgo(api.MODELOS.directorio)
+    primera = publicador.publicar({"Chihuahua": COEFICIENTES})
+    modelo = _modelo(cliente)
+    assert modelo["version_modelo"] == primera
+
+    segunda = publicador.publicar({"Chihuahua": dict(COEFICIENTES, algebra=dict(COEFICIENTES["algebra"], intercepto=0.9))})
+    assert segunda != primera
+    nuevo = _modelo(cliente)
+    assert nuevo["version_modelo"] == segunda
+    assert nuevo["riesgo_modelo"] != modelo["riesgo_modelo"]
+
+    # Regresar a la versión anterior también se toma sin reiniciar
+    publicador.activar(primera)
+    assert _modelo(cliente) == modelo
+
+
+def test_marg_explicito_ajusta_en_linea(cliente):
+    ModelosRiesgo(api.MODELOS.directorio).publicar({"Chihuahua": COEFICIENTES})
+    entrenado = _modelo(cliente)
+    assert entrenado["version_modelo"] is not None
+
+    # Con marg el modelo entrenado (que no la usa) se deja de lado
+    datos, _ = api._datos_con_historia('Chihuahua')
+    en_linea = api.calcular_riesgo_modelo(
+        api._mean(datos["precipitacion"]), api._mean(datos["temperatura"]), marg=0.8,
+        historia={'precipitacion': datos["precipitacion"], 'temperatura': datos["temperatura"]})
+    modelo = _modelo(cliente, '&marg=0.8')
+    assert modelo["version_modelo"] is None
+    assert modelo["riesgo_modelo"] == round(en_linea["riesgo"] * 100, 1)
+    assert modelo["riesgo_modelo"] != entrenado["riesgo_modelo"]
+
+    # Con 90 días de historia la marginación es una columna constante que
+    # absorbe el intercepto: deliberadamente no cambia el riesgo
+    assert _modelo(cliente, '&marg=0.2')["riesgo_modelo"] == modelo["riesgo_modelo"]
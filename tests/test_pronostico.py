@@ -0,0 +1,105 @@
+"""/api/pronostico contra el simulador de Open-Meteo."""
+import time
+from datetime import date, timedelta
+
+import pytest
+import requests
+
+import api
+import stub_open_meteo
+
+
+@pytest.fixture
+def cliente(simulador, almacen, monkeypatch):
+    """Cliente de la API contra el simulador, con almacén y pronósticos vacíos.
+    `cliente.llamadas` registra las rutas pedidas a Open-Meteo."""
+    monkeypatch.setattr(api, 'URL_ARCHIVO', simulador + '/archive')
+    monkeypatch.setattr(api, 'URL_PRONOSTICO', simulador + '/forecast')
+    monkeypatch.setattr(api.PRONOSTICOS, '_datos', {})
+    monkeypatch.setattr(api.PRESUPUESTO, 'espera_maxima', 0.0)
+    llamadas = []
+    get_original = requests.get
+
+    def _get(url, *args, **kwargs):
+        llamadas.append(url.rsplit('/', 1)[-1])
+        return get_original(url, *args, **kwargs)
+
+    monkeypatch.setattr(requests, 'get', _get)
+    cliente = api.app.test_client()
+    cliente.llamadas = llamadas
+    return cliente
+
+
+def _esperar(condicion, limite=5.0):
+    fin = time.monotonic() + limite
+    while not condicion():
+        if time.monotonic() > fin:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_une_archivo_y_pronostico(cliente):
+    r = cliente.get('/api/pronostico?municipio=Chihuahua')
+    assert r.status_code == 200
+    cuerpo = r.get_json()
+    series = cuerpo["series"]
+    fechas = series["fechas"]
+    dias_archivo = series["dias_archivo"]
+
+    # Los días del archivo son los de /api/analizar, sin repetir ni saltar fechas
+    inicio, fin = api._rango_fechas(90)
+    assert fechas[:dias_archivo] == [(inicio + timedelta(days=i)).isoformat() for i in range(dias_archivo)]
+    assert fechas[dias_archivo - 1] == fin.isoformat()
+    consecutivas = [date.fromisoformat(f) for f in fechas]
+    assert all((b - a).days == 1 for a, b in zip(consecutivas, consecutivas[1:]))
+
+    # Lo que sigue sale del pronóstico del simulador para la celda del municipio
+    celda = api._agrupar_por_celda([api.MUNICIPIOS["Chihuahua"]])[0][0]
+    esperado = stub_open_meteo.bloque_diario(celda["lat"], celda["lon"],
+                                             date.fromisoformat(fechas[dias_archivo]),
+                                             date.fromisoformat(fechas[-1]))
+    assert fechas[dias_archivo:] == esperado["time"]
+    assert series["lluvia_mm"][dias_archivo:] == esperado["precipitation_sum"]
+    assert series["temperatura_c"][dias_archivo:] == esperado["temperature_2m_mean"]
+    assert len(series["riesgo_diario"]) == len(fechas)
+
+
+def test_horizonte_maximo_16_dias(cliente):
+    cuerpo = cliente.get('/api/pronostico?municipio=Juárez').get_json()
+    horizonte = cuerpo["horizonte"]
+    assert 0 < horizonte["dias"] <= api.DIAS_PRONOSTICO
+    assert horizonte["dias"] == len(cuerpo["series"]["fechas"]) - cuerpo["series"]["dias_archivo"]
+    assert horizonte["desde"] == cuerpo["series"]["fechas"][cuerpo["series"]["dias_archivo"]]
+    assert horizonte["hasta"] == (date.today() + timedelta(days=api.DIAS_PRONOSTICO - 1)).isoformat()
+
+
+def test_ttl_del_pronostico_separado_del_archivo(cliente, monkeypatch):
+    assert cliente.get('/api/pronostico?municipio=Delicias').status_code == 200
+    assert sorted(cliente.llamadas) == ['archive', 'forecast']
+
+    # Dentro del TTL no se pide nada
+    del cliente.llamadas[:]
+    assert cliente.get('/api/pronostico?municipio=Delicias').status_code == 200
+    assert cliente.llamadas == []
+
+    # Vencido el pronóstico se vuelve a pedir (en segundo plano); el archivo
+    # sigue saliendo del almacén local
+    generado = api.PRONOSTICOS.obtener('Delicias')['marca_tiempo']
+    monkeypatch.setattr(api.PRONOSTICOS, 'ttl', 0.0)
+    assert cliente.get('/api/pronostico?municipio=Delicias').status_code == 200
+    assert _esperar(lambda: api.PRONOSTICOS._datos['Delicias']['marca_tiempo'] > generado)
+    assert cliente.llamadas == ['forecast']
+
+    # Y el archivo no depende del TTL del pronóstico
+    assert api.obtener_datos_meteo('Delicias')["fechas"][-1] == api._rango_fechas(90)[1].isoformat()
+    assert cliente.llamadas == ['forecast']
+
+
+def test_503_sin_pronostico(cliente, simulador, monkeypatch):
+    monkeypatch.setattr(api, 'URL_PRONOSTICO', simulador + '/no-existe')
+    r = cliente.get('/api/pronostico?municipio=Hidalgo del Parral')
+    assert r.status_code == 503
+    assert 'Pronóstico no disponible' in r.get_json()["error"]
+    # El archivo sí se descargó y queda guardado
+    assert 'archive' in cliente.llamadas
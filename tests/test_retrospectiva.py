@@ -0,0 +1,145 @@
+"""Reproducción diaria de retrospectiva.py contra el cálculo ventana por ventana."""
+import json
+import random
+from datetime import date, timedelta
+
+import pytest
+
+import api
+import limite_open_meteo
+import retrospectiva
+from analisis_sequia import calcular_riesgo_modelo, riesgo_con_coeficientes
+
+TOLERANCIA = 1e-15
+
+COEFICIENTES = {
+    "estadistico": {"beta0": 0.9, "beta1": -0.02},
+    "algebra": {"precipitacion": -0.015, "temperatura": 0.01, "intercepto": 0.4},
+}
+
+
+def _serie(dias, inicio=date(2010, 1, 1), semilla=7, sin=()):
+    """Serie diaria sintética; `sin` son las posiciones de los días faltantes."""
+    azar = random.Random(semilla)
+    serie = {"fechas": [], "precipitacion": [], "temperatura": [], "evapotranspiracion": []}
+    for i in range(dias):
+        if i in sin:
+            continue
+        serie["fechas"].append((inicio + timedelta(days=i)).isoformat())
+        serie["precipitacion"].append(max(0.0, azar.gauss(15, 15)))
+        serie["temperatura"].append(azar.gauss(22, 6))
+        serie["evapotranspiracion"].append(azar.gauss(4, 1))
+    return serie
+
+
+def _ingenua(serie, ventana, marg=None, coeficientes=None):
+    """Lo que habría respondido /api/analizar cada día: índice y riesgo
+    recalculados sobre la ventana de días consecutivos que termina en él."""
+    fechas = [date.fromisoformat(f) for f in serie["fechas"]]
+    resultado = {"fechas": [], "indice": [], "riesgo": []}
+    for fin in range(ventana - 1, len(fechas)):
+        inicio = fin - ventana + 1
+        if (fechas[fin] - fechas[inicio]).days != ventana - 1:
+            continue  # la ventana cruza un hueco
+        p = serie["precipitacion"][inicio:fin + 1]
+        t = serie["temperatura"][inicio:fin + 1]
+        e = serie["evapotranspiracion"][inicio:fin + 1]
+        indice, _ = api.calcular_indice_sequia(p, t, e)
+        if coeficientes is None:
+            riesgo = calcular_riesgo_modelo(sum(p) / ventana, sum(t) / ventana, marg,
+                                            historia={'precipitacion': p, 'temperatura': t})
+        else:
+            riesgo = riesgo_con_coeficientes(coeficientes, sum(p) / ventana, sum(t) / ventana,
+                                             historia={'precipitacion': p})
+        resultado["fechas"].append(serie["fechas"][fin])
+        resultado["indice"].append(indice)
+        resultado["riesgo"].append(riesgo["riesgo"])
+    return resultado
+
+
+def _comparar(obtenido, esperado):
+    assert obtenido["fechas"] == esperado["fechas"]
+    assert obtenido["indice"] == pytest.approx(esperado["indice"], rel=0, abs=TOLERANCIA)
+    assert obtenido["riesgo"] == pytest.approx(esperado["riesgo"], rel=0, abs=TOLERANCIA)
+
+
+@pytest.mark.parametrize("ventana", [2, 31, 91])
+def test_igual_a_la_reproduccion_ingenua(ventana):
+    # Más de RECONSTRUIR días, para cruzar al menos una reconstrucción de las sumas
+    serie = _serie(2 * retrospectiva.RECONSTRUIR + 50)
+    _comparar(retrospectiva.reproducir(serie, ventana), _ingenua(serie, ventana))
+
+
+@pytest.mark.parametrize("ventana", [2, 91])
+def test_sequia_prolongada(ventana):
+    # Semanas sin lluvia tras días lluviosos: max == min en la ventana, donde
+    # el residuo de una suma deslizante se dividiría entre 1e-10
+    serie = _serie(700, semilla=5)
+    serie["precipitacion"][200:500] = [0.0] * 300
+    _comparar(retrospectiva.reproducir(serie, ventana), _ingenua(serie, ventana))
+
+
+def test_marginacion():
+    serie = _serie(400, semilla=3)
+    _comparar(retrospectiva.reproducir(serie, 91, marg=0.8), _ingenua(serie, 91, marg=0.8))
+
+
+def test_coeficientes_entrenados():
+    serie = _serie(500, semilla=11)
+    _comparar(retrospectiva.reproducir(serie, 91, coeficientes=COEFICIENTES),
+              _ingenua(serie, 91, coeficientes=COEFICIENTES))
+
+
+def test_huecos_reinician_la_ventana():
+    serie = _serie(600, sin={100, 101, 102, 350})
+    resultado = retrospectiva.reproducir(serie, 91)
+    _comparar(resultado, _ingenua(serie, 91))
+    assert resultado["huecos"] == 2
+    # Tras cada hueco no hay resultados hasta volver a llenar la ventana
+    assert "2010-04-14" not in resultado["fechas"]  # primer día tras el hueco: la ventana tiene 1 día
+    assert (date(2010, 1, 1) + timedelta(days=103 + 90)).isoformat() in resultado["fechas"]
+
+
+def test_desde():
+    serie = _serie(300)
+    resultado = retrospectiva.reproducir(serie, 91, desde="2010-06-01")
+    esperado = _ingenua(serie, 91)
+    desde = esperado["fechas"].index("2010-06-01")
+    _comparar(resultado, {c: v[desde:] for c, v in esperado.items()})
+
+
+@pytest.fixture
+def archivo(simulador, almacen, monkeypatch):
+    monkeypatch.setattr(api, 'URL_ARCHIVO', simulador + '/archive')
+
+
+ARGUMENTOS = ['--desde', '2019-01-01', '--hasta', '2019-12-31', '--procesos', '1',
+              '--municipio', 'Chihuahua', '--municipio', 'Delicias', '--json']
+
+
+def test_json_limpio_en_stdout(archivo, capsys):
+    assert retrospectiva.main_cli(ARGUMENTOS) == 0
+    salida = capsys.readouterr()
+    reporte = json.loads(salida.out)
+    assert reporte["municipios"] == 2
+    assert reporte["errores"] == {}
+    assert reporte["dias_evaluados"] == 2 * 365
+    assert "[API]" in salida.err
+
+
+def test_sin_cuota_falla_y_reanuda(archivo, capsys, monkeypatch):
+    # Alcanza para un municipio (dos bloques anuales) y no se recarga
+    monkeypatch.setattr(api, 'PRESUPUESTO', limite_open_meteo.CuboFichas(
+        capacidad=60, por_segundo=1e-6, espera_maxima=0))
+    argumentos = ARGUMENTOS + ['--concurrencia', '1', '--espera-cuota', '0']
+    assert retrospectiva.main_cli(argumentos) == 1
+    reporte = json.loads(capsys.readouterr().out)
+    assert reporte["municipios"] == 1
+    assert list(reporte["errores"]) and "Cuota" in next(iter(reporte["errores"].values()))
+
+    # La siguiente corrida sólo descarga lo que faltó
+    monkeypatch.setattr(api, 'PRESUPUESTO', limite_open_meteo.CuboFichas(
+        capacidad=60, por_segundo=1e-6, espera_maxima=0))
+    assert retrospectiva.main_cli(argumentos) == 0
+    reporte = json.loads(capsys.readouterr().out)
+    assert reporte["municipios"] == 2 and reporte["errores"] == {}
@@ -0,0 +1,86 @@
+"""Series largas: submuestreo LTTB para las gráficas y NDJSON en flujo."""
+import json
+import random
+from datetime import date, timedelta
+
+import pytest
+
+import api
+from submuestreo import lttb_indices, submuestrear_series
+
+PUNTOS = 500
+
+
+@pytest.fixture
+def cliente(simulador, almacen, monkeypatch):
+    monkeypatch.setattr(api, 'URL_ARCHIVO', simulador + '/archive')
+    return api.app.test_client()
+
+
+def test_lttb_conserva_extremos_y_picos():
+    azar = random.Random(3)
+    valores = [azar.random() for _ in range(5000)]
+    valores[1234] = 100.0
+    indices = lttb_indices(valores, PUNTOS)
+    assert len(indices) == PUNTOS
+    assert indices[0] == 0 and indices[-1] == len(valores) - 1
+    assert 1234 in indices
+
+
+def test_columnas_comparten_fechas():
+    fechas = [(date(2000, 1, 1) + timedelta(days=i)).isoformat() for i in range(3000)]
+    series = {"fechas": fechas, "lluvia_mm": [float(i % 37) for i in range(3000)],
+              "indice_movil": {"30": [float(i % 11) for i in range(3000)]}}
+    reducida = submuestrear_series(series, PUNTOS)
+    assert len(reducida["fechas"]) <= PUNTOS
+    assert len(reducida["lluvia_mm"]) == len(reducida["indice_movil"]["30"]) == len(reducida["fechas"])
+    assert reducida["fechas"] == sorted(reducida["fechas"])
+
+
+def test_analizar_ventana_larga_acotada(cliente):
+    base = '/api/analizar?municipio=Chihuahua&marg=0.5'
+    completa = cliente.get(f'{base}&dias=3650')
+    larga = cliente.get(f'{base}&dias=3650&puntos={PUNTOS}')
+    anual = cliente.get(f'{base}&dias=365&puntos={PUNTOS}')
+    assert completa.status_code == larga.status_code == anual.status_code == 200
+
+    cuerpo = larga.get_json()
+    assert len(cuerpo["series"]["fechas"]) <= PUNTOS
+    assert cuerpo["submuestreo"]["dias"] > 3000
+    assert cuerpo["series"]["fechas"][-1] == completa.get_json()["series"]["fechas"][-1]
+    # Diez años pesan lo mismo que uno: el tamaño depende de `puntos`, no de la ventana
+    assert len(larga.data) < 2 * len(anual.data)
+    assert len(larga.data) < len(completa.data) / 4
+
+
+def test_detalle_rango_largo_acotado(cliente):
+    base = '/api/analizar_detalle?municipio=Chihuahua&desde=2015-01-01&hasta=2024-12-31'
+    completa = cliente.get(base).get_json()
+    r = cliente.get(f'{base}&puntos={PUNTOS}')
+    assert r.status_code == 200
+    cuerpo = r.get_json()
+    assert len(cuerpo["fechas"]) <= PUNTOS
+    assert len(cuerpo["precipitacion"]) == len(cuerpo["temperatura"]) == len(cuerpo["fechas"])
+    assert cuerpo["submuestreo"] == {"metodo": "lttb", "puntos": len(cuerpo["fechas"]),
+                                     "dias": len(completa["fechas"])}
+    assert cuerpo["fechas"][0] == completa["fechas"][0] == '2015-01-01'
+    assert cuerpo["fechas"][-1] == completa["fechas"][-1]
+
+
+@pytest.mark.parametrize("consulta", ["puntos=10", "puntos=500&formato=csv", "puntos=500&formato=ndjson"])
+def test_detalle_puntos_invalidos(cliente, consulta):
+    assert cliente.get(f'/api/analizar_detalle?municipio=Chihuahua&{consulta}').status_code == 400
+
+
+def test_detalle_ndjson_un_dia_por_linea(cliente):
+    # El rango cruza un cambio de año: llega en dos bloques anuales
+    desde, hasta = date(2022, 11, 1), date(2023, 2, 28)
+    r = cliente.get(f'/api/analizar_detalle?municipio=Delicias&formato=ndjson'
+                    f'&desde={desde}&hasta={hasta}')
+    assert r.status_code == 200
+    assert r.mimetype == 'application/x-ndjson'
+    lineas = [json.loads(linea) for linea in r.get_data(as_text=True).splitlines()]
+    assert [linea["fecha"] for linea in lineas] == [
+        (desde + timedelta(days=i)).isoformat() for i in range((hasta - desde).days + 1)]
+    assert all(set(linea) == {"fecha", "precipitacion", "temperatura", "evapotranspiracion"}
+               for linea in lineas)